@@ -0,0 +1,177 @@
+"""
+Кэш ответов LLM, адресуемый по содержимому запроса.
+
+Ключ кэша - SHA-256 от (модель, версия промпта, температура, текст запроса).
+Версия промпта вычисляется как хэш текста системного промпта, поэтому любое
+изменение промпта автоматически делает старые записи недоступными.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from apps.enhancer.models import LLMResponseCache
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Как часто (в количестве записей) запускать очистку устаревших записей
+EVICTION_INTERVAL = 100
+
+# Счётчики попаданий и промахов в рамках процесса
+_stats = {"hits": 0, "misses": 0, "writes": 0, "evicted": 0}
+_stats_lock = threading.Lock()
+
+
+def _increment(counter, value=1):
+    with _stats_lock:
+        _stats[counter] += value
+
+
+def prompt_version(prompt):
+    """
+    Возвращает версию промпта - короткий хэш его текста.
+    Args:
+        prompt (str): Текст системного промпта
+    Returns:
+        str: Версия промпта
+    """
+    return hashlib.sha256((prompt or "").encode("utf-8")).hexdigest()[:16]
+
+
+def make_cache_key(model, prompt, temperature, text):
+    """
+    Формирует ключ кэша по модели, версии промпта, температуре и тексту запроса.
+    Args:
+        model (str): Название модели LLM
+        prompt (str): Текст системного промпта
+        temperature (float): Температура генерации
+        text (str): Текст запроса (чанк или JSON для финализации)
+    Returns:
+        str: SHA-256 ключ кэша
+    """
+    payload = json.dumps(
+        [model, prompt_version(prompt), round(float(temperature), 3), text],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_cache_enabled():
+    return getattr(settings, "LLM_CACHE_ENABLED", True)
+
+
+def get_cached_response(key):
+    """
+    Возвращает закэшированный ответ LLM или None при промахе.
+    Args:
+        key (str): Ключ кэша
+    Returns:
+        dict: Ответ LLM или None
+    """
+    if not is_cache_enabled():
+        return None
+
+    try:
+        entry = LLMResponseCache.objects.filter(key=key).only("id", "response", "created_at").first()
+        if entry is None:
+            _increment("misses")
+            return None
+
+        ttl_days = getattr(settings, "LLM_CACHE_TTL_DAYS", 30)
+        if ttl_days and timezone.now() - entry.created_at > timedelta(days=ttl_days):
+            logger.debug(f"Запись кэша LLM {key[:12]} устарела, удаляем")
+            entry.delete()
+            _increment("misses")
+            _increment("evicted")
+            return None
+
+        LLMResponseCache.objects.filter(id=entry.id).update(
+            hits=F("hits") + 1,
+            last_accessed_at=timezone.now(),
+        )
+        _increment("hits")
+        logger.info(f"Попадание в кэш LLM: {key[:12]}")
+        return entry.response
+    except Exception as e:
+        # Ошибка кэша не должна прерывать обработку документа
+        logger.warning(f"Ошибка чтения кэша LLM: {str(e)}")
+        _increment("misses")
+        return None
+
+
+def set_cached_response(key, model, prompt, response):
+    """
+    Сохраняет ответ LLM в кэш.
+    Args:
+        key (str): Ключ кэша
+        model (str): Название модели LLM
+        prompt (str): Текст системного промпта
+        response (dict): Распарсенный ответ LLM
+    """
+    if not is_cache_enabled() or response is None:
+        return
+
+    try:
+        LLMResponseCache.objects.update_or_create(
+            key=key,
+            defaults={
+                "model_name": model,
+                "prompt_version": prompt_version(prompt),
+                "response": response,
+                "last_accessed_at": timezone.now(),
+            },
+        )
+        _increment("writes")
+        with _stats_lock:
+            run_eviction = _stats["writes"] % EVICTION_INTERVAL == 0
+        if run_eviction:
+            evict_cache()
+    except Exception as e:
+        logger.warning(f"Ошибка записи в кэш LLM: {str(e)}")
+
+
+def evict_cache():
+    """
+    Удаляет устаревшие по TTL записи и самые давно использованные записи сверх лимита (LRU).
+    Returns:
+        int: Количество удалённых записей
+    """
+    deleted = 0
+    ttl_days = getattr(settings, "LLM_CACHE_TTL_DAYS", 30)
+    if ttl_days:
+        expired_before = timezone.now() - timedelta(days=ttl_days)
+        deleted += LLMResponseCache.objects.filter(created_at__lt=expired_before).delete()[0]
+
+    max_entries = getattr(settings, "LLM_CACHE_MAX_ENTRIES", 50000)
+    if max_entries:
+        overflow = LLMResponseCache.objects.count() - max_entries
+        if overflow > 0:
+            stale_ids = list(
+                LLMResponseCache.objects.order_by("last_accessed_at").values_list("id", flat=True)[:overflow]
+            )
+            deleted += LLMResponseCache.objects.filter(id__in=stale_ids).delete()[0]
+
+    if deleted:
+        _increment("evicted", deleted)
+        logger.info(f"Очистка кэша LLM: удалено {deleted} записей")
+    return deleted
+
+
+def get_cache_stats():
+    """
+    Возвращает статистику кэша LLM в рамках текущего процесса.
+    Returns:
+        dict: Счётчики hits, misses, writes, evicted и доля попаданий hit_rate
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return stats
@@ -0,0 +1,420 @@
+"""
+Единый интерфейс клиентов LLM (GigaChat, OpenAI, локальная заглушка).
+
+Клиенты создаются лениво, по одному на провайдера в процессе, и переиспользуют
+HTTP-соединения между запросами. Каждый запрос выполняется с таймаутом и
+повторяется с экспоненциальной задержкой со случайным разбросом (jitter) при
+ответах 429/5xx и сетевых ошибках. Перед каждым запросом ограничитель частоты,
+общий для всех воркеров, списывает запрос и токены промпта с квоты учётных данных,
+а после ответа - токены ответа. Провайдер по умолчанию задаётся настройкой LLM_PROVIDER.
+
+Сообщения передаются в формате OpenAI: [{"role": "system" | "user" | "assistant", "content": "..."}].
+"""
+
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+
+import httpx
+from django.conf import settings
+from gigachat import GigaChat
+from gigachat.exceptions import ResponseError
+from gigachat.models import Chat, Messages
+
+from apps.enhancer.LLM.concurrency import _credential_key, acredential_slot, credential_slot
+from apps.enhancer.processing.tokens import count_tokens
+from apps.enhancer.rate_limit import get_rate_limiter
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# HTTP-статусы, при которых запрос повторяется
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+# Максимальная задержка между повторами (сек)
+MAX_RETRY_DELAY = 30.0
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class LLMError(Exception):
+    """Ошибка запроса к LLM"""
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.status_code is None or self.status_code in RETRY_STATUSES
+
+
+def _parse_retry_after(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(attempt, backoff=None, retry_after=None):
+    """
+    Вычисляет задержку перед повтором: экспоненциальная задержка с полным случайным разбросом.
+    Args:
+        attempt (int): Номер попытки (с нуля)
+        backoff (float): Базовая задержка (по умолчанию LLM_RETRY_BACKOFF)
+        retry_after (float): Задержка, запрошенная сервером (заголовок Retry-After)
+    Returns:
+        float: Задержка в секундах
+    """
+    if retry_after is not None:
+        return min(retry_after, MAX_RETRY_DELAY)
+    if backoff is None:
+        backoff = getattr(settings, "LLM_RETRY_BACKOFF", 1.0)
+    return random.uniform(0, min(MAX_RETRY_DELAY, backoff * (2 ** attempt)))
+
+
+class LLMClient:
+    """
+    Базовый клиент LLM. Наследники реализуют _complete и _acomplete (один запрос без повторов).
+    Args:
+        model (str): Название модели
+        timeout (float): Таймаут запроса в секундах (по умолчанию LLM_TIMEOUT)
+        max_retries (int): Количество повторов (по умолчанию LLM_MAX_RETRIES)
+    """
+
+    provider = None
+
+    def __init__(self, model, timeout=None, max_retries=None):
+        self.model = model
+        self.timeout = timeout if timeout is not None else getattr(settings, "LLM_TIMEOUT", 60)
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, "LLM_MAX_RETRIES", 3)
+
+    @property
+    def credential(self):
+        """Учётные данные, по которым ограничиваются частота и число одновременных запросов"""
+        return self.provider
+
+    def rate_limits(self):
+        """
+        Лимиты провайдера в минуту на одни учётные данные.
+        Returns:
+            dict: {"requests": запросов в минуту, "tokens": токенов в минуту} (0 - без ограничения)
+        """
+        return {}
+
+    @property
+    def rate_limiter(self):
+        return get_rate_limiter(f"llm:{self.provider}", self.rate_limits())
+
+    def _acquire_kwargs(self, messages):
+        prompt_tokens = sum(count_tokens(message["content"]) for message in messages)
+        return {"requests": 1, "tokens": prompt_tokens}
+
+    def complete(self, messages, temperature=0.3, max_tokens=None):
+        """
+        Отправляет запрос к LLM и возвращает текст ответа.
+        Args:
+            messages (list): Сообщения в формате [{"role": ..., "content": ...}]
+            temperature (float): Температура генерации
+            max_tokens (int): Максимум токенов ответа (по умолчанию LLM_MAX_OUTPUT_TOKENS)
+        Returns:
+            str: Текст ответа модели
+        Raises:
+            LLMError: Если запрос не удался после всех повторов
+        """
+        max_tokens = max_tokens or getattr(settings, "LLM_MAX_OUTPUT_TOKENS", 2000)
+        rate_key = _credential_key(self.credential)
+        costs = self._acquire_kwargs(messages)
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.rate_limiter.acquire(rate_key, **costs)
+                with credential_slot(self.credential):
+                    result = self._complete(messages, temperature, max_tokens)
+                self.rate_limiter.charge(rate_key, tokens=count_tokens(result))
+                return result
+            except LLMError as e:
+                if not e.retryable or attempt >= self.max_retries:
+                    raise
+                delay = retry_delay(attempt, retry_after=e.retry_after)
+                logger.warning(
+                    f"Ошибка запроса к {self.provider} ({str(e)}), повтор {attempt+1}/{self.max_retries} через {delay:.1f} сек"
+                )
+                time.sleep(delay)
+
+    async def acomplete(self, messages, temperature=0.3, max_tokens=None):
+        """
+        Асинхронный вариант complete.
+        Args:
+            messages (list): Сообщения в формате [{"role": ..., "content": ...}]
+            temperature (float): Температура генерации
+            max_tokens (int): Максимум токенов ответа (по умолчанию LLM_MAX_OUTPUT_TOKENS)
+        Returns:
+            str: Текст ответа модели
+        Raises:
+            LLMError: Если запрос не удался после всех повторов
+        """
+        max_tokens = max_tokens or getattr(settings, "LLM_MAX_OUTPUT_TOKENS", 2000)
+        rate_key = _credential_key(self.credential)
+        costs = self._acquire_kwargs(messages)
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.rate_limiter.aacquire(rate_key, **costs)
+                async with acredential_slot(self.credential):
+                    result = await self._acomplete(messages, temperature, max_tokens)
+                # Списание в Redis - блокирующий сетевой вызов, выполняем его вне цикла событий
+                await asyncio.to_thread(self.rate_limiter.charge, rate_key, tokens=count_tokens(result))
+                return result
+            except LLMError as e:
+                if not e.retryable or attempt >= self.max_retries:
+                    raise
+                delay = retry_delay(attempt, retry_after=e.retry_after)
+                logger.warning(
+                    f"Ошибка запроса к {self.provider} ({str(e)}), повтор {attempt+1}/{self.max_retries} через {delay:.1f} сек"
+                )
+                await asyncio.sleep(delay)
+
+    def _complete(self, messages, temperature, max_tokens):
+        raise NotImplementedError
+
+    async def _acomplete(self, messages, temperature, max_tokens):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+
+class GigaChatClient(LLMClient):
+    """
+    Клиент GigaChat на основе SDK gigachat. SDK хранит HTTP-клиенты и токен доступа,
+    поэтому соединения и авторизация переиспользуются между запросами.
+    """
+
+    provider = "gigachat"
+
+    def __init__(self, credentials=None, model=None, timeout=None, max_retries=None):
+        super().__init__(model or getattr(settings, "GIGACHAT_MODEL", "GigaChat-2-Max"), timeout, max_retries)
+        self._credentials = credentials or getattr(settings, "GIGACHAT_CREDENTIALS", None)
+        self._sdk = None
+        self._sdk_lock = threading.Lock()
+
+    @property
+    def credential(self):
+        return self._credentials
+
+    def rate_limits(self):
+        return {
+            "requests": getattr(settings, "GIGACHAT_REQUESTS_PER_MINUTE", 0),
+            "tokens": getattr(settings, "GIGACHAT_TOKENS_PER_MINUTE", 0),
+        }
+
+    @property
+    def sdk(self):
+        if self._sdk is None:
+            with self._sdk_lock:
+                if self._sdk is None:
+                    self._sdk = GigaChat(
+                        credentials=self._credentials,
+                        verify_ssl_certs=False,
+                        model=self.model,
+                        timeout=self.timeout,
+                    )
+        return self._sdk
+
+    def _payload(self, messages, temperature, max_tokens):
+        return Chat(
+            messages=[Messages(role=message["role"], content=message["content"]) for message in messages],
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+
+    @staticmethod
+    def _wrap_error(error):
+        if isinstance(error, ResponseError) and len(error.args) >= 2:
+            headers = error.args[3] if len(error.args) > 3 else {}
+            return LLMError(
+                f"HTTP {error.args[1]}",
+                status_code=error.args[1],
+                retry_after=_parse_retry_after(headers.get("Retry-After")) if headers else None,
+            )
+        return LLMError(str(error) or error.__class__.__name__)
+
+    def _complete(self, messages, temperature, max_tokens):
+        try:
+            response = self.sdk.chat(self._payload(messages, temperature, max_tokens))
+        except Exception as e:
+            raise self._wrap_error(e) from e
+        return response.choices[0].message.content
+
+    async def _acomplete(self, messages, temperature, max_tokens):
+        try:
+            response = await self.sdk.achat(self._payload(messages, temperature, max_tokens))
+        except Exception as e:
+            raise self._wrap_error(e) from e
+        return response.choices[0].message.content
+
+    def close(self):
+        if self._sdk is not None:
+            self._sdk.close()
+
+    async def aclose(self):
+        if self._sdk is not None:
+            await self._sdk.aclose()
+
+
+class OpenAIClient(LLMClient):
+    """
+    Клиент OpenAI Chat Completions поверх httpx с пулом постоянных соединений.
+    """
+
+    provider = "openai"
+
+    def __init__(self, api_key=None, model=None, base_url=None, timeout=None, max_retries=None):
+        super().__init__(model or getattr(settings, "OPENAI_MODEL", "gpt-4o-mini"), timeout, max_retries)
+        self._api_key = api_key or getattr(settings, "OPENAI_API_KEY", None)
+        self.base_url = (base_url or getattr(settings, "OPENAI_API_BASE", "https://api.openai.com/v1")).rstrip("/")
+        self._client = None
+        # Асинхронный клиент httpx привязан к циклу событий, поэтому у каждого цикла свой клиент
+        self._aclients = {}
+        self._client_lock = threading.Lock()
+
+    @property
+    def credential(self):
+        return self._api_key
+
+    def rate_limits(self):
+        return {
+            "requests": getattr(settings, "OPENAI_REQUESTS_PER_MINUTE", 0),
+            "tokens": getattr(settings, "OPENAI_TOKENS_PER_MINUTE", 0),
+        }
+
+    def _client_kwargs(self):
+        concurrency = getattr(settings, "LLM_MAX_CONCURRENCY", 4)
+        return {
+            "base_url": self.base_url,
+            "headers": {"Authorization": f"Bearer {self._api_key}"},
+            "timeout": httpx.Timeout(self.timeout, connect=min(10.0, self.timeout)),
+            "limits": httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        }
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = httpx.Client(**self._client_kwargs())
+        return self._client
+
+    @property
+    def aclient(self):
+        loop = asyncio.get_running_loop()
+        with self._client_lock:
+            # Клиенты завершённых циклов (например, после asyncio.run) больше не используются
+            for closed_loop in [other for other in self._aclients if other.is_closed()]:
+                del self._aclients[closed_loop]
+            client = self._aclients.get(loop)
+            if client is None:
+                client = self._aclients[loop] = httpx.AsyncClient(**self._client_kwargs())
+            return client
+
+    def _body(self, messages, temperature, max_tokens):
+        return {"model": self.model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+
+    @staticmethod
+    def _parse(response):
+        if response.status_code != 200:
+            raise LLMError(
+                f"HTTP {response.status_code}: {response.text[:200]}",
+                status_code=response.status_code,
+                retry_after=_parse_retry_after(response.headers.get("Retry-After")),
+            )
+        return response.json()["choices"][0]["message"]["content"]
+
+    def _complete(self, messages, temperature, max_tokens):
+        try:
+            response = self.client.post("/chat/completions", json=self._body(messages, temperature, max_tokens))
+        except httpx.HTTPError as e:
+            raise LLMError(f"{e.__class__.__name__}: {str(e)}") from e
+        return self._parse(response)
+
+    async def _acomplete(self, messages, temperature, max_tokens):
+        try:
+            response = await self.aclient.post("/chat/completions", json=self._body(messages, temperature, max_tokens))
+        except httpx.HTTPError as e:
+            raise LLMError(f"{e.__class__.__name__}: {str(e)}") from e
+        return self._parse(response)
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+
+    async def aclose(self):
+        with self._client_lock:
+            client = self._aclients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+class FakeLLMClient(LLMClient):
+    """
+    Локальная заглушка LLM без сетевых запросов (для разработки и тестов).
+    Args:
+        response (str | callable): Фиксированный ответ или функция messages -> str.
+            По умолчанию возвращает JSON с первыми словами последнего сообщения пользователя в keywords.
+    """
+
+    provider = "fake"
+
+    def __init__(self, response=None, model="fake", **kwargs):
+        super().__init__(model, timeout=0, max_retries=0)
+        self.response = response
+        self.calls = []
+
+    def _complete(self, messages, temperature, max_tokens):
+        self.calls.append(messages)
+        if callable(self.response):
+            return self.response(messages)
+        if self.response is not None:
+            return self.response
+        user_text = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        return json.dumps({"keywords": user_text.split()[:5]}, ensure_ascii=False)
+
+    async def _acomplete(self, messages, temperature, max_tokens):
+        return self._complete(messages, temperature, max_tokens)
+
+
+CLIENT_CLASSES = {
+    GigaChatClient.provider: GigaChatClient,
+    OpenAIClient.provider: OpenAIClient,
+    FakeLLMClient.provider: FakeLLMClient,
+}
+
+
+def get_llm_client(provider=None):
+    """
+    Возвращает клиент LLM для провайдера (один экземпляр на процесс).
+    Args:
+        provider (str): "gigachat", "openai" или "fake" (по умолчанию LLM_PROVIDER)
+    Returns:
+        LLMClient: Клиент LLM
+    Raises:
+        ValueError: Если провайдер неизвестен
+    """
+    provider = provider or getattr(settings, "LLM_PROVIDER", "gigachat")
+    with _clients_lock:
+        client = _clients.get(provider)
+        if client is None:
+            client_class = CLIENT_CLASSES.get(provider)
+            if client_class is None:
+                raise ValueError(f"Неизвестный провайдер LLM: {provider}")
+            client = client_class()
+            _clients[provider] = client
+            logger.info(f"Создан клиент LLM {provider} (модель {client.model})")
+        return client
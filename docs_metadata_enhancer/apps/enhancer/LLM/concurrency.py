@@ -0,0 +1,111 @@
+"""
+Ограничение количества одновременных запросов к LLM в рамках процесса воркера:
+семафоры для потоков (credential_slot) и для циклов событий (acredential_slot).
+"""
+
+import asyncio
+import hashlib
+import logging
+import threading
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Семафоры по учётным данным (ключ - хэш учётных данных, а не сами данные)
+_credential_semaphores = {}
+_semaphores_lock = threading.Lock()
+
+# Асинхронные семафоры по циклам событий: asyncio.Semaphore привязывается к циклу,
+# в котором используется, поэтому для каждого цикла создаются свои
+_async_semaphores = weakref.WeakKeyDictionary()
+
+
+def _credential_key(credential):
+    """
+    Возвращает безопасный ключ для учётных данных, пригодный для логов.
+    Args:
+        credential (str): Учётные данные или API-ключ
+    Returns:
+        str: Короткий хэш учётных данных
+    """
+    return hashlib.sha256((credential or "").encode("utf-8")).hexdigest()[:12]
+
+
+def _concurrency_limit(limit):
+    if limit is None:
+        limit = getattr(settings, "LLM_MAX_CONCURRENCY_PER_CREDENTIAL", 4)
+    return max(1, int(limit))
+
+
+def get_credential_semaphore(credential, limit=None):
+    """
+    Возвращает семафор, ограничивающий число одновременных запросов с одними учётными данными.
+    Args:
+        credential (str): Учётные данные или API-ключ
+        limit (int): Максимум одновременных запросов (по умолчанию LLM_MAX_CONCURRENCY_PER_CREDENTIAL)
+    Returns:
+        threading.BoundedSemaphore: Семафор для учётных данных
+    """
+    key = _credential_key(credential)
+    with _semaphores_lock:
+        semaphore = _credential_semaphores.get(key)
+        if semaphore is None:
+            limit = _concurrency_limit(limit)
+            semaphore = threading.BoundedSemaphore(limit)
+            _credential_semaphores[key] = semaphore
+            logger.debug(f"Создан семафор для учётных данных {key} с лимитом {limit}")
+        return semaphore
+
+
+@contextmanager
+def credential_slot(credential, limit=None):
+    """
+    Контекстный менеджер, занимающий слот для запроса с указанными учётными данными.
+    Args:
+        credential (str): Учётные данные или API-ключ
+        limit (int): Максимум одновременных запросов
+    """
+    semaphore = get_credential_semaphore(credential, limit)
+    semaphore.acquire()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+def get_async_credential_semaphore(credential, limit=None):
+    """
+    Возвращает асинхронный семафор для учётных данных в текущем цикле событий.
+    Args:
+        credential (str): Учётные данные или API-ключ
+        limit (int): Максимум одновременных запросов (по умолчанию LLM_MAX_CONCURRENCY_PER_CREDENTIAL)
+    Returns:
+        asyncio.BoundedSemaphore: Семафор для учётных данных
+    """
+    key = _credential_key(credential)
+    loop = asyncio.get_running_loop()
+    with _semaphores_lock:
+        semaphores = _async_semaphores.setdefault(loop, {})
+        semaphore = semaphores.get(key)
+        if semaphore is None:
+            limit = _concurrency_limit(limit)
+            semaphore = asyncio.BoundedSemaphore(limit)
+            semaphores[key] = semaphore
+            logger.debug(f"Создан асинхронный семафор для учётных данных {key} с лимитом {limit}")
+        return semaphore
+
+
+@asynccontextmanager
+async def acredential_slot(credential, limit=None):
+    """
+    Асинхронный вариант credential_slot для запросов из цикла событий.
+    Args:
+        credential (str): Учётные данные или API-ключ
+        limit (int): Максимум одновременных запросов
+    """
+    async with get_async_credential_semaphore(credential, limit):
+        yield
@@ -0,0 +1,130 @@
+"""
+Извлечение и финализация сущностей с помощью LLM, не зависящие от провайдера.
+Провайдер выбирается настройкой LLM_PROVIDER или передаётся явно через client.
+Невалидный JSON сначала исправляется локально и только при неудаче - повторным запросом к LLM.
+"""
+
+import json
+import logging
+
+from apps.enhancer.LLM.cache import get_cached_response, make_cache_key, set_cached_response
+from apps.enhancer.LLM.client import LLMError, get_llm_client
+from apps.enhancer.LLM.prompts.ner_prompt import finalize_prompt, ner_prompt_3
+from apps.enhancer.processing.json_repair import METADATA_SCHEMA, parse_llm_json, record_repair
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+LLM_TEMPERATURE = 0.3
+
+
+def extract_entities(text, client=None, raise_retryable=False):
+    """
+    Извлекает сущности из текста с помощью LLM.
+    Args:
+        text (str): Текст для обработки
+        client (LLMClient): Клиент LLM (по умолчанию get_llm_client())
+        raise_retryable (bool): Пробрасывать временные ошибки LLM (429/5xx, сеть) после
+            исчерпания повторов клиента, чтобы вызывающая задача могла повториться позже
+    Returns:
+        dict: Извлеченные сущности в формате JSON или None
+    Raises:
+        LLMError: Временная ошибка LLM, если raise_retryable
+    """
+    client = client or get_llm_client()
+    try:
+        cache_key = make_cache_key(client.model, ner_prompt_3, LLM_TEMPERATURE, text)
+        cached_result = get_cached_response(cache_key)
+        if cached_result is not None:
+            return cached_result
+
+        result = client.complete(
+            [
+                {"role": "system", "content": ner_prompt_3},
+                {"role": "user", "content": text},
+            ],
+            temperature=LLM_TEMPERATURE,
+        )
+        parsed_result = parse_llm_json(result, METADATA_SCHEMA)
+
+        if parsed_result is None:
+            logger.warning("Попытка исправить невалидный JSON...")
+            parsed_result = fix_json_response(ner_prompt_3, result, client)
+
+        set_cached_response(cache_key, client.model, ner_prompt_3, parsed_result)
+        return parsed_result
+    except Exception as e:
+        logger.error(f"Ошибка обработки текста с {client.provider}: {str(e)}")
+        if raise_retryable and isinstance(e, LLMError) and e.retryable:
+            raise
+        return None
+
+
+def fix_json_response(system_prompt, invalid_response, client=None):
+    """
+    Запрашивает у LLM исправление невалидного JSON, который не удалось исправить локально.
+    Args:
+        system_prompt (str): Системный промпт для задачи
+        invalid_response (str): Невалидный ответ
+        client (LLMClient): Клиент LLM (по умолчанию get_llm_client())
+    Returns:
+        dict: Исправленный JSON или None
+    """
+    client = client or get_llm_client()
+    fix_prompt = (
+        f"Ответ не является валидным JSON. Перепишите его в правильном формате JSON. "
+        f"Исходный ответ: {invalid_response}"
+    )
+    try:
+        fixed_result = client.complete(
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": fix_prompt},
+            ],
+            temperature=LLM_TEMPERATURE,
+        )
+        parsed_result = parse_llm_json(fixed_result, METADATA_SCHEMA, record=False)
+        record_repair("remote" if parsed_result is not None else "failed")
+        return parsed_result
+    except Exception as e:
+        logger.error(f"Ошибка при исправлении JSON: {str(e)}")
+        record_repair("failed")
+        return None
+
+
+def finalize_entities(merged_entities, client=None):
+    """
+    Отправляет объединённые сущности в LLM для финальной обработки, удаления дубликатов и выделения основной информации.
+    Args:
+        merged_entities (dict): Объединённые сущности из всех чанков
+        client (LLMClient): Клиент LLM (по умолчанию get_llm_client())
+    Returns:
+        dict: Финальный JSON с обработанными сущностями или None
+    """
+    client = client or get_llm_client()
+    try:
+        input_json = json.dumps(merged_entities, ensure_ascii=False)
+        cache_key = make_cache_key(client.model, finalize_prompt, LLM_TEMPERATURE, input_json)
+        cached_result = get_cached_response(cache_key)
+        if cached_result is not None:
+            return cached_result
+
+        result = client.complete(
+            [
+                {"role": "system", "content": finalize_prompt},
+                {"role": "user", "content": input_json},
+                {"role": "user", "content": "Обработайте входной JSON и верните результат."},
+            ],
+            temperature=LLM_TEMPERATURE,
+        )
+        parsed_result = parse_llm_json(result, METADATA_SCHEMA)
+
+        if parsed_result is None:
+            logger.warning("Попытка исправить невалидный JSON в финальной обработке...")
+            parsed_result = fix_json_response(finalize_prompt, result, client)
+
+        set_cached_response(cache_key, client.model, finalize_prompt, parsed_result)
+        return parsed_result
+    except Exception as e:
+        logger.error(f"Ошибка финальной обработки сущностей: {str(e)}")
+        return None
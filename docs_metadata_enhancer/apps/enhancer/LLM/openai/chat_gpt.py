@@ -1,15 +1,14 @@
 
 import json
+import logging
 
-
-from docs_metadata_enhancer.settings import OPENAI_API_KEY
-
-import openai
-from apps.enhancer.processing.utils import validate_json
+from apps.enhancer.LLM.client import get_llm_client
+from apps.enhancer.processing.json_repair import parse_llm_json, record_repair
 from apps.enhancer.LLM.prompts.ner_prompt import ner_prompt_2
 from apps.enhancer.LLM.prompts.ner_prompt import ner_prompt
 
-openai.api_key = OPENAI_API_KEY
+# Настройка логирования
+logger = logging.getLogger(__name__)
 
 def process_text_with_chatgpt(text):
     """
@@ -20,9 +19,8 @@ def process_text_with_chatgpt(text):
         dict: Извлеченные сущности в формате JSON или None
     """
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[
+        result = get_llm_client("openai").complete(
+            [
                 {"role": "system", "content": ner_prompt_2},
                 {"role": "user", "content": text},
                 {"role": "assistant", "content": ""}
@@ -30,18 +28,17 @@ def process_text_with_chatgpt(text):
             temperature=0.3
         )
         
-        result = response['choices'][0]['message']['content']
-        parsed_result = validate_json(result)
+        parsed_result = parse_llm_json(result)
         
         # Если JSON невалиден, пробуем исправить
         if parsed_result is None:
-            print("Попытка исправить невалидный JSON...")
+            logger.warning("Попытка исправить невалидный JSON...")
             parsed_result = fix_json_response(text, result)
         
         return parsed_result
     
     except Exception as e:
-        print(f"Ошибка обработки текста с ChatGPT: {e}")
+        logger.error(f"Ошибка обработки текста с ChatGPT: {str(e)}")
         return None
     
     
@@ -59,9 +56,8 @@ def fix_json_response(original_text, invalid_response):
         f"Исходный ответ: {invalid_response}"
     )
     try:
-        fix_response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[
+        fixed_result = get_llm_client("openai").complete(
+            [
                 {"role": "system", "content": ner_prompt},
                 {"role": "user", "content": original_text},
                 {"role": "assistant", "content": invalid_response},
@@ -69,10 +65,12 @@ def fix_json_response(original_text, invalid_response):
             ],
             temperature=0.3
         )
-        fixed_result = fix_response['choices'][0]['message']['content']
-        return validate_json(fixed_result)  # Повторная проверка
+        parsed_result = parse_llm_json(fixed_result, record=False)  # Повторная проверка
+        record_repair("remote" if parsed_result is not None else "failed")
+        return parsed_result
     except Exception as e:
-        print(f"Ошибка при исправлении JSON: {e}")
+        logger.error(f"Ошибка при исправлении JSON: {str(e)}")
+        record_repair("failed")
         return None
     
     
@@ -110,25 +108,22 @@ def finalize_entities(merged_entities):
     try:
         # Преобразуем merged_entities в строку JSON для отправки
         input_json = json.dumps(merged_entities, ensure_ascii=False)
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[
+        result = get_llm_client("openai").complete(
+            [
                 {"role": "system", "content": final_prompt},
                 {"role": "user", "content": input_json},
                 {"role": "user", "content": "Обработайте входной JSON и верните результат."}
             ],
             temperature=0.3
         )
-        
-        result = response['choices'][0]['message']['content']
-        parsed_result = validate_json(result)
+        parsed_result = parse_llm_json(result)
         
         if parsed_result is None:
-            print("Попытка исправить невалидный JSON в финальной обработке...")
+            logger.warning("Попытка исправить невалидный JSON в финальной обработке...")
             parsed_result = fix_json_response("", result)
         
         return parsed_result
     
     except Exception as e:
-        print(f"Ошибка финальной обработки сущностей: {e}")
+        logger.error(f"Ошибка финальной обработки сущностей: {str(e)}")
         return None
\ No newline at end of file
@@ -251,4 +251,35 @@ ner_prompt_3 = """Вы — эксперт по распознаванию име
 }
 
 Теперь обработайте следующий текст и верните результат строго в формате JSON, без дополнительного текста:
-"""
\ No newline at end of file
+"""
+
+finalize_prompt = """
+    Вы — эксперт по обработке и агрегации данных. Ваша задача — обработать JSON с сущностями, извлечёнными из текста (вероятно, из нескольких фрагментов и предыдущим этапом обработки), удалить дубликаты, выбрать наиболее релевантную информацию и оставить только основные данные. Верните результат в формате JSON, строго соответствующем следующей структуре, без дополнительного текста:
+    {
+    "creator": ["Имя создателя 1", ...],
+    "organizations": ["Название организации 1", ...],
+    "publisher": "Название публикующей организации",
+    "title": "Название текста",
+    "keywords": ["ключевое слово 1", "ключевое слово 2", ...],
+    "summary": "краткое описание",
+    "subject": ["предметная область 1", ...],
+    "document_language": "язык документа",
+    "identifier": "идентификатор ресурса (DOI, URL и т.д.)",
+    "contributor": ["контрибьютор 1", ...],
+    "rights": "информация о правах или лицензии",
+    "persons": ["Упомянутая персона 1", ...]
+    }
+
+    Правила:
+    - Для списков (creator, organizations, keywords, subject, contributor, persons) удалите дубликаты. Списки должны содержать уникальные значения.
+    - Для поля keywords оставьте не более пяти-семи наиболее значимых ключевых слов, отражающих главную суть текста.
+    - Для поля title выберите или сгенерируйте одно наиболее полное и точное название, отражающее суть всего текста. Если входной JSON содержит несколько вариантов title из разных фрагментов, объедините их или выберите лучший.
+    - Для поля summary составьте одно краткое, но исчерпывающее описание (2-3 предложения), объединяющее основные аспекты текста без повторов. Если входной JSON содержит несколько summary, синтезируйте из них одно обобщающее.
+    - Для поля publisher выберите одно наиболее релевантное название организации-издателя.
+    - Для поля document_language выберите один язык, наиболее подходящий для всего текста.
+    - Для поля identifier выберите один наиболее релевантный и полный идентификатор (например, DOI предпочтительнее общего URL страницы, если оба присутствуют).
+    - Для поля rights выберите одну наиболее подходящую и полную информацию о правах или лицензии.
+    - Если для какого-то поля информация отсутствует во входном JSON или не может быть однозначно определена, оставьте его пустым (`[]` для списков, `null` или `""` для строк).
+
+    Входной JSON:
+    """
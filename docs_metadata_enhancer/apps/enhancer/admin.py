@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Folder, Document, WikidataEntity, DocumentEntityRelation
+from .models import Folder, Document, WikidataEntity, DocumentEntityRelation, LLMResponseCache, DocumentChunk, WikidataLookupCache, EntityNameIndex, WikidataDumpEntity
 
 @admin.register(Folder)
 class FolderAdmin(admin.ModelAdmin):
@@ -14,7 +14,7 @@ class DocumentAdmin(admin.ModelAdmin):
     list_filter = ('file_type', 'owner', 'created_at')
     search_fields = ('name', 'content')
     ordering = ['-created_at']
-    readonly_fields = ('file_type',)
+    readonly_fields = ('file_type', 'content_hash')
 
 @admin.register(WikidataEntity)
 class WikidataEntityAdmin(admin.ModelAdmin):
@@ -27,3 +27,40 @@ class DocumentEntityRelationAdmin(admin.ModelAdmin):
     list_display = ('document', 'entity', 'field_category', 'name', 'confidence', 'created_at')
     list_filter = ('field_category','created_at')
     search_fields = ('document__name', 'entity__qid', 'entity__label_ru')
+
+@admin.register(LLMResponseCache)
+class LLMResponseCacheAdmin(admin.ModelAdmin):
+    list_display = ('key', 'model_name', 'prompt_version', 'hits', 'created_at', 'last_accessed_at')
+    list_filter = ('model_name', 'prompt_version')
+    search_fields = ('key',)
+    readonly_fields = ('created_at',)
+
+
+@admin.register(DocumentChunk)
+class DocumentChunkAdmin(admin.ModelAdmin):
+    list_display = ('document', 'index', 'chunk_hash', 'prompt_version', 'created_at')
+    list_filter = ('prompt_version',)
+    search_fields = ('document__name', 'chunk_hash')
+    readonly_fields = ('created_at',)
+
+
+@admin.register(WikidataLookupCache)
+class WikidataLookupCacheAdmin(admin.ModelAdmin):
+    list_display = ('namespace', 'lookup', 'status', 'value', 'created_at', 'expires_at')
+    list_filter = ('namespace', 'status')
+    search_fields = ('lookup',)
+    readonly_fields = ('created_at',)
+
+
+@admin.register(EntityNameIndex)
+class EntityNameIndexAdmin(admin.ModelAdmin):
+    list_display = ('normalized_name', 'entity_type', 'qid', 'usage_count', 'last_used_at')
+    list_filter = ('entity_type',)
+    search_fields = ('normalized_name', 'qid')
+    readonly_fields = ('created_at',)
+
+
+@admin.register(WikidataDumpEntity)
+class WikidataDumpEntityAdmin(admin.ModelAdmin):
+    list_display = ('qid', 'label_ru', 'label_en', 'types', 'sitelinks')
+    search_fields = ('qid', 'label_ru', 'label_en')
@@ -2,8 +2,8 @@
 Модуль загрузчиков документов для приложения Enhancer
 """
 
-from .document_loader import load_document
-from .pdf_loader import load_pdf
+from .document_loader import iter_document, load_document
+from .pdf_loader import iter_pdf_pages, load_pdf
 from .docx_loader import load_docx
 from .doc_loader import load_doc
 from .txt_loader import load_txt
@@ -11,7 +11,9 @@ from .rtf_loader import load_rtf
 
 __all__ = [
     'load_document',
+    'iter_document',
     'load_pdf',
+    'iter_pdf_pages',
     'load_docx',
     'load_doc',
     'load_txt',
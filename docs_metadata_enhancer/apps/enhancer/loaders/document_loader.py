@@ -1,6 +1,6 @@
 import os
 import logging
-from .pdf_loader import load_pdf
+from .pdf_loader import iter_pdf_pages, load_pdf
 from .docx_loader import load_docx
 from .doc_loader import load_doc
 from .txt_loader import load_txt
@@ -46,6 +46,29 @@ def load_document(file_path):
         logger.error(f"Неподдерживаемый формат файла: {ext}")
         return None
 
+def iter_document(file_path):
+    """
+    Потоковая загрузка документа: PDF читается постранично, остальные форматы -
+    через соответствующий загрузчик целиком (они и так возвращают один объект Document).
+    
+    Args:
+        file_path (str): Путь к файлу документа
+    
+    Yields:
+        Document: Объекты Document по мере загрузки
+    """
+    if not os.path.exists(file_path):
+        logger.error(f"Файл не найден: {file_path}")
+        return
+    
+    _, ext = os.path.splitext(file_path)
+    ext = ext.lower()
+    
+    if ext == '.pdf':
+        yield from iter_pdf_pages(file_path)
+    else:
+        yield from load_document(file_path) or []
+
 if __name__ == "__main__":
     import sys
     
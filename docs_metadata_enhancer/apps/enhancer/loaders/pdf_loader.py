@@ -65,6 +65,48 @@ def load_pdf(pdf_path):
         logger.error(f"Трассировка: {traceback.format_exc()}")
         return None
 
+def iter_pdf_pages(pdf_path):
+    """
+    Лениво загружает PDF постранично, не удерживая все страницы в памяти.
+    Args:
+        pdf_path (str): Путь к PDF-файлу
+    Yields:
+        Document: Объект Document для очередной страницы
+    Raises:
+        Exception: Ошибка разбора PDF (после записи в лог)
+    """
+    try:
+        logger.info(f"Начало потоковой загрузки PDF: {pdf_path}")
+        
+        if not os.path.exists(pdf_path):
+            logger.error(f"PDF file not found at path: {pdf_path}")
+            return
+        
+        abs_path = os.path.abspath(pdf_path)
+        
+        _, ext = os.path.splitext(abs_path)
+        if ext.lower() != '.pdf':
+            logger.error(f"Файл должен быть в формате PDF, получен формат: {ext}")
+            return
+        
+        file_size = os.path.getsize(abs_path) / (1024 * 1024)  # в МБ
+        logger.info(f"Размер файла: {file_size:.2f} МБ")
+        
+        # lazy_load разбирает страницы по одной по мере запроса
+        loader = PyPDFLoader(abs_path)
+        pages_count = 0
+        for page in loader.lazy_load():
+            pages_count += 1
+            yield page
+        
+        logger.info(f"Потоковая загрузка PDF завершена. Количество страниц: {pages_count}")
+    
+    except Exception as e:
+        logger.error(f"Ошибка при потоковой загрузке PDF: {str(e)}")
+        logger.error(f"Трассировка: {traceback.format_exc()}")
+        # Ошибка на середине документа не должна молча обрезать его: документ помечается как failed
+        raise
+
 if __name__ == "__main__":
     # Use a relative path from the current directory
     current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -0,0 +1,60 @@
+# apps/enhancer/management/commands/bench_preprocessing.py
+import logging
+import re
+import timeit
+
+from django.core.management.base import BaseCommand
+from nltk.corpus import stopwords
+
+from apps.enhancer.processing.pre_processing import get_preprocessing_engine, init_nltk
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Страница тестового текста (смешанный русский и английский текст с лишними пробелами и переносами)
+SAMPLE_PAGE = (
+    "Настоящая   диссертация посвящена исследованию методов извлечения метаданных\n\n"
+    "из научных документов и их связыванию с Wikidata. The results of the study are\t"
+    "presented in the third chapter and are available under a CC BY license.\n"
+) * 20
+
+
+def legacy_preprocess(text):
+    """Прежняя предобработка: init_nltk и сборка набора стоп-слов на каждый вызов, два прохода re.sub"""
+    cleaned = re.sub(r'\s+', ' ', re.sub(r'\n+', '\n', text)).strip()
+    init_nltk()
+    stop_words = set(stopwords.words('russian')).union(set(stopwords.words('english')))
+    return ' '.join([word for word in cleaned.split() if word.lower() not in stop_words])
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает время прежней предобработки текста и однопроходного PreprocessingEngine, "
+        "созданного один раз на процесс"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=200, help="Количество страниц тестового текста")
+        parser.add_argument("--repeat", type=int, default=3, help="Количество повторов замера")
+
+    def handle(self, *args, **options):
+        pages = [SAMPLE_PAGE] * options["pages"]
+        repeat = options["repeat"]
+
+        engine = get_preprocessing_engine()
+        if not all(legacy_preprocess(page) == engine.process(page) for page in pages[:3]):
+            logger.error("Результаты прежней предобработки и PreprocessingEngine различаются")
+
+        # Подробное логирование NLTK на каждом вызове прежней предобработки искажает замер
+        previous_disable = logging.root.manager.disable
+        logging.disable(logging.INFO)
+        try:
+            legacy_time = timeit.timeit(lambda: [legacy_preprocess(page) for page in pages], number=repeat) / repeat
+            engine_time = timeit.timeit(lambda: [engine.process(page) for page in pages], number=repeat) / repeat
+        finally:
+            logging.disable(previous_disable)
+
+        logger.info(f"Страниц: {len(pages)}, символов: {len(SAMPLE_PAGE) * len(pages)}")
+        logger.info(f"Прежняя предобработка: {legacy_time * 1000:.1f} мс")
+        logger.info(f"PreprocessingEngine: {engine_time * 1000:.1f} мс")
+        self.stdout.write(self.style.SUCCESS(f"Ускорение предобработки: x{legacy_time / engine_time:.1f}"))
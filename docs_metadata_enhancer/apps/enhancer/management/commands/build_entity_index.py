@@ -0,0 +1,19 @@
+# apps/enhancer/management/commands/build_entity_index.py
+from django.core.management.base import BaseCommand
+
+from apps.enhancer.models import EntityNameIndex
+from apps.enhancer.processing.entity_index import rebuild_entity_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Перестраивает локальный индекс имён сущностей (имя и тип -> QID) "
+        "из связей документов с сущностями Wikidata и меток сущностей"
+    )
+
+    def handle(self, *args, **options):
+        previous = EntityNameIndex.objects.count()
+        count = rebuild_entity_index()
+        self.stdout.write(self.style.SUCCESS(
+            f"Локальный индекс имён перестроен: {count} записей (было {previous})"
+        ))
@@ -0,0 +1,70 @@
+# apps/enhancer/management/commands/bulk_ingest.py
+import zipfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounts.models import User
+from apps.enhancer.models import Folder
+from apps.enhancer.processing.ingest import ArchiveTooLargeError, check_path_archives, ingest_files, iter_paths
+
+
+class Command(BaseCommand):
+    help = (
+        "Массовая загрузка документов из файлов, каталогов и ZIP-архивов: "
+        "потоковая запись в хранилище, bulk_create пачками и постановка обработки в очередь"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="Файлы, каталоги или ZIP-архивы")
+        parser.add_argument('--owner', required=True, help="Email владельца документов")
+        parser.add_argument('--folder', type=int, help="ID папки для документов")
+        parser.add_argument('--batch-size', type=int, default=settings.BULK_INGEST_BATCH_SIZE,
+                            help="Размер пачки для bulk_create и постановки задач в очередь")
+        parser.add_argument('--priority', type=int, default=settings.TASK_PRIORITY_BULK,
+                            help="Приоритет задач обработки (для Redis 0 - наивысший)")
+        parser.add_argument('--no-enqueue', action='store_true',
+                            help="Только создать документы, не запуская обработку")
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(email=options['owner'])
+        except User.DoesNotExist:
+            raise CommandError(f"Пользователь {options['owner']} не найден")
+
+        folder = None
+        if options['folder']:
+            try:
+                folder = Folder.objects.get(id=options['folder'], owner=owner)
+            except Folder.DoesNotExist:
+                raise CommandError(f"Папка {options['folder']} не найдена у пользователя {owner.email}")
+
+        # Архивы проверяются до загрузки, чтобы превышающий ограничения архив не прерывал её на середине
+        try:
+            check_path_archives(options['paths'])
+        except (ArchiveTooLargeError, zipfile.BadZipFile) as e:
+            raise CommandError(str(e))
+
+        queue = settings.CELERY_QUEUE_PARSING
+
+        def on_batch(stats):
+            report = stats.report()
+            self.stdout.write(
+                f"Создано документов: {report['created']}, в очереди: {report['enqueued']}, "
+                f"{report['docs_per_sec']} док/сек, {report['mb_per_sec']} МБ/сек"
+            )
+
+        stats = ingest_files(
+            iter_paths(options['paths']),
+            owner,
+            folder=folder,
+            batch_size=options['batch_size'],
+            priority=options['priority'],
+            enqueue=not options['no_enqueue'],
+            on_batch=on_batch,
+        )
+
+        report = stats.report(queue=None if options['no_enqueue'] else queue)
+        self.stdout.write(self.style.SUCCESS("Массовая загрузка завершена"))
+        for key, value in report.items():
+            self.stdout.write(f"  {key}: {value}")
@@ -0,0 +1,58 @@
+# apps/enhancer/management/commands/import_wikidata_dump.py
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.enhancer.models import WikidataDumpEntity
+from apps.enhancer.processing.wikidata import VALID_TYPES
+from apps.enhancer.processing.wikidata_offline import default_dump_types, import_dump, open_dump
+
+
+class Command(BaseCommand):
+    help = (
+        "Импортирует подмножество JSON-дампа Wikidata (сущности выбранных типов P31) "
+        "в локальное хранилище для связывания сущностей без сети"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dump', help="Путь к дампу Wikidata (.json, .json.gz или .json.bz2)")
+        parser.add_argument('--types', help="Типы сущностей через запятую: " + ", ".join(VALID_TYPES))
+        parser.add_argument('--p31', help="Дополнительные Q-идентификаторы типов (P31) через запятую")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Размер пачки записи в БД")
+        parser.add_argument('--limit', type=int, help="Максимум импортируемых сущностей")
+        parser.add_argument('--clear', action='store_true', help="Удалить ранее импортированные сущности")
+
+    def handle(self, *args, **options):
+        if options['types']:
+            allowed_types = set()
+            for entity_type in options['types'].split(','):
+                entity_type = entity_type.strip()
+                if entity_type not in VALID_TYPES:
+                    raise CommandError(f"Неизвестный тип сущности: {entity_type}")
+                allowed_types.update(VALID_TYPES[entity_type])
+        else:
+            allowed_types = default_dump_types()
+        if options['p31']:
+            allowed_types.update(qid.strip() for qid in options['p31'].split(',') if qid.strip())
+
+        if options['clear']:
+            deleted, _ = WikidataDumpEntity.objects.all().delete()
+            self.stdout.write(f"Удалено записей: {deleted}")
+
+        def on_batch(stats):
+            self.stdout.write(f"Прочитано сущностей: {stats['read']}, импортировано: {stats['imported']}")
+
+        try:
+            with open_dump(options['dump']) as lines:
+                stats = import_dump(
+                    lines,
+                    allowed_types=allowed_types,
+                    batch_size=options['batch_size'],
+                    limit=options['limit'],
+                    on_batch=on_batch,
+                )
+        except OSError as e:
+            raise CommandError(f"Не удалось прочитать дамп: {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Импорт завершён: импортировано {stats['imported']} из {stats['read']} сущностей, "
+            f"всего в хранилище {WikidataDumpEntity.objects.count()}"
+        ))
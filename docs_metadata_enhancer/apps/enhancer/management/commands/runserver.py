@@ -10,8 +10,10 @@ class Command(RunserverCommand):
     def handle(self, *args, **options):
         print("Запуск Celery процессов...")
 
-        # Запускаем Celery worker
-        celery_command = ['celery', '-A', 'docs_metadata_enhancer', 'worker', '-l', 'info']
+        # Запускаем Celery worker, обслуживающий все очереди (parsing, llm, wikidata и очередь по умолчанию)
+        from docs_metadata_enhancer.celery import get_worker_queues
+        celery_command = ['celery', '-A', 'docs_metadata_enhancer', 'worker', '-l', 'info',
+                          '-Q', ','.join(get_worker_queues())]
         celery_process = subprocess.Popen(
             celery_command,
             stdout=subprocess.PIPE,
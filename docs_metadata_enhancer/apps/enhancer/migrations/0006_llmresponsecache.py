@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-17 02:57
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('enhancer', '0005_alter_documententityrelation_unique_together_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMResponseCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='Ключ кэша')),
+                ('model_name', models.CharField(max_length=100, verbose_name='Модель LLM')),
+                ('prompt_version', models.CharField(max_length=64, verbose_name='Версия промпта')),
+                ('response', models.JSONField(blank=True, default=dict, verbose_name='Ответ LLM')),
+                ('hits', models.PositiveIntegerField(default=0, verbose_name='Количество попаданий')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('last_accessed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Дата последнего обращения')),
+            ],
+            options={
+                'verbose_name': 'Кэш ответа LLM',
+                'verbose_name_plural': 'Кэш ответов LLM',
+                'ordering': ['-last_accessed_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-17 02:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('enhancer', '0006_llmresponsecache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True, verbose_name='SHA-256 содержимого файла'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-17 03:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('enhancer', '0007_document_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_hash', models.CharField(max_length=64, verbose_name='SHA-256 текста чанка')),
+                ('index', models.PositiveIntegerField(verbose_name='Порядковый номер чанка')),
+                ('prompt_version', models.CharField(max_length=64, verbose_name='Версия промпта')),
+                ('entities', models.JSONField(blank=True, default=dict, verbose_name='Извлечённые сущности')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='enhancer.document', verbose_name='Документ')),
+            ],
+            options={
+                'verbose_name': 'Чанк документа',
+                'verbose_name_plural': 'Чанки документов',
+                'ordering': ['document', 'index'],
+                'unique_together': {('document', 'chunk_hash')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-17 03:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('enhancer', '0008_documentchunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WikidataLookupCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='Ключ кэша')),
+                ('namespace', models.CharField(db_index=True, max_length=32, verbose_name='Вид запроса')),
+                ('lookup', models.CharField(max_length=255, verbose_name='Запрос')),
+                ('status', models.CharField(choices=[('found', 'Найдено'), ('not_found', 'Не найдено'), ('failure', 'Ошибка запроса')], max_length=20, verbose_name='Результат')),
+                ('value', models.JSONField(blank=True, null=True, verbose_name='Значение')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Действует до')),
+            ],
+            options={
+                'verbose_name': 'Кэш запроса к Wikidata',
+                'verbose_name_plural': 'Кэш запросов к Wikidata',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
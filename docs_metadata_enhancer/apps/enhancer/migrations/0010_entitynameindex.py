@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-17 03:28
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('enhancer', '0009_wikidatalookupcache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntityNameIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('normalized_name', models.CharField(max_length=255, verbose_name='Нормализованное имя')),
+                ('entity_type', models.CharField(blank=True, default='', max_length=32, verbose_name='Тип сущности')),
+                ('qid', models.CharField(max_length=20, verbose_name='Идентификатор Q')),
+                ('usage_count', models.PositiveIntegerField(default=1, verbose_name='Количество использований')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата последнего использования')),
+            ],
+            options={
+                'verbose_name': 'Имя сущности в локальном индексе',
+                'verbose_name_plural': 'Локальный индекс имён сущностей',
+                'ordering': ['-usage_count'],
+                'indexes': [models.Index(fields=['normalized_name', 'entity_type'], name='enhancer_en_normali_51aaba_idx')],
+                'unique_together': {('normalized_name', 'entity_type', 'qid')},
+            },
+        ),
+    ]
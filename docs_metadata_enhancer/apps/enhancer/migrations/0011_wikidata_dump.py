@@ -0,0 +1,46 @@
+# Generated by Django 5.2 on 2026-10-17 03:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('enhancer', '0010_entitynameindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WikidataDumpEntity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('qid', models.CharField(max_length=20, unique=True, verbose_name='Идентификатор Q')),
+                ('label_ru', models.CharField(blank=True, default='', max_length=255, verbose_name='Метка на русском')),
+                ('label_en', models.CharField(blank=True, default='', max_length=255, verbose_name='Метка на английском')),
+                ('description_ru', models.TextField(blank=True, default='', verbose_name='Описание на русском')),
+                ('description_en', models.TextField(blank=True, default='', verbose_name='Описание на английском')),
+                ('types', models.JSONField(blank=True, default=list, verbose_name='Типы (P31)')),
+                ('sitelinks', models.PositiveIntegerField(default=0, verbose_name='Количество ссылок на статьи')),
+            ],
+            options={
+                'verbose_name': 'Сущность из дампа Wikidata',
+                'verbose_name_plural': 'Сущности из дампа Wikidata',
+                'ordering': ['qid'],
+            },
+        ),
+        migrations.CreateModel(
+            name='WikidataDumpLabel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('normalized_name', models.CharField(db_index=True, max_length=255, verbose_name='Нормализованное имя')),
+                ('is_alias', models.BooleanField(default=False, verbose_name='Синоним')),
+                ('entity', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='names', to='enhancer.wikidatadumpentity', verbose_name='Сущность')),
+            ],
+            options={
+                'verbose_name': 'Метка из дампа Wikidata',
+                'verbose_name_plural': 'Метки из дампа Wikidata',
+                'unique_together': {('entity', 'normalized_name')},
+            },
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from apps.accounts.models import User
 
 # Create your models here.
@@ -94,6 +95,7 @@ class Document(models.Model):
     processing_status = models.CharField(max_length=20, choices=PROCESSING_STATUS, default='pending', verbose_name="Статус обработки")
     task_id = models.CharField(max_length=50, blank=True, null=True, verbose_name="ID задачи Celery")
     processing_errors = models.TextField(blank=True, null=True, verbose_name="Ошибки обработки")
+    content_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True, verbose_name="SHA-256 содержимого файла")
 
     class Meta:
         verbose_name = "Документ"
@@ -156,3 +158,121 @@ class DocumentEntityRelation(models.Model):
     def __str__(self):
         field_info = f"{self.field_key}: {self.field_value}" if self.field_key and self.field_value else self.field_category
         return f"{self.document.name} - {self.entity} ({field_info})"
+
+
+class LLMResponseCache(models.Model):
+    """Модель для кэширования ответов LLM по хэшу запроса (модель, версия промпта, температура, текст)"""
+    key = models.CharField(max_length=64, unique=True, verbose_name="Ключ кэша")
+    model_name = models.CharField(max_length=100, verbose_name="Модель LLM")
+    prompt_version = models.CharField(max_length=64, verbose_name="Версия промпта")
+    response = models.JSONField(default=dict, blank=True, verbose_name="Ответ LLM")
+    hits = models.PositiveIntegerField(default=0, verbose_name="Количество попаданий")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    last_accessed_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name="Дата последнего обращения")
+
+    class Meta:
+        verbose_name = "Кэш ответа LLM"
+        verbose_name_plural = "Кэш ответов LLM"
+        ordering = ['-last_accessed_at']
+
+    def __str__(self):
+        return f"{self.model_name} ({self.prompt_version}) - {self.key[:12]}"
+
+
+class DocumentChunk(models.Model):
+    """Модель для хранения результатов обработки чанков документа (контрольные точки для возобновления обработки)"""
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks', verbose_name="Документ")
+    chunk_hash = models.CharField(max_length=64, verbose_name="SHA-256 текста чанка")
+    index = models.PositiveIntegerField(verbose_name="Порядковый номер чанка")
+    prompt_version = models.CharField(max_length=64, verbose_name="Версия промпта")
+    entities = models.JSONField(default=dict, blank=True, verbose_name="Извлечённые сущности")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+
+    class Meta:
+        verbose_name = "Чанк документа"
+        verbose_name_plural = "Чанки документов"
+        unique_together = ('document', 'chunk_hash')
+        ordering = ['document', 'index']
+
+    def __str__(self):
+        return f"{self.document.name} - чанк {self.index + 1}"
+
+
+class WikidataLookupCache(models.Model):
+    """Модель для общего кэша запросов к Wikidata (поиск QID по имени, данные сущностей, метки)"""
+    STATUS_CHOICES = (
+        ('found', 'Найдено'),
+        ('not_found', 'Не найдено'),
+        ('failure', 'Ошибка запроса'),
+    )
+
+    key = models.CharField(max_length=64, unique=True, verbose_name="Ключ кэша")
+    namespace = models.CharField(max_length=32, db_index=True, verbose_name="Вид запроса")
+    lookup = models.CharField(max_length=255, verbose_name="Запрос")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, verbose_name="Результат")
+    value = models.JSONField(null=True, blank=True, verbose_name="Значение")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    expires_at = models.DateTimeField(db_index=True, verbose_name="Действует до")
+
+    class Meta:
+        verbose_name = "Кэш запроса к Wikidata"
+        verbose_name_plural = "Кэш запросов к Wikidata"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.namespace}: {self.lookup} ({self.get_status_display()})"
+
+
+class EntityNameIndex(models.Model):
+    """Модель локального индекса: нормализованное имя и тип сущности -> Q-идентификатор Wikidata"""
+    normalized_name = models.CharField(max_length=255, verbose_name="Нормализованное имя")
+    entity_type = models.CharField(max_length=32, blank=True, default="", verbose_name="Тип сущности")
+    qid = models.CharField(max_length=20, verbose_name="Идентификатор Q")
+    usage_count = models.PositiveIntegerField(default=1, verbose_name="Количество использований")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    last_used_at = models.DateTimeField(default=timezone.now, verbose_name="Дата последнего использования")
+
+    class Meta:
+        verbose_name = "Имя сущности в локальном индексе"
+        verbose_name_plural = "Локальный индекс имён сущностей"
+        unique_together = ('normalized_name', 'entity_type', 'qid')
+        indexes = [models.Index(fields=['normalized_name', 'entity_type'])]
+        ordering = ['-usage_count']
+
+    def __str__(self):
+        return f"{self.normalized_name} ({self.entity_type or '-'}) -> {self.qid}"
+
+
+class WikidataDumpEntity(models.Model):
+    """Модель сущности, импортированной из дампа Wikidata (для связывания без сети)"""
+    qid = models.CharField(max_length=20, unique=True, verbose_name="Идентификатор Q")
+    label_ru = models.CharField(max_length=255, blank=True, default="", verbose_name="Метка на русском")
+    label_en = models.CharField(max_length=255, blank=True, default="", verbose_name="Метка на английском")
+    description_ru = models.TextField(blank=True, default="", verbose_name="Описание на русском")
+    description_en = models.TextField(blank=True, default="", verbose_name="Описание на английском")
+    types = models.JSONField(default=list, blank=True, verbose_name="Типы (P31)")
+    sitelinks = models.PositiveIntegerField(default=0, verbose_name="Количество ссылок на статьи")
+
+    class Meta:
+        verbose_name = "Сущность из дампа Wikidata"
+        verbose_name_plural = "Сущности из дампа Wikidata"
+        ordering = ['qid']
+
+    def __str__(self):
+        return f"{self.qid} - {self.label_ru or self.label_en}"
+
+
+class WikidataDumpLabel(models.Model):
+    """Модель нормализованной метки или синонима сущности из дампа Wikidata"""
+    entity = models.ForeignKey(WikidataDumpEntity, on_delete=models.CASCADE, related_name='names',
+                               verbose_name="Сущность")
+    normalized_name = models.CharField(max_length=255, db_index=True, verbose_name="Нормализованное имя")
+    is_alias = models.BooleanField(default=False, verbose_name="Синоним")
+
+    class Meta:
+        verbose_name = "Метка из дампа Wikidata"
+        verbose_name_plural = "Метки из дампа Wikidata"
+        unique_together = ('entity', 'normalized_name')
+
+    def __str__(self):
+        return f"{self.normalized_name} -> {self.entity.qid}"
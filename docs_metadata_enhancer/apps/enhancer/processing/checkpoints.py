@@ -0,0 +1,173 @@
+"""
+Контрольные точки обработки чанков документа.
+
+Результат извлечения сущностей из каждого чанка сохраняется в DocumentChunk с ключом
+(документ, SHA-256 текста чанка). При повторном запуске задачи (autoretry, перезапуск
+воркера с task_acks_late) чанки с сохранённым результатом не отправляются в LLM повторно,
+обрабатываются только недостающие. Результаты, полученные с другой версией промпта
+извлечения, не используются.
+"""
+
+import hashlib
+import logging
+import threading
+
+from apps.enhancer.LLM.cache import prompt_version
+from apps.enhancer.LLM.prompts.ner_prompt import ner_prompt_3
+from apps.enhancer.models import DocumentChunk
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+def chunk_hash(chunk):
+    """
+    Возвращает SHA-256 текста чанка.
+    Args:
+        chunk (str): Текст чанка
+    Returns:
+        str: Хэш чанка
+    """
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+
+class ChunkCheckpoint:
+    """
+    Контрольные точки чанков одного документа.
+    Args:
+        document (Document): Обрабатываемый документ
+        prompt (str): Системный промпт извлечения (по умолчанию ner_prompt_3)
+        preload (bool): Загрузить все сохранённые результаты одним запросом при создании объекта.
+            Без предзагрузки результат чанка запрашивается из БД отдельно (задача одного чанка).
+    """
+
+    def __init__(self, document, prompt=None, preload=True):
+        self.document = document
+        self.prompt_version = prompt_version(prompt or ner_prompt_3)
+        self.preload = preload
+        self._results = {}
+        if preload:
+            self._results = {
+                chunk.chunk_hash: chunk.entities
+                for chunk in self._queryset().only("chunk_hash", "entities")
+                if chunk.entities
+            }
+        self._stats = {"resumed": 0, "processed": 0, "failed": 0}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        if self._results:
+            logger.info(f"Документ ID {document.id}: найдено {len(self._results)} сохранённых результатов чанков")
+
+    def _queryset(self):
+        return DocumentChunk.objects.filter(document=self.document, prompt_version=self.prompt_version)
+
+    def _count(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+    def get(self, chunk):
+        """
+        Возвращает сохранённый результат чанка или None.
+        Args:
+            chunk (str): Текст чанка
+        Returns:
+            dict: Сущности чанка или None
+        """
+        return self.get_by_hash(chunk_hash(chunk))
+
+    def get_by_hash(self, key):
+        """
+        Возвращает сохранённый результат чанка по хэшу его текста или None.
+        Args:
+            key (str): SHA-256 текста чанка
+        Returns:
+            dict: Сущности чанка или None
+        """
+        entities = self._results.get(key)
+        if entities is None and not self.preload:
+            entities = self._queryset().filter(chunk_hash=key).values_list("entities", flat=True).first() or None
+        return entities
+
+    def results(self, keys):
+        """
+        Возвращает сохранённые результаты чанков в заданном порядке.
+        Args:
+            keys (list): Хэши чанков документа по порядку
+        Returns:
+            list: Сущности чанков (None для чанков без результата)
+        """
+        if not self.preload:
+            saved = dict(self._queryset().filter(chunk_hash__in=keys).values_list("chunk_hash", "entities"))
+            return [saved.get(key) or None for key in keys]
+        return [self._results.get(key) for key in keys]
+
+    def save(self, index, chunk, entities):
+        """
+        Сохраняет результат чанка. Пустые результаты (ошибки) не сохраняются,
+        такие чанки будут обработаны при следующем запуске.
+        Args:
+            index (int): Порядковый номер чанка
+            chunk (str): Текст чанка
+            entities (dict): Извлечённые сущности
+        """
+        if not entities:
+            return
+        key = chunk_hash(chunk)
+        chunk_result = DocumentChunk(
+            document=self.document,
+            chunk_hash=key,
+            index=index,
+            prompt_version=self.prompt_version,
+            entities=entities,
+        )
+        try:
+            # Запись выполняется одним запросом (upsert); потоки стадии LLM пишут по очереди
+            with self._write_lock:
+                DocumentChunk.objects.bulk_create(
+                    [chunk_result],
+                    update_conflicts=True,
+                    unique_fields=["document", "chunk_hash"],
+                    update_fields=["index", "prompt_version", "entities"],
+                )
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить результат чанка {index+1} документа ID {self.document.id}: {str(e)}")
+            return
+        with self._lock:
+            self._results[key] = entities
+
+    def extract(self, index, chunk, extract_func):
+        """
+        Возвращает сохранённый результат чанка, а если его нет - извлекает сущности и сохраняет результат.
+        Args:
+            index (int): Порядковый номер чанка
+            chunk (str): Текст чанка
+            extract_func (callable): Извлечение сущностей (index, chunk) -> dict или None
+        Returns:
+            dict: Сущности чанка или None в случае ошибки
+        """
+        entities = self.get(chunk)
+        if entities is not None:
+            logger.info(f"Чанк {index+1}: используется сохранённый результат")
+            self._count("resumed")
+            return entities
+
+        entities = extract_func(index, chunk)
+        self._count("processed" if entities else "failed")
+        self.save(index, chunk, entities)
+        return entities
+
+    def clear(self):
+        """Удаляет контрольные точки документа (после успешного завершения обработки)."""
+        deleted, _ = DocumentChunk.objects.filter(document=self.document).delete()
+        with self._lock:
+            self._results.clear()
+        return deleted
+
+    def get_stats(self):
+        """
+        Возвращает статистику контрольных точек.
+        Returns:
+            dict: resumed (взято из сохранённых), processed (обработано LLM), failed (ошибки)
+        """
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,91 @@
+"""
+Дедупликация документов по хэшу содержимого: повторно загруженный побайтно
+идентичный файл получает результаты уже обработанного документа без запуска пайплайна.
+"""
+
+import copy
+import logging
+
+from django.db import transaction
+
+from apps.enhancer.models import Document, DocumentEntityRelation
+from apps.enhancer.utils import compute_file_hash
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+def ensure_content_hash(document):
+    """
+    Вычисляет и сохраняет хэш содержимого документа, если он ещё не заполнен.
+    Args:
+        document (Document): Объект документа
+    Returns:
+        str: SHA-256 содержимого файла или None, если файл недоступен
+    """
+    if document.content_hash:
+        return document.content_hash
+
+    try:
+        with document.file.open('rb') as file:
+            document.content_hash = compute_file_hash(file)
+        document.save(update_fields=['content_hash'])
+        return document.content_hash
+    except Exception as e:
+        logger.warning(f"Не удалось вычислить хэш файла документа ID {document.id}: {str(e)}")
+        return None
+
+
+def find_processed_duplicate(document):
+    """
+    Ищет ранее успешно обработанный документ с тем же содержимым (у любого пользователя).
+    Args:
+        document (Document): Объект документа
+    Returns:
+        Document: Документ-источник результатов или None
+    """
+    content_hash = ensure_content_hash(document)
+    if not content_hash:
+        return None
+
+    return (
+        Document.objects
+        .filter(content_hash=content_hash, processing_status='success')
+        .exclude(id=document.id)
+        .exclude(metadata={})
+        .order_by('-updated_at')
+        .first()
+    )
+
+
+def clone_document_results(source, target):
+    """
+    Копирует metadata, meta_wikidata и связи с сущностями Wikidata из одного документа в другой.
+    Args:
+        source (Document): Обработанный документ-источник
+        target (Document): Документ, которому копируются результаты
+    Returns:
+        int: Количество скопированных связей с сущностями
+    """
+    with transaction.atomic():
+        target.metadata = copy.deepcopy(source.metadata)
+        target.meta_wikidata = copy.deepcopy(source.meta_wikidata)
+        target.save(update_fields=['metadata', 'meta_wikidata'])
+
+        relations = [
+            DocumentEntityRelation(
+                document=target,
+                entity_id=relation.entity_id,
+                field_category=relation.field_category,
+                name=relation.name,
+                field_key=relation.field_key,
+                field_value=relation.field_value,
+                confidence=relation.confidence,
+                context=relation.context,
+            )
+            for relation in source.entity_relations.all()
+        ]
+        DocumentEntityRelation.objects.bulk_create(relations, ignore_conflicts=True)
+
+    logger.info(f"Результаты документа ID {source.id} скопированы в документ ID {target.id}, связей: {len(relations)}")
+    return len(relations)
@@ -0,0 +1,222 @@
+"""
+Локальный индекс имён сущностей: нормализованное имя и тип сущности -> Q-идентификатор.
+
+Индекс строится из уже связанных сущностей (DocumentEntityRelation и метки WikidataEntity)
+и пополняется при каждом успешном поиске в Wikidata и ручном связывании. link_to_wikidata
+обращается к индексу до любых HTTP-запросов, поэтому часто встречающиеся организации,
+языки и ключевые слова ищутся в Wikidata один раз. Чтение индекса ничего не записывает
+в БД. При нескольких Q-идентификаторах для одного имени выбирается тот, с которым имя
+чаще связывалось (успешный поиск или ручное связывание).
+"""
+
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from apps.enhancer.models import DocumentEntityRelation, EntityNameIndex, WikidataEntity
+from apps.enhancer.processing.entity_merge import normalize_value
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Типы сущностей полей метаданных (как при обогащении документа)
+FIELD_ENTITY_TYPES = {
+    "creator": "person",
+    "organizations": "organization",
+    "title": "concept",
+    "keywords": "concept",
+    "subject": "discipline",
+    "document_language": "language",
+    "contributor": "person",
+}
+
+# Максимальная длина нормализованного имени в индексе
+MAX_NAME_LENGTH = 255
+
+# Размер пачки при перестроении индекса
+REBUILD_BATCH_SIZE = 1000
+
+# Счётчики индекса в рамках процесса
+_stats = {"hits": 0, "misses": 0, "saved_calls": 0, "recorded": 0}
+_stats_lock = threading.Lock()
+
+
+def _increment(counter, value=1):
+    with _stats_lock:
+        _stats[counter] += value
+
+
+def is_index_enabled():
+    return getattr(settings, "WIKIDATA_ENTITY_INDEX_ENABLED", True)
+
+
+def normalize_name(name):
+    """
+    Нормализует имя для поиска в индексе.
+    Args:
+        name (str): Имя сущности
+    Returns:
+        str: Нормализованное имя
+    """
+    return normalize_value(name)[:MAX_NAME_LENGTH]
+
+
+def _expected_calls(entity_type):
+    """Сколько HTTP-запросов требует поиск в Wikidata: поиск и, для типизированных сущностей, проверка типа"""
+    from apps.enhancer.processing.wikidata import VALID_TYPES
+
+    return 2 if entity_type in VALID_TYPES else 1
+
+
+def lookup_entity_name(name, entity_type=None):
+    """
+    Ищет Q-идентификатор имени в локальном индексе (только чтение: счётчик использований
+    увеличивается при подтверждённом связывании в record_entity_name, а не при каждом попадании,
+    иначе первый попавший в индекс Q-идентификатор закреплялся бы за именем навсегда).
+    Args:
+        name (str): Имя сущности
+        entity_type (str): Тип сущности (person, organization, concept, language, discipline)
+    Returns:
+        str: Q-идентификатор с наибольшим количеством подтверждённых связываний или None
+    """
+    if not is_index_enabled():
+        return None
+    normalized = normalize_name(name)
+    if not normalized:
+        return None
+
+    try:
+        entry = (
+            EntityNameIndex.objects.filter(normalized_name=normalized, entity_type=entity_type or "")
+            .order_by("-usage_count", "-last_used_at")
+            .only("id", "qid")
+            .first()
+        )
+        if entry is None:
+            _increment("misses")
+            return None
+    except Exception as e:
+        # Ошибка индекса не должна прерывать связывание
+        logger.warning(f"Ошибка чтения локального индекса имён: {str(e)}")
+        _increment("misses")
+        return None
+
+    _increment("hits")
+    _increment("saved_calls", _expected_calls(entity_type))
+    return entry.qid
+
+
+def record_entity_name(name, entity_type, qid):
+    """
+    Добавляет подтверждённое сопоставление имени и Q-идентификатора (успешный поиск в Wikidata
+    или ручное связывание) в индекс или увеличивает его счётчик использований.
+    Args:
+        name (str): Имя сущности
+        entity_type (str): Тип сущности
+        qid (str): Q-идентификатор Wikidata
+    """
+    if not is_index_enabled() or not qid:
+        return
+    normalized = normalize_name(name)
+    if not normalized:
+        return
+
+    try:
+        updated = EntityNameIndex.objects.filter(
+            normalized_name=normalized, entity_type=entity_type or "", qid=qid
+        ).update(usage_count=F("usage_count") + 1, last_used_at=timezone.now())
+        if not updated:
+            EntityNameIndex.objects.bulk_create(
+                [EntityNameIndex(normalized_name=normalized, entity_type=entity_type or "", qid=qid)],
+                ignore_conflicts=True,
+            )
+        _increment("recorded")
+    except Exception as e:
+        logger.warning(f"Ошибка записи в локальный индекс имён: {str(e)}")
+
+
+def entity_types_from_properties(properties):
+    """
+    Определяет типы сущности (person, organization, ...) по значениям P31 из WikidataEntity.properties.
+    Args:
+        properties (dict): Свойства сущности
+    Returns:
+        set: Типы сущности
+    """
+    from apps.enhancer.processing.wikidata import VALID_TYPES
+
+    instance_of = {
+        value.get("qid")
+        for value in (properties or {}).get("P31", {}).get("values", [])
+        if isinstance(value, dict)
+    }
+    return {entity_type for entity_type, type_qids in VALID_TYPES.items() if instance_of & set(type_qids)}
+
+
+def rebuild_entity_index():
+    """
+    Перестраивает индекс из связей документов с сущностями и меток сущностей Wikidata.
+    Счётчик использований имени из связей равен количеству связей, имена из меток
+    сущностей добавляются с нулевым счётчиком.
+    Returns:
+        int: Количество записей индекса
+    """
+    counts = Counter()
+
+    relations = DocumentEntityRelation.objects.values_list(
+        "field_key", "field_category", "field_value", "name", "entity__qid"
+    )
+    for field_key, field_category, field_value, name, qid in relations.iterator():
+        normalized = normalize_name(field_value or name or "")
+        if not normalized:
+            continue
+        entity_type = FIELD_ENTITY_TYPES.get(field_key or field_category, "")
+        counts[(normalized, entity_type, qid)] += 1
+
+    entities = WikidataEntity.objects.values_list("qid", "label_ru", "label_en", "properties")
+    for qid, label_ru, label_en, properties in entities.iterator():
+        entity_types = entity_types_from_properties(properties) | {""}
+        for label in (label_ru, label_en):
+            normalized = normalize_name(label or "")
+            if not normalized:
+                continue
+            for entity_type in entity_types:
+                counts.setdefault((normalized, entity_type, qid), 0)
+
+    now = timezone.now()
+    with transaction.atomic():
+        EntityNameIndex.objects.all().delete()
+        EntityNameIndex.objects.bulk_create(
+            [
+                EntityNameIndex(
+                    normalized_name=normalized,
+                    entity_type=entity_type,
+                    qid=qid,
+                    usage_count=count,
+                    last_used_at=now,
+                )
+                for (normalized, entity_type, qid), count in counts.items()
+            ],
+            batch_size=REBUILD_BATCH_SIZE,
+        )
+
+    logger.info(f"Локальный индекс имён перестроен: {len(counts)} записей")
+    return len(counts)
+
+
+def get_entity_index_stats():
+    """
+    Возвращает статистику локального индекса в рамках текущего процесса.
+    Returns:
+        dict: Счётчики hits, misses, recorded, сэкономленные HTTP-запросы saved_calls и доля попаданий hit_rate
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return stats
@@ -0,0 +1,433 @@
+"""
+Локальное объединение сущностей, извлечённых из разных чанков.
+
+Значения нормализуются (Unicode NFKC, регистр, пробелы, кавычки, ё -> е), кириллица
+транслитерируется в латиницу, поэтому «Иван Иванов» и «Ivan Ivanov» получают один ключ.
+Близкие варианты объединяются нечётким сравнением ключей. Термины: формы слова
+(«машинное обучение» / «машинного обучения») - по совпадению основ слов, различающихся
+только окончанием, опечатки - по схожести Jaro-Winkler (jellyfish; для названий
+организаций порог строже, чем для терминов). Имена: по словам,
+с учётом инициалов, вариантов транслитерации (Sergey / Sergei) и одной опечатки в
+длинных словах (расстояние Дамерау-Левенштейна). Значения с разными числами
+(«Windows 10» / «Windows 11», «ГОСТ 7.32-2017» / «ГОСТ 7.32-2001») нечётко не объединяются.
+Имя присоединяется к группе, только если оно совпадает со всеми именами группы и подходит
+ровно одной группе: «А. Иванов» не объединяет «Алексея Иванова» и «Андрея Иванова».
+Группировка не зависит от порядка значений: сначала сравниваются полные ключи,
+затем ключи с инициалами. Для каждой группы вариантов считается частота,
+а представителем группы становится самый частый вариант.
+Результат - ранжированный по частоте компактный список кандидатов для каждого поля.
+При иерархической свёртке частоты переносятся между уровнями (weighted_candidates, carry_counts).
+"""
+
+import logging
+import os
+import re
+import unicodedata
+
+import jellyfish
+from django.conf import settings
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Поля с именами людей: порядок слов в имени не важен («Иванов Иван» = «Иван Иванов»)
+NAME_FIELDS = {"creator", "contributor", "persons"}
+
+# Поля с названиями организаций: опечатки объединяются по более строгому порогу схожести
+ORGANIZATION_FIELDS = {"organizations", "publisher"}
+
+# Поля-списки и поля с одним значением в итоговых метаданных
+LIST_FIELDS = ("creator", "organizations", "keywords", "dates", "subject", "contributor", "persons")
+SCALAR_FIELDS = ("title", "summary", "publisher", "document_language", "identifier", "rights")
+
+# Сколько кандидатов каждого поля передавать на финализацию.
+# Имена людей (creator, contributor, persons) не сокращаются: отброшенного автора
+# финализация восстановить не может
+CANDIDATE_LIMITS = {
+    "organizations": 20,
+    "keywords": 20,
+    "dates": 20,
+    "subject": 10,
+    "title": 5,
+    "summary": 3,
+    "publisher": 5,
+    "document_language": 3,
+    "identifier": 5,
+    "rights": 3,
+}
+
+# Поля, значения которых сравниваются только точно (идентификаторы, даты, длинные тексты)
+EXACT_FIELDS = {"identifier", "dates", "summary"}
+
+# Минимальная длина ключа для нечёткого сравнения
+MIN_FUZZY_LENGTH = 4
+
+# Максимальная длина окончания и минимальная длина основы слова при сравнении форм слова
+MAX_ENDING_LENGTH = 3
+MIN_STEM_LENGTH = 3
+
+# Минимальная длина слова имени, в котором допускается одна опечатка
+MIN_TYPO_NAME_LENGTH = 7
+
+# Варианты латинского написания одних и тех же звуков (Sergey / Sergei, Ivanow / Ivanov)
+_NAME_VARIANTS_RE = (
+    (re.compile(r"kh"), "h"),
+    (re.compile(r"ks"), "x"),
+    (re.compile(r"[yj]"), "i"),
+    (re.compile(r"w"), "v"),
+)
+
+_TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya",
+}
+_TRANSLIT_TABLE = str.maketrans(_TRANSLIT)
+
+_QUOTES_RE = re.compile(r"[\"'«»„“”‘’`]")
+_NUMBER_RE = re.compile(r"\d+")
+_NON_WORD_RE = re.compile(r"[^\w]+")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_value(value):
+    """
+    Нормализует значение для сравнения: NFKC, регистр, кавычки, ё -> е, пробелы.
+    Args:
+        value: Значение сущности
+    Returns:
+        str: Нормализованная строка
+    """
+    text = unicodedata.normalize("NFKC", str(value)).casefold().replace("ё", "е")
+    text = _QUOTES_RE.sub("", text)
+    return _WHITESPACE_RE.sub(" ", text).strip(" .,;:-")
+
+
+def entity_key(value, field=None):
+    """
+    Возвращает ключ сравнения значения: нормализованная транслитерированная строка
+    из буквенно-цифровых слов. Для имён слова сортируются.
+    Args:
+        value: Значение сущности
+        field (str): Поле сущности
+    Returns:
+        str: Ключ сравнения
+    """
+    words = _NON_WORD_RE.sub(" ", normalize_value(value).translate(_TRANSLIT_TABLE)).split()
+    if field in NAME_FIELDS:
+        words.sort()
+    return " ".join(words)
+
+
+def same_inflection(key_a, key_b):
+    """
+    Проверяет, что ключи состоят из одних и тех же слов, различающихся только окончаниями.
+    Args:
+        key_a (str): Ключ сравнения
+        key_b (str): Ключ сравнения
+    Returns:
+        bool: True, если ключи - формы одного и того же словосочетания
+    """
+    words_a, words_b = key_a.split(), key_b.split()
+    if len(words_a) != len(words_b):
+        return False
+    for word_a, word_b in zip(words_a, words_b):
+        if word_a == word_b:
+            continue
+        stem = len(os.path.commonprefix([word_a, word_b]))
+        ending_a, ending_b = word_a[stem:], word_b[stem:]
+        if stem < MIN_STEM_LENGTH or len(ending_a) > MAX_ENDING_LENGTH or len(ending_b) > MAX_ENDING_LENGTH:
+            return False
+        # Окончания состоят только из букв: «раздел1» и «раздел2» - разные значения
+        if not (ending_a + ending_b).isalpha():
+            return False
+    return True
+
+
+def _fold_name_word(word):
+    for pattern, replacement in _NAME_VARIANTS_RE:
+        word = pattern.sub(replacement, word)
+    return word
+
+
+def _same_name_word(word_a, word_b):
+    if word_a == word_b:
+        return True
+    # Инициал: «И.» и «Иван»
+    if len(word_a) == 1 or len(word_b) == 1:
+        return word_a[0] == word_b[0]
+    folded_a, folded_b = _fold_name_word(word_a), _fold_name_word(word_b)
+    if folded_a == folded_b:
+        return True
+    return (
+        min(len(folded_a), len(folded_b)) >= MIN_TYPO_NAME_LENGTH
+        and jellyfish.damerau_levenshtein_distance(folded_a, folded_b) <= 1
+    )
+
+
+def same_name(key_a, key_b):
+    """
+    Проверяет, что ключи - варианты написания одного имени.
+    Каждое слово более короткого имени должно совпасть с отдельным словом более длинного
+    (имена могут различаться не больше чем на одно слово, например отчеством).
+    Args:
+        key_a (str): Ключ сравнения имени
+        key_b (str): Ключ сравнения имени
+    Returns:
+        bool: True, если имена совпадают
+    """
+    words_a, words_b = key_a.split(), key_b.split()
+    if len(words_a) > len(words_b):
+        words_a, words_b = words_b, words_a
+    if not words_a or len(words_b) - len(words_a) > 1:
+        return False
+    # Хотя бы одно слово (фамилия) должно быть полным, а не инициалом
+    if all(len(word) == 1 for word in words_a):
+        return False
+    remaining = list(words_b)
+    for word in words_a:
+        match = next((other for other in remaining if _same_name_word(word, other)), None)
+        if match is None:
+            return False
+        remaining.remove(match)
+    return True
+
+
+def is_near_duplicate(key_a, key_b, field=None):
+    """
+    Проверяет, являются ли ключи вариантами одного значения.
+    Args:
+        key_a (str): Ключ сравнения
+        key_b (str): Ключ сравнения
+        field (str): Поле сущности
+    Returns:
+        bool: True, если значения следует объединить
+    """
+    if field in EXACT_FIELDS:
+        return False
+    # Числа - часть значения: версии, номера стандартов, годы
+    if _NUMBER_RE.findall(key_a) != _NUMBER_RE.findall(key_b):
+        return False
+    if field in NAME_FIELDS:
+        return same_name(key_a, key_b)
+    if same_inflection(key_a, key_b):
+        return True
+    return jellyfish.jaro_winkler_similarity(key_a, key_b) >= fuzzy_threshold(field)
+
+
+def fuzzy_threshold(field):
+    """
+    Порог схожести Jaro-Winkler для объединения значений с опечатками.
+    Названия организаций сравниваются строже терминов: разные организации часто
+    различаются одной буквой. Имена людей сравниваются по словам (same_name), без порога.
+    Args:
+        field (str): Поле сущности
+    Returns:
+        float: Порог схожести
+    """
+    if field in ORGANIZATION_FIELDS:
+        return getattr(settings, "ENTITY_ORGANIZATION_SIMILARITY", 0.98)
+    return getattr(settings, "ENTITY_TERM_SIMILARITY", 0.96)
+
+
+def _block_key(key, field):
+    """
+    Блок сравнения: нечётко сравниваются только ключи одного блока.
+    Имён в документе немного, поэтому они сравниваются все между собой
+    (количество слов и инициалы могут различаться). Термины - по числу слов и первым буквам
+    первого и последнего слова.
+    """
+    if field in NAME_FIELDS:
+        return None
+    return key[0], key[key.rfind(" ") + 1], key.count(" ")
+
+
+def _initials_count(key):
+    """Количество однобуквенных слов (инициалов) в ключе"""
+    return sum(1 for word in key.split() if len(word) == 1)
+
+
+def _cluster_groups(groups, field):
+    """
+    Объединяет группы точно совпадающих ключей в группы вариантов одного значения.
+    Имя присоединяется к группе вариантов, если оно совпадает со всеми её именами, термин -
+    если он близок к первому (самому частому) термину группы. Подходящая группа должна быть
+    единственной: неоднозначный ключ, например инициалы, подходящие к двум разным именам,
+    остаётся отдельным значением. Ключи перебираются от полных к содержащим инициалы,
+    затем по убыванию частоты, поэтому результат не зависит от порядка значений.
+    Args:
+        groups (list): Группы {"key", "count", "variants", "order"}
+        field (str): Поле сущности
+    Returns:
+        list: Группы вариантов - списки групп ключей
+    """
+    clusters = []
+    by_block = {}
+    for group in sorted(groups, key=lambda group: (_initials_count(group["key"]), -group["count"], group["key"])):
+        key = group["key"]
+        block = _block_key(key, field)
+        matches = []
+        if len(key) >= MIN_FUZZY_LENGTH:
+            matches = [
+                cluster for cluster in by_block.get(block, ())
+                if all(
+                    is_near_duplicate(key, other["key"], field)
+                    for other in (cluster if field in NAME_FIELDS else cluster[:1])
+                )
+            ]
+        if len(matches) == 1:
+            matches[0].append(group)
+            continue
+        cluster = [group]
+        clusters.append(cluster)
+        by_block.setdefault(block, []).append(cluster)
+    return clusters
+
+
+def rank_values(values, field=None):
+    """
+    Группирует варианты одного значения и ранжирует группы по частоте.
+    Args:
+        values (list): Значения поля из всех чанков (с повторами); значение может быть
+            взвешенным - {"value": значение, "count": частота} (см. weighted_candidates)
+        field (str): Поле сущности
+    Returns:
+        list: Кандидаты [{"value": представитель, "count": частота, "variants": варианты}],
+              отсортированные по убыванию частоты, при равенстве - по первому появлению
+    """
+    groups = {}
+    for value in values:
+        for item in (value if isinstance(value, list) else [value]):
+            weight = 1
+            if isinstance(item, dict):
+                weight = item.get("count") or 1
+                item = item.get("value")
+            if not isinstance(item, (str, int, float)) or isinstance(item, bool):
+                continue
+            surface = _WHITESPACE_RE.sub(" ", str(item)).strip()
+            key = entity_key(surface, field)
+            if not key:
+                continue
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {"key": key, "count": 0, "variants": {}, "order": len(groups)}
+            group["count"] += weight
+            group["variants"][surface] = group["variants"].get(surface, 0) + weight
+
+    if field in EXACT_FIELDS:
+        clusters = [[group] for group in groups.values()]
+    else:
+        clusters = _cluster_groups(list(groups.values()), field)
+
+    candidates = []
+    for cluster in clusters:
+        variants = {}
+        # Варианты в порядке первого появления
+        for group in sorted(cluster, key=lambda group: group["order"]):
+            for surface, count in group["variants"].items():
+                variants[surface] = variants.get(surface, 0) + count
+        candidates.append({
+            "order": min(group["order"] for group in cluster),
+            "count": sum(group["count"] for group in cluster),
+            "variants": variants,
+        })
+
+    candidates.sort(key=lambda candidate: (-candidate["count"], candidate["order"]))
+    return [
+        {
+            # Представитель - самый частый вариант, при равенстве - первый встреченный
+            "value": max(candidate["variants"].items(), key=lambda variant: variant[1])[0],
+            "count": candidate["count"],
+            "variants": list(candidate["variants"]),
+        }
+        for candidate in candidates
+    ]
+
+
+def rank_entities(entities_list):
+    """
+    Собирает значения всех полей из результатов чанков и ранжирует их.
+    Args:
+        entities_list (list): Словари сущностей из чанков
+    Returns:
+        dict: Поле -> ранжированный список кандидатов (см. rank_values)
+    """
+    values = {field: [] for field in LIST_FIELDS + SCALAR_FIELDS}
+    for entities in entities_list:
+        if not entities:
+            continue
+        for field in values:
+            value = entities.get(field)
+            if value:
+                values[field].append(value)
+    return {field: rank_values(field_values, field) for field, field_values in values.items()}
+
+
+def compact_candidates(ranked, limits=None):
+    """
+    Сокращает ранжированных кандидатов до компактного набора значений для финализации.
+    Args:
+        ranked (dict): Результат rank_entities
+        limits (dict): Максимум кандидатов по полям (по умолчанию CANDIDATE_LIMITS)
+    Returns:
+        dict: Поле -> список значений-представителей в порядке убывания частоты
+    """
+    limits = limits or CANDIDATE_LIMITS
+    return {
+        field: [candidate["value"] for candidate in candidates[:limits.get(field, len(candidates))]]
+        for field, candidates in ranked.items()
+    }
+
+
+def weighted_candidates(ranked):
+    """
+    Представляет ранжированных кандидатов частичным результатом с частотами,
+    пригодным для повторного ранжирования (rank_entities) без потери частот.
+    Args:
+        ranked (dict): Результат rank_entities
+    Returns:
+        dict: Поле -> [{"value": представитель, "count": частота}]
+    """
+    return {
+        field: [{"value": candidate["value"], "count": candidate["count"]} for candidate in candidates]
+        for field, candidates in ranked.items()
+        if candidates
+    }
+
+
+def carry_counts(entities, ranked):
+    """
+    Переносит частоты кандидатов на результат свёртки группы с помощью LLM: значение результата
+    получает частоту кандидата, вариантом которого оно является (или 1, если такого кандидата нет).
+    Args:
+        entities (dict): Результат финализации группы
+        ranked (dict): Результат rank_entities для входа группы
+    Returns:
+        dict: Поле -> [{"value": значение, "count": частота}]
+    """
+    weighted = {}
+    for field in LIST_FIELDS + SCALAR_FIELDS:
+        value = entities.get(field)
+        if not value:
+            continue
+        candidates = ranked.get(field, [])
+        keys = {
+            entity_key(variant, field): candidate
+            for candidate in candidates for variant in candidate["variants"]
+        }
+        items = []
+        for item in (value if isinstance(value, list) else [value]):
+            if not isinstance(item, (str, int, float)) or isinstance(item, bool):
+                continue
+            key = entity_key(str(item), field)
+            candidate = keys.get(key) or next(
+                (candidate for candidate in candidates
+                 if is_near_duplicate(key, entity_key(candidate["value"], field), field)),
+                None,
+            )
+            items.append({"value": item, "count": candidate["count"] if candidate else 1})
+        if items:
+            weighted[field] = items
+    return weighted
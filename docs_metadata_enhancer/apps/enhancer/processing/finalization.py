@@ -0,0 +1,183 @@
+"""
+Политика финализации сущностей: когда запрос финализации к LLM можно пропустить или сократить.
+
+Для коротких документов (один-три чанка) объединённый локально результат почти всегда
+уже окончательный, и второй запрос к LLM только удваивает время обработки.
+Политика выбирает одно из действий:
+    skip   - финальный результат собирается локально без запроса к LLM;
+    shrink - в LLM отправляются только поля с конфликтами (несколько вариантов заголовка,
+             описания и т.п.) и поля с объединёнными вариантами написания,
+             остальные поля заполняются локально;
+    full   - полная иерархическая финализация (reduce_entities).
+"""
+
+import json
+import logging
+
+from django.conf import settings
+
+from apps.enhancer.LLM.prompts.ner_prompt import finalize_prompt
+from apps.enhancer.processing.entity_merge import LIST_FIELDS, SCALAR_FIELDS, compact_candidates, rank_entities
+from apps.enhancer.processing.tokens import chunk_token_budget, count_tokens
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+SKIP = "skip"
+SHRINK = "shrink"
+FULL = "full"
+
+# Ограничения итоговых списков (как в промпте финализации)
+FINAL_LIST_LIMITS = {
+    "keywords": 7,
+}
+
+
+class FinalizationDecision:
+    """
+    Решение политики финализации.
+    Args:
+        action (str): skip, shrink или full
+        reason (str): Причина решения (для логов)
+        fields (list): Поля, отправляемые в LLM при shrink
+    """
+
+    def __init__(self, action, reason, fields=None):
+        self.action = action
+        self.reason = reason
+        self.fields = fields or []
+
+    def as_dict(self):
+        return {"action": self.action, "reason": self.reason, "fields": list(self.fields)}
+
+
+class FinalizationPolicy:
+    """
+    Политика выбора способа финализации по числу чанков, размеру объединённого
+    результата и наличию в нём конфликтов и дубликатов.
+    Args:
+        skip_max_chunks (int): Максимум чанков, при котором финализацию можно пропустить
+            (по умолчанию FINALIZE_SKIP_MAX_CHUNKS)
+        shrink_max_tokens (int): Максимальный размер объединённого результата в токенах для
+            сокращённой финализации (по умолчанию - бюджет одного запроса финализации)
+    """
+
+    def __init__(self, skip_max_chunks=None, shrink_max_tokens=None):
+        if skip_max_chunks is None:
+            skip_max_chunks = getattr(settings, "FINALIZE_SKIP_MAX_CHUNKS", 3)
+        if shrink_max_tokens is None:
+            shrink_max_tokens = chunk_token_budget(finalize_prompt)
+        self.skip_max_chunks = skip_max_chunks
+        self.shrink_max_tokens = shrink_max_tokens
+
+    @staticmethod
+    def conflicting_fields(ranked):
+        """
+        Поля, которые нельзя окончательно заполнить локально: у поля с одним значением
+        несколько вариантов или в списке больше значений, чем допускается в итоговом результате.
+        Args:
+            ranked (dict): Результат rank_entities
+        Returns:
+            list: Названия полей
+        """
+        fields = [field for field in SCALAR_FIELDS if len(ranked.get(field, [])) > 1]
+        fields += [field for field, limit in FINAL_LIST_LIMITS.items() if len(ranked.get(field, [])) > limit]
+        return fields
+
+    @staticmethod
+    def duplicate_list_fields(ranked):
+        """
+        Поля-списки, в которых варианты одного значения (разные написания) были объединены локально.
+        Выбор канонического написания можно доверить LLM.
+        Args:
+            ranked (dict): Результат rank_entities
+        Returns:
+            list: Названия полей
+        """
+        return [
+            field for field in LIST_FIELDS
+            if any(len(candidate["variants"]) > 1 for candidate in ranked.get(field, []))
+        ]
+
+    def decide(self, chunk_count, ranked):
+        """
+        Выбирает способ финализации.
+        Args:
+            chunk_count (int): Количество чанков с извлечёнными сущностями
+            ranked (dict): Результат rank_entities
+        Returns:
+            FinalizationDecision: Решение
+        """
+        if chunk_count <= 1:
+            return FinalizationDecision(SKIP, "один чанк")
+
+        conflicts = self.conflicting_fields(ranked)
+        duplicates = [field for field in self.duplicate_list_fields(ranked) if field not in conflicts]
+        if not conflicts and (not duplicates or chunk_count <= self.skip_max_chunks):
+            return FinalizationDecision(SKIP, f"{chunk_count} чанков без конфликтов")
+
+        fields = conflicts + duplicates
+        tokens = count_tokens(json.dumps(compact_candidates(ranked), ensure_ascii=False))
+        if tokens <= self.shrink_max_tokens:
+            return FinalizationDecision(SHRINK, f"{chunk_count} чанков, {tokens} токенов", fields)
+
+        return FinalizationDecision(FULL, f"{tokens} токенов превышают бюджет {self.shrink_max_tokens}")
+
+
+def build_local_result(ranked):
+    """
+    Собирает финальный результат локально: для списков - значения по убыванию частоты,
+    для полей с одним значением - самый частый вариант.
+    Args:
+        ranked (dict): Результат rank_entities
+    Returns:
+        dict: Финальный JSON в формате промпта финализации
+    """
+    result = {}
+    for field in LIST_FIELDS:
+        values = [candidate["value"] for candidate in ranked.get(field, [])]
+        limit = FINAL_LIST_LIMITS.get(field)
+        result[field] = values[:limit] if limit else values
+    for field in SCALAR_FIELDS:
+        candidates = ranked.get(field, [])
+        result[field] = candidates[0]["value"] if candidates else ""
+    return result
+
+
+def finalize_with_policy(entities_list, finalize_func, reduce_func, policy=None, stats=None):
+    """
+    Финализирует сущности способом, выбранным политикой.
+    Args:
+        entities_list (list): Сущности, извлечённые из чанков
+        finalize_func (callable): Запрос финализации к LLM (dict -> dict или None)
+        reduce_func (callable): Полная иерархическая финализация (list -> dict или None)
+        policy (FinalizationPolicy): Политика (по умолчанию FinalizationPolicy())
+        stats (dict): Необязательный словарь для статистики
+    Returns:
+        dict: Финальный JSON с обработанными сущностями или None в случае ошибки
+    """
+    policy = policy or FinalizationPolicy()
+    ranked = rank_entities(entities_list)
+    decision = policy.decide(len(entities_list), ranked)
+    logger.info(f"Политика финализации: {decision.action} ({decision.reason})")
+    if stats is not None:
+        stats["policy"] = decision.as_dict()
+
+    if decision.action == SKIP:
+        return build_local_result(ranked)
+
+    if decision.action == SHRINK:
+        result = build_local_result(ranked)
+        candidates = compact_candidates(ranked)
+        finalized = finalize_func({field: candidates[field] for field in decision.fields})
+        if stats is not None:
+            stats["llm_calls"] = 1
+        if not finalized:
+            logger.warning("Сокращённая финализация не удалась, используется локальный результат")
+            return result
+        for field in decision.fields:
+            if finalized.get(field):
+                result[field] = finalized[field]
+        return result
+
+    return reduce_func(entities_list)
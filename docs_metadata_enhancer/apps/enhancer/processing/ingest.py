@@ -0,0 +1,358 @@
+"""
+Массовая загрузка документов: каталоги, ZIP-архивы и несколько файлов за один запрос.
+
+Файлы потоково записываются в хранилище (SHA-256 содержимого считается во время записи),
+строки Document создаются пачками через bulk_create, а задачи обработки ставятся в очередь
+пачками (group) с приоритетом массовой загрузки, чтобы не задерживать интерактивную обработку.
+"""
+
+import hashlib
+import logging
+import os
+import time
+import zipfile
+
+from celery import current_app, group
+from django.conf import settings
+from django.core.files import File
+
+from apps.enhancer.models import Document
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Поддерживаемые расширения файлов
+SUPPORTED_EXTENSIONS = {type_code for type_code, _ in Document.DOCUMENT_TYPES}
+
+
+def get_file_type(name):
+    """
+    Определяет тип документа по расширению файла.
+    Args:
+        name (str): Имя файла
+    Returns:
+        str: Код типа документа или None, если тип не поддерживается
+    """
+    extension = os.path.splitext(name)[1].lower().lstrip(".")
+    return extension if extension in SUPPORTED_EXTENSIONS else None
+
+
+class HashingFile(File):
+    """Файл, вычисляющий SHA-256 содержимого во время записи в хранилище"""
+
+    def __init__(self, file, name=None):
+        super().__init__(file, name)
+        self.sha256 = hashlib.sha256()
+        self.bytes_read = 0
+
+    def chunks(self, chunk_size=None):
+        for chunk in super().chunks(chunk_size):
+            self.sha256.update(chunk)
+            self.bytes_read += len(chunk)
+            yield chunk
+
+
+class IngestStats:
+    """Статистика массовой загрузки: файлы, байты, документы, задачи и пропускная способность"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.files = 0
+        self.bytes = 0
+        self.created = 0
+        self.enqueued = 0
+        self.skipped = 0
+        self.errors = 0
+
+    def report(self, queue=None):
+        """
+        Возвращает сводку загрузки.
+        Args:
+            queue (str): Очередь, глубину которой нужно включить в отчёт
+        Returns:
+            dict: Счётчики, время, документов и мегабайт в секунду, глубина очереди
+        """
+        elapsed = max(time.perf_counter() - self.started_at, 1e-6)
+        report = {
+            "files": self.files,
+            "created": self.created,
+            "enqueued": self.enqueued,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "megabytes": round(self.bytes / 1024 / 1024, 2),
+            "seconds": round(elapsed, 2),
+            "docs_per_sec": round(self.created / elapsed, 2),
+            "mb_per_sec": round(self.bytes / 1024 / 1024 / elapsed, 2),
+        }
+        if queue:
+            report["queue"] = queue
+            report["queue_depth"] = get_queue_depth(queue)
+        return report
+
+
+def get_queue_depth(queue):
+    """
+    Возвращает количество задач в очереди брокера Redis (с учётом списков приоритетов).
+    Args:
+        queue (str): Название очереди
+    Returns:
+        int: Количество задач или None, если брокер недоступен
+    """
+    transport_options = getattr(settings, "CELERY_BROKER_TRANSPORT_OPTIONS", {})
+    separator = transport_options.get("sep", "\x06\x16")
+    steps = transport_options.get("priority_steps", [0, 3, 6, 9])
+    keys = [queue] + [f"{queue}{separator}{step}" for step in steps if step]
+    try:
+        with current_app.connection_for_read() as connection:
+            connection.ensure_connection(max_retries=1)
+            client = connection.default_channel.client
+            return sum(client.llen(key) for key in keys)
+    except Exception as e:
+        logger.warning(f"Не удалось получить глубину очереди {queue}: {str(e)}")
+        return None
+
+
+def iter_directory_files(root):
+    """
+    Рекурсивно обходит каталог.
+    Args:
+        root (str): Путь к каталогу
+    Yields:
+        str: Путь к файлу (в порядке обхода, имена внутри каталога отсортированы)
+    """
+    for directory, _, names in os.walk(root):
+        for name in sorted(names):
+            yield os.path.join(directory, name)
+
+
+class ArchiveTooLargeError(ValueError):
+    """ZIP-архив превышает допустимое количество файлов или размер после распаковки"""
+
+
+def check_zip_members(infos, name="архив"):
+    """
+    Проверяет ограничения ZIP-архива до распаковки (защита от ZIP-бомб).
+    Размеры берутся из ZipInfo.file_size: zipfile не распаковывает больше заявленного размера.
+    Args:
+        infos (list): Файлы архива (ZipInfo без каталогов)
+        name (str): Имя архива для сообщения об ошибке
+    Raises:
+        ArchiveTooLargeError: Если архив превышает BULK_INGEST_ZIP_MAX_MEMBERS или BULK_INGEST_ZIP_MAX_BYTES
+    """
+    max_members = getattr(settings, "BULK_INGEST_ZIP_MAX_MEMBERS", 10000)
+    max_bytes = getattr(settings, "BULK_INGEST_ZIP_MAX_BYTES", 2 * 1024 ** 3)
+    if max_members and len(infos) > max_members:
+        raise ArchiveTooLargeError(
+            f"Архив {name} содержит {len(infos)} файлов, допустимо не более {max_members}"
+        )
+    total_bytes = sum(info.file_size for info in infos)
+    if max_bytes and total_bytes > max_bytes:
+        raise ArchiveTooLargeError(
+            f"Размер архива {name} после распаковки {total_bytes / 1024 ** 2:.1f} МБ, "
+            f"допустимо не более {max_bytes / 1024 ** 2:.1f} МБ"
+        )
+
+
+def check_zip_archive(archive, name="архив"):
+    """
+    Проверяет ограничения ZIP-архива, не распаковывая его (см. check_zip_members).
+    Args:
+        archive: Путь к архиву или файловый объект
+        name (str): Имя архива для сообщения об ошибке
+    Raises:
+        ArchiveTooLargeError: Если архив превышает ограничения
+        zipfile.BadZipFile: Если файл не является ZIP-архивом
+    """
+    with zipfile.ZipFile(archive) as zip_file:
+        check_zip_members([info for info in zip_file.infolist() if not info.is_dir()], name)
+
+
+def iter_zip_members(archive, name="архив"):
+    """
+    Возвращает файлы из ZIP-архива, не распаковывая архив целиком.
+    Ограничения количества файлов и размера после распаковки проверяются до чтения первого файла.
+    Args:
+        archive: Путь к архиву или файловый объект
+        name (str): Имя архива для сообщения об ошибке
+    Yields:
+        tuple: (имя файла, открытый файловый объект члена архива)
+    Raises:
+        ArchiveTooLargeError: Если архив превышает ограничения
+    """
+    with zipfile.ZipFile(archive) as zip_file:
+        infos = [info for info in zip_file.infolist() if not info.is_dir()]
+        check_zip_members(infos, name)
+        for info in infos:
+            with zip_file.open(info) as member:
+                yield info.filename, member
+
+
+def check_path_archives(paths):
+    """
+    Проверяет ограничения всех ZIP-архивов среди путей (включая архивы внутри каталогов).
+    Args:
+        paths (list): Пути к файлам, каталогам или ZIP-архивам
+    Raises:
+        ArchiveTooLargeError: Если архив превышает ограничения
+        zipfile.BadZipFile: Если файл с расширением .zip не является ZIP-архивом
+    """
+    for path in paths:
+        files = iter_directory_files(path) if os.path.isdir(path) else [path]
+        for file_path in files:
+            if file_path.lower().endswith(".zip"):
+                check_zip_archive(file_path, file_path)
+
+
+def iter_paths(paths):
+    """
+    Разворачивает пути (файлы, каталоги, ZIP-архивы) в поток файлов.
+    Args:
+        paths (list): Пути к файлам, каталогам или ZIP-архивам
+    Yields:
+        tuple: (имя файла, открытый файловый объект)
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            files = iter_directory_files(path)
+        else:
+            files = [path]
+        for file_path in files:
+            if file_path.lower().endswith(".zip"):
+                yield from iter_zip_members(file_path, file_path)
+                continue
+            with open(file_path, "rb") as file:
+                yield file_path, file
+
+
+def iter_uploaded_files(uploaded_files):
+    """
+    Разворачивает загруженные через форму файлы (включая ZIP-архивы) в поток файлов.
+    Args:
+        uploaded_files (list): Файлы из request.FILES
+    Yields:
+        tuple: (имя файла, файловый объект)
+    """
+    for uploaded_file in uploaded_files:
+        if uploaded_file.name.lower().endswith(".zip"):
+            yield from iter_zip_members(uploaded_file, uploaded_file.name)
+        else:
+            yield uploaded_file.name, uploaded_file
+
+
+def check_uploaded_archives(uploaded_files):
+    """
+    Проверяет ограничения всех загруженных ZIP-архивов до начала загрузки,
+    чтобы превышающий их архив не оставлял частично загруженных документов.
+    Args:
+        uploaded_files (list): Файлы из request.FILES
+    Raises:
+        ArchiveTooLargeError: Если архив превышает ограничения
+        zipfile.BadZipFile: Если файл с расширением .zip не является ZIP-архивом
+    """
+    for uploaded_file in uploaded_files:
+        if uploaded_file.name.lower().endswith(".zip"):
+            check_zip_archive(uploaded_file, uploaded_file.name)
+            uploaded_file.seek(0)
+
+
+def store_file(name, file, owner, folder=None):
+    """
+    Записывает файл в хранилище документов и подготавливает (не сохраняя) строку Document.
+    Args:
+        name (str): Имя файла
+        file: Файловый объект
+        owner (User): Владелец документа
+        folder (Folder): Папка документа
+    Returns:
+        tuple: (Document без первичного ключа, размер файла в байтах)
+    """
+    file_field = Document._meta.get_field("file")
+    base_name = os.path.basename(name)
+    content = HashingFile(file, base_name)
+    stored_name = file_field.storage.save(file_field.generate_filename(None, base_name), content)
+    document = Document(
+        name=os.path.splitext(base_name)[0],
+        file=stored_name,
+        file_type=get_file_type(base_name),
+        folder=folder,
+        owner=owner,
+        content_hash=content.sha256.hexdigest(),
+    )
+    return document, content.bytes_read
+
+
+def enqueue_documents(documents, priority=None):
+    """
+    Ставит обработку документов в очередь одной группой задач и сохраняет ID задач.
+    Args:
+        documents (list): Созданные документы
+        priority (int): Приоритет задач
+    Returns:
+        int: Количество поставленных задач
+    """
+    from apps.enhancer.tasks import process_document
+
+    if not documents:
+        return 0
+    result = group(
+        process_document.si(document.id, priority=priority).set(priority=priority)
+        for document in documents
+    ).apply_async()
+    for document, task_result in zip(documents, result.results):
+        document.task_id = task_result.id
+    Document.objects.bulk_update(documents, ["task_id"])
+    return len(documents)
+
+
+def ingest_files(files, owner, folder=None, batch_size=None, priority=None, enqueue=True,
+                 stats=None, on_batch=None):
+    """
+    Загружает поток файлов: запись в хранилище, bulk_create пачками и постановка обработки в очередь.
+    Args:
+        files (Iterable): Пары (имя файла, файловый объект)
+        owner (User): Владелец документов
+        folder (Folder): Папка для документов
+        batch_size (int): Размер пачки (по умолчанию BULK_INGEST_BATCH_SIZE)
+        priority (int): Приоритет задач обработки (по умолчанию TASK_PRIORITY_BULK)
+        enqueue (bool): Ставить ли обработку документов в очередь
+        stats (IngestStats): Статистика загрузки (создаётся, если не передана)
+        on_batch (callable): Вызывается после каждой пачки с текущей статистикой
+    Returns:
+        IngestStats: Статистика загрузки
+    """
+    stats = stats or IngestStats()
+    if batch_size is None:
+        batch_size = getattr(settings, "BULK_INGEST_BATCH_SIZE", 100)
+    if priority is None:
+        priority = getattr(settings, "TASK_PRIORITY_BULK", None)
+
+    def flush(batch):
+        documents = Document.objects.bulk_create(batch)
+        stats.created += len(documents)
+        if enqueue:
+            stats.enqueued += enqueue_documents(documents, priority)
+        logger.info(f"Массовая загрузка: создано документов {stats.created}, в очереди {stats.enqueued}")
+        if on_batch:
+            on_batch(stats)
+
+    batch = []
+    for name, file in files:
+        if not get_file_type(name):
+            stats.skipped += 1
+            logger.debug(f"Пропущен файл неподдерживаемого типа: {name}")
+            continue
+        try:
+            document, size = store_file(name, file, owner, folder)
+        except Exception as e:
+            stats.errors += 1
+            logger.error(f"Ошибка при сохранении файла {name}: {str(e)}")
+            continue
+        stats.files += 1
+        stats.bytes += size
+        batch.append(document)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    return stats
@@ -0,0 +1,267 @@
+"""
+Локальное восстановление JSON из ответов LLM без повторного запроса к модели.
+
+Типичные дефекты ответов: обёртка в ```json ... ```, текст до и после JSON,
+висячие запятые и обрыв ответа на лимите max_tokens посреди строки или списка.
+Обрыв исправляется закрытием незавершённой строки-значения и всех открытых
+скобок, а незавершённые ключи и литералы отбрасываются.
+"""
+
+import json
+import logging
+import re
+import threading
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+
+# Схема метаданных, которые возвращает LLM при извлечении и финализации сущностей
+METADATA_SCHEMA = {
+    "creator": list,
+    "organizations": list,
+    "publisher": str,
+    "title": str,
+    "keywords": list,
+    "dates": list,
+    "summary": str,
+    "subject": list,
+    "document_language": str,
+    "identifier": str,
+    "contributor": list,
+    "rights": str,
+    "persons": list,
+}
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+# Счётчики разбора ответов в рамках процесса:
+# parsed - валидный JSON, local - исправлен локально, remote - исправлен запросом к LLM, failed - не исправлен
+_stats = {"parsed": 0, "local": 0, "remote": 0, "failed": 0}
+_stats_lock = threading.Lock()
+
+
+def record_repair(outcome):
+    """
+    Учитывает результат разбора ответа LLM.
+    Args:
+        outcome (str): "parsed", "local", "remote" или "failed"
+    """
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def get_repair_stats():
+    """
+    Возвращает статистику разбора ответов LLM в рамках текущего процесса.
+    Returns:
+        dict: Счётчики parsed, local, remote, failed
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def strip_code_fences(text):
+    """
+    Убирает обёртку ```json ... ``` и текст до первой открывающей скобки.
+    Args:
+        text (str): Ответ модели
+    Returns:
+        str: Текст, начинающийся с { или [ (или исходный текст без пробелов, если скобок нет)
+    """
+    match = _FENCE_RE.search(text)
+    if match:
+        text = match.group(1)
+    starts = [position for position in (text.find("{"), text.find("[")) if position != -1]
+    return text[min(starts):] if starts else text.strip()
+
+
+def remove_trailing_commas(text):
+    """
+    Удаляет запятые перед закрывающими скобками вне строк.
+    Args:
+        text (str): JSON-текст
+    Returns:
+        str: Текст без висячих запятых
+    """
+    result = []
+    in_string = False
+    escape = False
+    pending_comma = None
+    for char in text:
+        if in_string:
+            result.append(char)
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        if pending_comma is not None:
+            if char.isspace():
+                pending_comma.append(char)
+                continue
+            if char not in "}]":
+                result.append(",")
+            result.extend(pending_comma)
+            pending_comma = None
+        if char == ",":
+            pending_comma = []
+            continue
+        if char == '"':
+            in_string = True
+        result.append(char)
+    if pending_comma is not None:
+        result.extend(pending_comma)
+    return "".join(result)
+
+
+def close_truncated_json(text):
+    """
+    Дописывает оборванный JSON: закрывает строку-значение и все открытые скобки.
+    Незавершённые ключи, пары без значения и литералы отбрасываются до последнего целого элемента.
+    Args:
+        text (str): JSON-текст, возможно оборванный
+    Returns:
+        str: JSON-текст с закрытыми скобками
+    """
+    stack = []
+    in_string = False
+    escape = False
+    string_is_key = False
+    last_significant = ""
+    safe_index, safe_stack = 0, []
+
+    for index, char in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+                if not string_is_key:
+                    safe_index, safe_stack = index + 1, list(stack)
+                last_significant = '"'
+            continue
+        if char.isspace():
+            continue
+        if char == '"':
+            in_string = True
+            string_is_key = bool(stack) and stack[-1] == "{" and last_significant in ("{", ",")
+        elif char in "{[":
+            stack.append(char)
+            safe_index, safe_stack = index + 1, list(stack)
+        elif char in "}]":
+            if stack:
+                stack.pop()
+            safe_index, safe_stack = index + 1, list(stack)
+        elif char == "," and last_significant not in ("{", "[", ",", ":"):
+            safe_index, safe_stack = index, list(stack)
+        last_significant = char
+
+    if not stack and not in_string:
+        return text
+
+    if in_string and not string_is_key:
+        # Обрыв внутри строки-значения: сохраняем начало строки
+        head = text[:-1] if escape else text
+        return head + '"' + "".join(_CLOSERS[bracket] for bracket in reversed(stack))
+
+    head = text[:safe_index].rstrip()
+    if head.endswith(","):
+        head = head[:-1]
+    return head + "".join(_CLOSERS[bracket] for bracket in reversed(safe_stack))
+
+
+def _decode(text):
+    """Разбирает первый JSON-объект в тексте, игнорируя текст после него."""
+    value, _ = json.JSONDecoder().raw_decode(text)
+    return value
+
+
+def repair_json(text):
+    """
+    Пытается разобрать ответ модели, последовательно применяя локальные исправления.
+    Args:
+        text (str): Ответ модели
+    Returns:
+        tuple: (распарсенное значение или None, был ли текст исправлен)
+    """
+    if not text:
+        return None, False
+    try:
+        return json.loads(text), False
+    except (json.JSONDecodeError, TypeError):
+        pass
+
+    candidate = strip_code_fences(text)
+    repairs = (
+        lambda value: value,
+        remove_trailing_commas,
+        lambda value: remove_trailing_commas(close_truncated_json(remove_trailing_commas(value))),
+    )
+    for repair in repairs:
+        try:
+            return _decode(repair(candidate)), True
+        except (json.JSONDecodeError, ValueError):
+            continue
+    return None, False
+
+
+def conform_to_schema(data, schema):
+    """
+    Проверяет ответ по схеме и приводит типы полей (строка вместо списка и наоборот).
+    Args:
+        data: Распарсенный ответ модели
+        schema (dict): Поле -> ожидаемый тип (list или str)
+    Returns:
+        dict: Ответ с приведёнными полями или None, если это не объект или в нём нет ни одного поля схемы
+    """
+    if not isinstance(data, dict) or not any(field in data for field in schema):
+        return None
+
+    result = dict(data)
+    for field, kind in schema.items():
+        if field not in result or result[field] is None:
+            continue
+        value = result[field]
+        if kind is list:
+            if isinstance(value, str):
+                result[field] = [value] if value.strip() else []
+            elif isinstance(value, list):
+                result[field] = [item if isinstance(item, str) else str(item)
+                                 for item in value if isinstance(item, (str, int, float))]
+            else:
+                result[field] = [str(value)]
+        elif isinstance(value, list):
+            strings = [item for item in value if isinstance(item, str) and item.strip()]
+            result[field] = strings[0] if strings else ""
+        elif not isinstance(value, str):
+            result[field] = str(value)
+    return result
+
+
+def parse_llm_json(text, schema=None, record=True):
+    """
+    Разбирает ответ модели с локальным исправлением и проверкой по схеме.
+    Args:
+        text (str): Ответ модели
+        schema (dict): Схема полей (например, METADATA_SCHEMA) или None без проверки
+        record (bool): Учитывать результат в статистике разбора
+    Returns:
+        dict: Распарсенный ответ или None, если его не удалось восстановить локально
+    """
+    data, repaired = repair_json(text)
+    if data is not None and schema is not None:
+        data = conform_to_schema(data, schema)
+    elif not isinstance(data, dict):
+        data = None
+
+    if data is not None and repaired:
+        logger.info("JSON ответа модели исправлен локально")
+    if record and data is not None:
+        record_repair("local" if repaired else "parsed")
+    return data
@@ -1,51 +1,184 @@
 """
 Пайплайн для обработки документов: загрузка, предобработка текста,
-извлечение и финализация сущностей с использованием GigaChat.
+извлечение и финализация сущностей с использованием LLM.
 """
 
 import json
 import logging
+import time
 import traceback
+
+from django import db
+from django.conf import settings
+
+from apps.enhancer.LLM.prompts.ner_prompt import ner_prompt_3
 from apps.enhancer.models import Document
-from apps.enhancer.processing.pre_processing import load_and_combine_pdf, preprocess_text
-from apps.enhancer.processing.post_processing import extract_and_finalize_entities
+from apps.enhancer.processing.pre_processing import (get_preprocessing_engine, iter_document_text,
+                                                     iter_preprocessed_text)
+from apps.enhancer.processing.post_processing import (extract_chunk_entities,
+                                                      merge_and_finalize_entities)
+from apps.enhancer.processing.stages import IterStage, MapStage, StagedPipeline
+from apps.enhancer.processing.tokens import chunk_token_budget, iter_token_chunks
 from apps.enhancer.processing.wikidata import enrich_with_wikidata
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
-def process_doc_pipeline(doc_path, chunk_size=3000, chunk_overlap=200):
+def build_document_stages(max_tokens, overlap_tokens, chunk_tokens=None, checkpoint=None):
+    """
+    Формирует стадии конвейера обработки документа: очистка страниц -> разбиение на чанки -> LLM.
+    Args:
+        max_tokens (int): Бюджет токенов текста одного чанка
+        overlap_tokens (int): Перекрытие между чанками в токенах
+        chunk_tokens (list): Необязательный список, в который записывается количество токенов каждого чанка
+        checkpoint (ChunkCheckpoint): Контрольные точки чанков; чанки с сохранённым результатом не отправляются в LLM
+    Returns:
+        list: Стадии для StagedPipeline
+    """
+    engine = get_preprocessing_engine()
+
+    def extract(item):
+        if checkpoint is None:
+            return extract_chunk_entities(*item)
+        return checkpoint.extract(*item, extract_chunk_entities)
+
+    def token_chunks(fragments):
+        for chunk, tokens in iter_token_chunks(fragments, max_tokens, overlap_tokens):
+            if chunk_tokens is not None:
+                chunk_tokens.append(tokens)
+            logger.debug(f"Сформирован чанк: {tokens} токенов, {len(chunk)} символов")
+            yield chunk
+
+    return [
+        MapStage(
+            "clean",
+            engine.process,
+            workers=getattr(settings, "PIPELINE_CLEAN_WORKERS", 1),
+        ),
+        IterStage(
+            "chunk",
+            lambda fragments: enumerate(token_chunks(fragments)),
+        ),
+        MapStage(
+            "llm",
+            extract,
+            workers=getattr(settings, "LLM_MAX_CONCURRENCY", 4),
+            # Потоки стадии обращаются к кэшу LLM в БД, закрываем их соединения
+            teardown=lambda: db.connection.close(),
+        ),
+    ]
+
+
+def summarize_chunk_tokens(chunk_tokens, max_tokens):
+    """
+    Сводка по размерам чанков в токенах.
+    Args:
+        chunk_tokens (list): Количество токенов в каждом чанке
+        max_tokens (int): Бюджет токенов чанка
+    Returns:
+        dict: Количество чанков, суммарное/минимальное/максимальное/среднее число токенов и заполнение бюджета
+    """
+    if not chunk_tokens:
+        return {"count": 0, "token_budget": max_tokens}
+    total = sum(chunk_tokens)
+    return {
+        "count": len(chunk_tokens),
+        "token_budget": max_tokens,
+        "tokens_total": total,
+        "tokens_min": min(chunk_tokens),
+        "tokens_max": max(chunk_tokens),
+        "tokens_avg": round(total / len(chunk_tokens), 1),
+        "budget_fill": round(total / (len(chunk_tokens) * max_tokens), 3),
+        "tokens_per_chunk": list(chunk_tokens),
+    }
+
+
+def prepare_document_chunks(doc_path, max_tokens=None, overlap_tokens=None):
+    """
+    Загружает документ, выполняет предобработку и разбивает текст на чанки по бюджету токенов
+    без запросов к LLM (первый шаг распределённой обработки документа). Чанки формируются
+    потоково по мере чтения страниц, поэтому задачи извлечения можно ставить в очередь
+    до окончания загрузки документа.
+    Args:
+        doc_path (str): Путь к файлу документа
+        max_tokens (int): Бюджет токенов чанка (по умолчанию вычисляется из LLM_PROMPT_TOKEN_BUDGET)
+        overlap_tokens (int): Перекрытие между чанками в токенах (по умолчанию LLM_CHUNK_OVERLAP_TOKENS)
+    Yields:
+        tuple: (текст чанка, количество токенов)
+    """
+    if max_tokens is None:
+        max_tokens = chunk_token_budget(ner_prompt_3)
+    if overlap_tokens is None:
+        overlap_tokens = getattr(settings, "LLM_CHUNK_OVERLAP_TOKENS", 100)
+    page_texts = iter_preprocessed_text(iter_document_text(doc_path))
+    yield from iter_token_chunks(page_texts, max_tokens, overlap_tokens)
+
+
+def finalize_chunk_results(entities_list, stage_stats=None):
+    """
+    Объединяет и финализирует сущности, извлечённые из чанков, с замером времени.
+    Args:
+        entities_list (list): Сущности, успешно извлечённые из чанков
+        stage_stats (dict): Необязательный словарь, в который записывается статистика финализации
+    Returns:
+        dict: Финальный JSON с обработанными сущностями или None в случае ошибки
+    """
+    finalize_started_at = time.perf_counter()
+    finalize_stats = {}
+    final_entities = merge_and_finalize_entities(entities_list, stats=finalize_stats)
+    finalize_stats["wall_seconds"] = round(time.perf_counter() - finalize_started_at, 3)
+    if stage_stats is not None:
+        stage_stats["finalize"] = finalize_stats
+    return final_entities
+
+
+def process_doc_pipeline(doc_path, max_tokens=None, overlap_tokens=None, stats=None, checkpoint=None):
     """
-    Пайплайн для обработки PDF: загрузка, предобработка, извлечение и финализация сущностей.
+    Пайплайн для обработки документа: загрузка, предобработка, извлечение и финализация сущностей.
+    Загрузка, очистка, разбиение на чанки и запросы к LLM выполняются параллельно как стадии
+    конвейера с ограниченными очередями, поэтому запросы к LLM начинаются после разбора первых страниц.
+    Чанки заполняются до бюджета токенов промпта (LLM_PROMPT_TOKEN_BUDGET) за вычетом системного промпта.
     Args:
-        pdf_path (str): Путь к PDF-файлу
-        chunk_size (int): Размер чанка (по умолчанию 1000 символов)
-        chunk_overlap (int): Перекрытие между чанками (по умолчанию 200 символов)
+        doc_path (str): Путь к файлу документа
+        max_tokens (int): Бюджет токенов чанка (по умолчанию вычисляется из LLM_PROMPT_TOKEN_BUDGET)
+        overlap_tokens (int): Перекрытие между чанками в токенах (по умолчанию LLM_CHUNK_OVERLAP_TOKENS)
+        stats (dict): Необязательный словарь, в который записываются тайминги стадий и размеры чанков
+        checkpoint (ChunkCheckpoint): Контрольные точки чанков для возобновления обработки после сбоя
     Returns:
         dict: Финальный JSON с обработанными сущностями или None в случае ошибки
     """
     try:
         logger.info(f"Начало обработки документа: {doc_path}")
         
-        # Шаг 1: Загрузка и объединение текста из PDF
-        logger.info("Шаг 1: Загрузка и объединение текста из документа")
-        full_text = load_and_combine_pdf(doc_path)
-        if not full_text:
-            logger.error("Ошибка: не удалось загрузить и объединить текст из документа")
-            return None
-        logger.info(f"Документ успешно загружен, получено {len(full_text)} символов текста")
-
-        # Шаг 2: Предобработка текста
-        logger.info("Шаг 2: Предобработка текста")
-        final_text = preprocess_text(full_text)
-        if not final_text:
-            logger.error("Ошибка: не удалось выполнить предобработку текста")
-            return None
-        logger.info(f"Предобработка завершена, получено {len(final_text)} символов текста после обработки")
-
-        # Шаг 3: Извлечение и финализация сущностей
-        logger.info("Шаг 3: Извлечение и финализация сущностей")
-        final_entities = extract_and_finalize_entities(final_text, chunk_size, chunk_overlap)
+        # Шаги 1-3: Загрузка, предобработка, разбиение на чанки и извлечение сущностей (конвейер)
+        logger.info("Шаги 1-3: Конвейерная загрузка, предобработка и извлечение сущностей")
+        if max_tokens is None:
+            max_tokens = chunk_token_budget(ner_prompt_3)
+        if overlap_tokens is None:
+            overlap_tokens = getattr(settings, "LLM_CHUNK_OVERLAP_TOKENS", 100)
+        chunk_tokens = []
+        pipeline = StagedPipeline(
+            build_document_stages(max_tokens, overlap_tokens, chunk_tokens, checkpoint),
+            queue_size=getattr(settings, "PIPELINE_QUEUE_SIZE", 8),
+        )
+        chunk_results, stage_stats = pipeline.run(iter_document_text(doc_path), source_name="load")
+        entities_list = [entities for entities in chunk_results if entities]
+        stage_stats["chunks"] = summarize_chunk_tokens(chunk_tokens, max_tokens)
+        if checkpoint is not None:
+            stage_stats["checkpoints"] = checkpoint.get_stats()
+        logger.info(
+            f"Обработано {len(entities_list)}/{len(chunk_results)} чанков, "
+            f"токенов в чанках: {stage_stats['chunks'].get('tokens_total', 0)} (бюджет чанка {max_tokens})"
+        )
+        
+        # Шаг 4: Объединение и финализация сущностей
+        logger.info("Шаг 4: Объединение и финализация сущностей")
+        final_entities = finalize_chunk_results(entities_list, stage_stats)
+        
+        logger.info(f"Тайминги стадий обработки документа: {stage_stats}")
+        if stats is not None:
+            stats.update(stage_stats)
+        
         if not final_entities:
             logger.error("Ошибка: не удалось извлечь сущности")
             return None
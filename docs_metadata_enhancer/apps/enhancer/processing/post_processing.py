@@ -1,17 +1,29 @@
 import json
 import logging
 import traceback
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
-from apps.enhancer.LLM.sber.giga_chat import finalize_entities, process_text_with_gigachat
-from apps.enhancer.processing.pre_processing import split_text
+from django import db
+from django.conf import settings
+
+from apps.enhancer.LLM.cache import get_cache_stats
+from apps.enhancer.LLM.client import LLMError
+from apps.enhancer.LLM.entities import extract_entities, finalize_entities
+from apps.enhancer.LLM.prompts.ner_prompt import finalize_prompt
+from apps.enhancer.processing.entity_merge import carry_counts, compact_candidates, rank_entities, weighted_candidates
+from apps.enhancer.processing.finalization import build_local_result, finalize_with_policy
+from apps.enhancer.processing.json_repair import get_repair_stats
+from apps.enhancer.processing.pre_processing import iter_chunks
+from apps.enhancer.processing.tokens import chunk_token_budget, count_tokens
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
  
 def merge_entities(entities_list):
     """
-    Объединяет сущности из списка без удаления дубликатов.
+    Объединяет сущности из списка с локальным удалением дубликатов.
+    Варианты одного значения (регистр, транслитерация, формы слова, опечатки) объединяются,
+    значения каждого поля упорядочиваются по частоте и сокращаются до компактного набора кандидатов.
     Args:
         entities_list (list): Список словарей с сущностями
     Returns:
@@ -20,45 +32,20 @@ def merge_entities(entities_list):
     try:
         logger.info(f"Начало объединения сущностей из {len(entities_list)} источников")
         
-        merged = {
-            "creator": [],
-            "organizations": [],
-            "title": [],
-            "keywords": [],
-            "dates": [],
-            "summary": [],
-            "subject": [],
-            "document_language": [],
-            "identifier": [],
-            "contributor": [],
-            "rights": []
-        }
-        
         for i, entities in enumerate(entities_list):
             if not entities:
                 logger.warning(f"Источник #{i+1} не содержит сущностей, пропускаем")
                 continue
-                
-            logger.info(f"Обработка источника #{i+1}. Найденные ключи: {list(entities.keys())}")
-            merged["creator"].extend(entities.get("creator", []))
-            merged["organizations"].extend(entities.get("organizations", []))
-            merged["keywords"].extend(entities.get("keywords", []))
-            merged["dates"].extend(entities.get("dates", []))
-            merged["subject"].extend(entities.get("subject", []))
-            merged["contributor"].extend(entities.get("contributor", []))
-            if entities.get("title"):
-                merged["title"].append(entities["title"])
-            if entities.get("summary"):
-                merged["summary"].append(entities["summary"])
-            if entities.get("document_language"):
-                merged["document_language"].append(entities["document_language"])
-            if entities.get("identifier"):
-                merged["identifier"].append(entities["identifier"])
-            if entities.get("rights"):
-                merged["rights"].append(entities["rights"])
+            logger.debug(f"Обработка источника #{i+1}. Найденные ключи: {list(entities.keys())}")
         
-        # Логирование статистики по объединенным сущностям
-        stats = {key: len(value) for key, value in merged.items()}
+        ranked = rank_entities(entities_list)
+        merged = compact_candidates(ranked)
+        
+        # Логирование статистики по объединенным сущностям: кандидатов / всего упоминаний
+        stats = {
+            field: f"{len(merged[field])}/{sum(candidate['count'] for candidate in candidates)}"
+            for field, candidates in ranked.items()
+        }
         logger.info(f"Объединение сущностей завершено: {stats}")
         
         return merged
@@ -68,66 +55,268 @@ def merge_entities(entities_list):
         return None
 
 
-def extract_and_finalize_entities(text, chunk_size=1000, chunk_overlap=200):
+def extract_chunk_entities(index, chunk, total=None, raise_retryable=False):
+    """
+    Извлекает сущности из одного чанка. Ошибка в чанке не влияет на остальные чанки.
+    Args:
+        index (int): Порядковый номер чанка (с нуля)
+        chunk (str): Текст чанка
+        total (int): Общее количество чанков (неизвестно при потоковой обработке)
+        raise_retryable (bool): Пробрасывать временные ошибки LLM (см. extract_entities)
+    Returns:
+        dict: Извлечённые сущности или None в случае ошибки
+    Raises:
+        LLMError: Временная ошибка LLM, если raise_retryable
+    """
+    position = f"{index+1}/{total}" if total else f"{index+1}"
+    logger.info(f"Обработка чанка {position}, длина чанка: {len(chunk)} символов")
+    try:
+        entities = extract_entities(chunk, raise_retryable=raise_retryable)
+        if entities:
+            logger.info(f"Чанк {index+1}: успешно извлечены сущности - {list(entities.keys())}")
+            return entities
+        logger.error(f"Чанк {index+1}: не удалось извлечь сущности")
+    except Exception as chunk_error:
+        logger.error(f"Ошибка при обработке чанка {index+1}: {str(chunk_error)}")
+        if raise_retryable and isinstance(chunk_error, LLMError) and chunk_error.retryable:
+            raise
+        logger.error(traceback.format_exc())
+    return None
+
+
+def extract_chunk_entities_in_thread(index, chunk, total=None, checkpoint=None):
     """
-    Разбивает текст на чанки, извлекает сущности с помощью GigaChat и выполняет финальную обработку.
+    Обёртка для запуска в пуле потоков: закрывает соединение с БД потока (используется кэшем LLM).
+    """
+    try:
+        if checkpoint is not None:
+            return checkpoint.extract(index, chunk, lambda i, text: extract_chunk_entities(i, text, total))
+        return extract_chunk_entities(index, chunk, total)
+    finally:
+        db.connection.close()
+
+
+def extract_entities_from_chunks(chunks, max_workers=None, checkpoint=None):
+    """
+    Извлекает сущности из чанков параллельно, ограничивая число одновременных запросов к LLM.
+    Чанки могут поступать из генератора: запрос к LLM по каждому чанку отправляется
+    сразу после его получения, не дожидаясь окончания загрузки документа.
     Args:
-        final_text (str): Текст для обработки
+        chunks (Iterable[str]): Текстовые чанки (список или генератор)
+        max_workers (int): Максимум одновременных запросов (по умолчанию LLM_MAX_CONCURRENCY)
+        checkpoint (ChunkCheckpoint): Контрольные точки чанков; чанки с сохранённым результатом не отправляются в LLM
+    Returns:
+        list: Результаты в порядке чанков (None для чанков, обработанных с ошибкой)
+    """
+    total = len(chunks) if hasattr(chunks, '__len__') else None
+    if max_workers is None:
+        max_workers = getattr(settings, "LLM_MAX_CONCURRENCY", 4)
+    max_workers = max(1, int(max_workers))
+    if total is not None:
+        max_workers = min(max_workers, total or 1)
+
+    if max_workers == 1:
+        if checkpoint is not None:
+            return [checkpoint.extract(i, chunk, lambda i, text: extract_chunk_entities(i, text, total))
+                    for i, chunk in enumerate(chunks)]
+        return [extract_chunk_entities(i, chunk, total) for i, chunk in enumerate(chunks)]
+
+    logger.info(f"Параллельная обработка чанков, одновременных запросов: {max_workers}")
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-chunk") as executor:
+        futures = [
+            executor.submit(extract_chunk_entities_in_thread, i, chunk, total, checkpoint)
+            for i, chunk in enumerate(chunks)
+        ]
+        # Результаты собираются в порядке чанков, а не в порядке завершения
+        return [future.result() for future in futures]
+
+
+def _entities_tokens(entities):
+    # Частоты частичных результатов в запрос к LLM не попадают
+    values = {
+        field: [item["value"] if isinstance(item, dict) else item for item in value]
+        if isinstance(value, list) else value
+        for field, value in entities.items()
+    }
+    return count_tokens(json.dumps(values, ensure_ascii=False))
+
+
+def group_partial_results(partials, token_budget, fan_in):
+    """
+    Разбивает частичные результаты на группы для параллельной свёртки.
+    В группу добавляются результаты, пока их суммарный размер помещается в бюджет токенов
+    и их не больше fan_in. Каждая группа (кроме, возможно, последней) содержит не меньше двух
+    результатов, поэтому количество результатов на каждом уровне свёртки уменьшается минимум вдвое.
+    Args:
+        partials (list): Частичные результаты (словари сущностей)
+        token_budget (int): Бюджет токенов входного JSON одного запроса финализации
+        fan_in (int): Максимальное количество результатов в группе
+    Returns:
+        list: Список групп (списков частичных результатов)
+    """
+    groups = []
+    group, group_tokens = [], 0
+    for partial in partials:
+        tokens = _entities_tokens(partial)
+        if len(group) >= 2 and (group_tokens + tokens > token_budget or len(group) >= fan_in):
+            groups.append(group)
+            group, group_tokens = [], 0
+        group.append(partial)
+        group_tokens += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+
+def _reduce_group(ranked):
+    """
+    Свёртка группы частичных результатов с помощью LLM.
+    Результат получает частоты кандидатов группы, чтобы следующий уровень ранжировал значения
+    по частотам в исходных чанках. При ошибке возвращаются кандидаты группы, чтобы не потерять сущности.
+    Args:
+        ranked (dict): Результат rank_entities для группы
+    Returns:
+        dict: Частичный результат с частотами (поле -> [{"value", "count"}])
+    """
+    reduced = finalize_entities(compact_candidates(ranked))
+    return carry_counts(reduced, ranked) if reduced else weighted_candidates(ranked)
+
+
+def _reduce_group_in_thread(ranked):
+    """
+    Обёртка для запуска в пуле потоков: закрывает соединение с БД потока (используется кэшем LLM).
+    """
+    try:
+        return _reduce_group(ranked)
+    finally:
+        db.connection.close()
+
+
+def reduce_entities(entities_list, max_workers=None, stats=None):
+    """
+    Иерархическая (map-reduce) финализация сущностей.
+    Сущности объединяются и дедуплицируются локально (rank_entities); если результат не помещается в один
+    запрос финализации, частичные результаты сворачиваются группами параллельно, пока
+    не останется один запрос. Количество уровней свёртки растёт логарифмически от числа чанков.
+    Частоты значений в чанках переносятся между уровнями, а при ошибке финального запроса
+    результат собирается локально (как при ошибке свёртки группы).
+    Args:
+        entities_list (list): Сущности, извлечённые из чанков
+        max_workers (int): Максимум одновременных запросов (по умолчанию LLM_MAX_CONCURRENCY)
+        stats (dict): Необязательный словарь для статистики (уровни, запросы к LLM)
+    Returns:
+        dict: Финальный JSON с обработанными сущностями
+    """
+    if max_workers is None:
+        max_workers = getattr(settings, "LLM_MAX_CONCURRENCY", 4)
+    max_workers = max(1, int(max_workers))
+    fan_in = max(2, int(getattr(settings, "LLM_FINALIZE_FAN_IN", 8)))
+    token_budget = chunk_token_budget(finalize_prompt)
+    reduce_stats = {"levels": 0, "llm_calls": 0, "token_budget": token_budget}
+
+    partials = list(entities_list)
+    while True:
+        ranked = rank_entities(partials)
+        merged = compact_candidates(ranked)
+        merged_tokens = _entities_tokens(merged)
+        if len(partials) == 1 or merged_tokens <= token_budget:
+            break
+
+        groups = group_partial_results(partials, token_budget, fan_in)
+        reduce_stats["levels"] += 1
+        reduce_stats["llm_calls"] += len(groups)
+        logger.info(
+            f"Уровень свёртки {reduce_stats['levels']}: {len(partials)} результатов "
+            f"({merged_tokens} токенов) -> {len(groups)} групп"
+        )
+        group_ranked = [rank_entities(group) for group in groups]
+        workers = min(max_workers, len(group_ranked))
+        if workers == 1:
+            partials = [_reduce_group(ranked) for ranked in group_ranked]
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-reduce") as executor:
+                partials = list(executor.map(_reduce_group_in_thread, group_ranked))
+
+    logger.info(f"Финальный запрос: {len(partials)} результатов, {merged_tokens} токенов")
+    reduce_stats["llm_calls"] += 1
+    final_entities = finalize_entities(merged)
+    if not final_entities:
+        logger.warning("Финальный запрос не удался, используется локальный результат")
+        final_entities = build_local_result(ranked)
+    if stats is not None:
+        stats.update(reduce_stats)
+    logger.info(f"Статистика свёртки сущностей: {reduce_stats}")
+    return final_entities
+
+
+def merge_and_finalize_entities(entities_list, stats=None, policy=None):
+    """
+    Объединяет сущности из всех чанков и выполняет их финальную обработку.
+    Политика финализации решает, нужен ли запрос к LLM: для коротких документов результат
+    собирается локально, при небольшом числе конфликтов в LLM отправляются только спорные поля,
+    иначе выполняется иерархическая финализация.
+    Args:
+        entities_list (list): Сущности, успешно извлечённые из чанков
+        stats (dict): Необязательный словарь для статистики финализации
+        policy (FinalizationPolicy): Политика финализации (по умолчанию FinalizationPolicy())
+    Returns:
+        dict: Финальный JSON с обработанными сущностями или None в случае ошибки
+    """
+    if not entities_list:
+        logger.error("Все чанки обработаны с ошибкой, нет данных для объединения")
+        return None
+        
+    # Объединение, дедупликация и свёртка сущностей
+    logger.info(f"Объединение и финальная обработка сущностей из {len(entities_list)} чанков")
+    try:
+        final_entities = finalize_with_policy(
+            entities_list,
+            finalize_func=finalize_entities,
+            reduce_func=lambda partials: reduce_entities(partials, stats=stats),
+            policy=policy,
+            stats=stats,
+        )
+        if not final_entities:
+            logger.error("Не удалось выполнить финальную обработку сущностей")
+            return None
+        logger.info(f"Финальная обработка завершена успешно. Итоговые сущности: {list(final_entities.keys())}")
+        logger.info(f"Статистика кэша LLM: {get_cache_stats()}")
+        logger.info(f"Статистика разбора ответов LLM: {get_repair_stats()}")
+        return final_entities
+    except Exception as finalize_error:
+        logger.error(f"Ошибка при финальной обработке сущностей: {str(finalize_error)}")
+        logger.error(traceback.format_exc())
+        return None
+
+
+def extract_and_finalize_entities(text, chunk_size=1000, chunk_overlap=200, max_workers=None):
+    """
+    Разбивает текст на чанки, извлекает сущности с помощью LLM и выполняет финальную обработку.
+    Args:
+        text (str | Iterable[str]): Текст для обработки или поток его фрагментов (например, страниц)
         chunk_size (int): Размер чанка (по умолчанию 1000 символов)
         chunk_overlap (int): Перекрытие между чанками (по умолчанию 200 символов)
+        max_workers (int): Максимум одновременных запросов к LLM (по умолчанию LLM_MAX_CONCURRENCY)
     Returns:
         dict: Финальный JSON с обработанными сущностями или None в случае ошибки
     """
     try:
-        logger.info(f"Начало извлечения сущностей из текста длиной {len(text)} символов")
+        if isinstance(text, str):
+            logger.info(f"Начало извлечения сущностей из текста длиной {len(text)} символов")
+            fragments = [text]
+        else:
+            logger.info("Начало потокового извлечения сущностей из фрагментов текста")
+            fragments = text
         logger.info(f"Параметры: chunk_size={chunk_size}, chunk_overlap={chunk_overlap}")
         
-        # Разбиваем текст на чанки
-        chunks = split_text(text, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-        logger.info(f"Текст разбит на {len(chunks)} чанков")
+        # Чанки формируются потоково и сразу отправляются в LLM с ограниченной параллельностью
+        chunks = iter_chunks(fragments, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        chunk_results = extract_entities_from_chunks(chunks, max_workers=max_workers)
+        entities_list = [entities for entities in chunk_results if entities]
         
-        # Обрабатываем каждый чанк с GigaChat
-        entities_list = []
-        for i, chunk in enumerate(chunks):
-            logger.info(f"Обработка чанка {i+1}/{len(chunks)}, длина чанка: {len(chunk)} символов")
-            
-            try:
-                entities = process_text_with_gigachat(chunk)
-                if entities:
-                    logger.info(f"Чанк {i+1}: успешно извлечены сущности - {list(entities.keys())}")
-                    entities_list.append(entities)
-                else:
-                    logger.error(f"Чанк {i+1}: не удалось извлечь сущности")
-            except Exception as chunk_error:
-                logger.error(f"Ошибка при обработке чанка {i+1}: {str(chunk_error)}")
-                logger.error(traceback.format_exc())
+        logger.info(f"Обработано {len(entities_list)}/{len(chunk_results)} чанков")
         
-        logger.info(f"Обработано {len(entities_list)}/{len(chunks)} чанков")
-        
-        if not entities_list:
-            logger.error("Все чанки обработаны с ошибкой, нет данных для объединения")
-            return None
-            
-        # Объединяем сущности
-        logger.info("Объединение сущностей из всех чанков")
-        merged_entities = merge_entities(entities_list)
-        if not merged_entities:
-            logger.error("Не удалось объединить сущности")
-            return None
-            
-        # Финальная обработка сущностей
-        logger.info("Финальная обработка сущностей с помощью GigaChat")
-        try:
-            final_entities = finalize_entities(merged_entities)
-            if not final_entities:
-                logger.error("Не удалось выполнить финальную обработку сущностей")
-                return None
-            logger.info(f"Финальная обработка завершена успешно. Итоговые сущности: {list(final_entities.keys())}")
-            return final_entities
-        except Exception as finalize_error:
-            logger.error(f"Ошибка при финальной обработке сущностей: {str(finalize_error)}")
-            logger.error(traceback.format_exc())
-            return None
+        return merge_and_finalize_entities(entities_list)
     
     except Exception as e:
         logger.error(f"Ошибка при извлечении и финализации сущностей: {str(e)}")
@@ -1,18 +1,23 @@
 import logging
 import os
 import re
+import threading
 import traceback
-from typing import List
+from collections import deque
+from typing import Iterable, Iterator, List
 
 import nltk
 from nltk.corpus import stopwords
 
-from langchain.text_splitter import CharacterTextSplitter, TextSplitter
-from apps.enhancer.loaders.document_loader import load_document
+from apps.enhancer.loaders.document_loader import iter_document, load_document
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
+# Регулярные выражения очистки компилируются один раз при импорте модуля
+_NEWLINES_RE = re.compile(r'\n+')
+_WHITESPACE_RE = re.compile(r'\s+')
+
 # Инициализация NLTK один раз при запуске
 def init_nltk():
     """
@@ -22,14 +27,15 @@ def init_nltk():
         # Указываем путь для NLTK-данных (локально и для сервера)
         nltk_data_path = os.getenv("NLTK_DATA", "./nltk_data")
         os.makedirs(nltk_data_path, exist_ok=True)
-        nltk.data.path.append(nltk_data_path)
+        if nltk_data_path not in nltk.data.path:
+            nltk.data.path.append(nltk_data_path)
         
         # Проверяем наличие данных
         required_datasets = ['stopwords']
         for dataset in required_datasets:
             try:
-                resource_path ='corpora/{dataset}'
-                nltk.data.find(nltk_data_path)
+                resource_path = f'corpora/{dataset}'
+                nltk.data.find(resource_path)
                 logger.info(f"NLTK dataset '{dataset}' already exists")
             except LookupError:
                 logger.info(f"Downloading NLTK dataset '{dataset}' to {nltk_data_path}")
@@ -37,6 +43,59 @@ def init_nltk():
     except Exception as e:
         logging.error(f"Ошибка инициализации NLTK: {e}")
         raise
+
+
+class PreprocessingEngine:
+    """
+    Движок предобработки текста. Создаётся один раз на процесс воркера (см. get_preprocessing_engine):
+    хранит frozenset стоп-слов и выполняет очистку и удаление стоп-слов за один проход по тексту.
+    """
+
+    def __init__(self, stop_words=None):
+        if stop_words is None:
+            stop_words = load_stopwords()
+        self.stop_words = frozenset(stop_words)
+
+    def clean(self, text):
+        """
+        Заменяет любые последовательности пробельных символов одним пробелом.
+        Args:
+            text (str): Исходный текст
+        Returns:
+            str: Очищенный текст
+        """
+        return _WHITESPACE_RE.sub(' ', text).strip()
+
+    def process(self, text):
+        """
+        Очищает текст и удаляет стоп-слова за один проход.
+        str.split() без аргументов уже схлопывает пробельные символы и отбрасывает их по краям,
+        поэтому результат совпадает с последовательным вызовом clean_text и remove_stopwords.
+        Args:
+            text (str): Исходный текст
+        Returns:
+            str: Предобработанный текст
+        """
+        stop_words = self.stop_words
+        return ' '.join([word for word in text.split() if word.lower() not in stop_words])
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_preprocessing_engine():
+    """
+    Возвращает движок предобработки текущего процесса, создавая его при первом вызове.
+    Returns:
+        PreprocessingEngine: Движок предобработки
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = PreprocessingEngine()
+    return _engine
     
     
 def clean_text(text: str) -> str:
@@ -51,10 +110,10 @@ def clean_text(text: str) -> str:
         logger.info(f"Начало очистки текста длиной {len(text)} символов")
         
         # Заменяем множественные переносы строк на одинарные
-        cleaned_text = re.sub(r'\n+', '\n', text)
+        cleaned_text = _NEWLINES_RE.sub('\n', text)
         
         # Заменяем множественные пробелы на одинарные
-        cleaned_text = re.sub(r'\s+', ' ', cleaned_text)
+        cleaned_text = _WHITESPACE_RE.sub(' ', cleaned_text)
         
         # Удаляем пробелы в начале и конце строки
         cleaned_text = cleaned_text.strip()
@@ -67,6 +126,70 @@ def clean_text(text: str) -> str:
         return text  # Возвращаем исходный текст в случае ошибки
 
 
+def merge_word_stream(fragments: Iterable[str], chunk_size, chunk_overlap, separator=" ", length_function=len):
+    """
+    Потоково собирает слова из фрагментов в чанки по алгоритму TextSplitter._merge_splits.
+    Args:
+        fragments (Iterable[str]): Фрагменты текста
+        chunk_size (int): Максимальный размер чанка в единицах length_function
+        chunk_overlap (int): Максимальное перекрытие между чанками в единицах length_function
+        separator (str): Разделитель слов
+        length_function (callable): Функция длины (символы, токены и т.п.)
+    Yields:
+        tuple: (текст чанка, его длина в единицах length_function)
+    """
+    separator_len = length_function(separator)
+    current_doc = deque()
+    current_lens = deque()
+    total = 0
+
+    for fragment in fragments:
+        for word in fragment.split(separator):
+            if not word:
+                continue
+            word_len = length_function(word)
+            if total + word_len + (separator_len if current_doc else 0) > chunk_size:
+                if total > chunk_size:
+                    logger.warning(f"Создан чанк размером {total}, превышающим заданный {chunk_size}")
+                if current_doc:
+                    chunk = separator.join(current_doc).strip()
+                    if chunk:
+                        yield chunk, total
+                    # Оставляем хвост не длиннее chunk_overlap, в который помещается следующее слово
+                    while total > chunk_overlap or (
+                        total + word_len + (separator_len if current_doc else 0) > chunk_size
+                        and total > 0
+                    ):
+                        total -= current_lens[0] + (separator_len if len(current_doc) > 1 else 0)
+                        current_doc.popleft()
+                        current_lens.popleft()
+            current_doc.append(word)
+            current_lens.append(word_len)
+            total += word_len + (separator_len if len(current_doc) > 1 else 0)
+
+    chunk = separator.join(current_doc).strip()
+    if chunk:
+        yield chunk, total
+
+
+def iter_chunks(fragments: Iterable[str], chunk_size=4000, chunk_overlap=200, separator=" ") -> Iterator[str]:
+    """
+    Потоково разбивает текст на чанки по мере поступления фрагментов.
+    Семантика размера и перекрытия совпадает с CharacterTextSplitter(separator=" "):
+    слова накапливаются до chunk_size символов, а следующий чанк начинается
+    с хвоста предыдущего длиной не более chunk_overlap символов.
+    Args:
+        fragments (Iterable[str]): Фрагменты текста (например, предобработанные страницы)
+        chunk_size (int): Максимальный размер чанка в символах
+        chunk_overlap (int): Максимальное перекрытие между чанками в символах
+        separator (str): Разделитель слов
+    Yields:
+        str: Очередной чанк текста
+    """
+    for chunk, _ in merge_word_stream(fragments, chunk_size, chunk_overlap, separator):
+        yield chunk
+
+
 def split_text(text, chunk_size=4000, chunk_overlap=200):
     """
     Split text into chunks for processing
@@ -78,35 +201,38 @@ def split_text(text, chunk_size=4000, chunk_overlap=200):
         list: List of text chunks
     """
     try:
-        text_splitter= CharacterTextSplitter(
-            separator=" ", 
-            chunk_size=chunk_size, 
-            chunk_overlap=chunk_overlap, 
-        )
-        chunks= text_splitter.split_text(text)
-        print(f"Created {len(chunks)} chunks")
-        for i, chunk in enumerate(chunks):
-            print(f"Chunk {i+1} length: {len(chunk)} characters")
+        chunks = list(iter_chunks([text], chunk_size=chunk_size, chunk_overlap=chunk_overlap))
+        logger.info(f"Создано {len(chunks)} чанков")
         return chunks
     
     except Exception as e:
-        print(f"Error splitting text: {e}")
-        # Ручное разбиение как запасной вариант
+        logger.error(f"Ошибка при разбиении текста на чанки: {e}")
         raise
 
         
-def remove_stopwords(text):
+def load_stopwords():
+    """
+    Загружает объединённый набор русских и английских стоп-слов.
+    Returns:
+        set: Набор стоп-слов
+    """
+    init_nltk()
+    stop_words_ru = set(stopwords.words('russian'))
+    stop_words_en = set(stopwords.words('english'))
+    return stop_words_ru.union(stop_words_en)
+
+
+def remove_stopwords(text, stop_words=None):
     """
     Remove stopwords from text to reduce token count
     Args:
         text (str): Input text
+        stop_words (set): Stopword set (the per-process engine's set if not given)
     Returns:
         str: Text with stopwords removed
     """
-    init_nltk()
-    stop_words_ru = set(stopwords.words('russian'))
-    stop_words_en = set(stopwords.words('english'))
-    stop_words = stop_words_ru.union(stop_words_en)
+    if stop_words is None:
+        stop_words = get_preprocessing_engine().stop_words
     # Разбиваем текст на слова
     words = text.split()
     # Удаляем стоп-слова, сохраняя структуру
@@ -132,6 +258,34 @@ def load_and_combine_pdf(pdf_path):
         logging.error(f"Ошибка при загрузке PDF: {e}")
         return None
 
+def iter_document_text(doc_path):
+    """
+    Потоково загружает документ и возвращает текст страниц по одной.
+    Args:
+        doc_path (str): Путь к файлу документа
+    Yields:
+        str: Текст очередной страницы
+    """
+    for page in iter_document(doc_path):
+        if page.page_content:
+            yield page.page_content
+
+
+def iter_preprocessed_text(page_texts):
+    """
+    Очищает текст и удаляет стоп-слова постранично, не собирая документ в одну строку.
+    Args:
+        page_texts (Iterable[str]): Тексты страниц
+    Yields:
+        str: Предобработанный текст очередной страницы (пустые страницы пропускаются)
+    """
+    engine = get_preprocessing_engine()
+    for page_text in page_texts:
+        final_text = engine.process(page_text)
+        if final_text:
+            yield final_text
+
+
 def preprocess_text(full_text):
     """
     Очищает текст и удаляет стоп-слова.
@@ -144,9 +298,8 @@ def preprocess_text(full_text):
         if not full_text:
             logging.error("Ошибка: входной текст пуст")
             return None
-        cleaned_text = clean_text(full_text)
-        final_text = remove_stopwords(cleaned_text)
-        return final_text
+        return get_preprocessing_engine().process(full_text)
     except Exception as e:
         logging.error(f"Ошибка при предобработке текста: {e}")
-        return None
\ No newline at end of file
+        return None
+
@@ -0,0 +1,326 @@
+"""
+Конвейер из стадий (producer/consumer) с ограниченными очередями между ними.
+
+Каждая стадия работает в своих потоках и передаёт элементы следующей стадии через
+queue.Queue ограниченного размера: если следующая стадия не успевает, предыдущая
+блокируется на записи (backpressure). Благодаря этому разбор документа (CPU) и
+запросы к LLM (сеть) выполняются одновременно, а в памяти одновременно находится
+не больше нескольких страниц и чанков.
+
+Элементы передаются парами (index, value). MapStage сохраняет индексы элементов,
+IterStage получает значения строго по порядку индексов и нумерует свои результаты заново.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Маркер конца потока
+_END = object()
+# Маркер аварийной остановки конвейера
+_STOPPED = object()
+
+# Интервал проверки флага остановки при ожидании очереди (сек)
+_POLL_INTERVAL = 0.1
+
+
+class StageStats:
+    """Статистика выполнения стадии"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def add(self, items_in=0, items_out=0, busy=0.0, blocked=0.0):
+        with self._lock:
+            self.items_in += items_in
+            self.items_out += items_out
+            self.busy_seconds += busy
+            self.blocked_seconds += blocked
+
+    def mark_started(self):
+        with self._lock:
+            if self.started_at is None:
+                self.started_at = time.perf_counter()
+
+    def mark_finished(self):
+        with self._lock:
+            self.finished_at = time.perf_counter()
+
+    def as_dict(self, pipeline_started_at):
+        """
+        Возвращает статистику в виде словаря.
+        Args:
+            pipeline_started_at (float): Время запуска конвейера (perf_counter)
+        Returns:
+            dict: items_in, items_out, busy_seconds (время работы функции стадии),
+                  blocked_seconds (ожидание места в очереди следующей стадии),
+                  start_offset и wall_seconds (от первого до последнего элемента)
+        """
+        started = self.started_at or pipeline_started_at
+        finished = self.finished_at or started
+        return {
+            "workers": self.workers,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "blocked_seconds": round(self.blocked_seconds, 3),
+            "start_offset": round(started - pipeline_started_at, 3),
+            "wall_seconds": round(finished - started, 3),
+        }
+
+
+class MapStage:
+    """
+    Стадия, применяющая функцию к каждому элементу в нескольких потоках.
+    Args:
+        name (str): Название стадии
+        func (callable): Функция value -> result
+        workers (int): Количество потоков
+        teardown (callable): Вызывается в каждом потоке стадии при его завершении
+    """
+
+    def __init__(self, name, func, workers=1, teardown=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.teardown = teardown
+
+
+class IterStage:
+    """
+    Стадия, преобразующая упорядоченный поток значений в новый поток (например, разбиение на чанки).
+    Выполняется в одном потоке.
+    Args:
+        name (str): Название стадии
+        func (callable): Функция Iterable -> Iterable
+    """
+
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+        self.workers = 1
+        self.teardown = None
+
+
+class StagedPipeline:
+    """
+    Конвейер стадий с ограниченными очередями.
+    Args:
+        stages (list): Список MapStage/IterStage
+        queue_size (int): Максимальный размер очереди между стадиями
+    """
+
+    def __init__(self, stages, queue_size=8):
+        self.stages = stages
+        self.queue_size = max(1, int(queue_size))
+        self._stop = threading.Event()
+        self._error = None
+        self._error_lock = threading.Lock()
+
+    # --- Работа с очередями с учётом аварийной остановки ---
+
+    def _put(self, q, item):
+        started = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        return time.perf_counter() - started
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _STOPPED
+
+    def _fail(self, stage_name, error):
+        with self._error_lock:
+            if self._error is None:
+                self._error = error
+                logger.error(f"Стадия '{stage_name}' завершилась с ошибкой: {str(error)}", exc_info=True)
+        self._stop.set()
+
+    # --- Потоки стадий ---
+
+    def _run_source(self, source, out_q, stats):
+        try:
+            iterator = iter(source)
+            index = 0
+            while not self._stop.is_set():
+                started = time.perf_counter()
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    break
+                stats.mark_started()
+                busy = time.perf_counter() - started
+                blocked = self._put(out_q, (index, value))
+                stats.add(items_out=1, busy=busy, blocked=blocked)
+                index += 1
+        except Exception as e:
+            self._fail(stats.name, e)
+        finally:
+            stats.mark_finished()
+            self._put(out_q, _END)
+
+    def _run_map_worker(self, stage, in_q, out_q, stats, active, active_lock):
+        try:
+            while True:
+                item = self._get(in_q)
+                if item is _STOPPED:
+                    return
+                if item is _END:
+                    # Возвращаем маркер для остальных потоков этой стадии
+                    self._put(in_q, _END)
+                    break
+                index, value = item
+                stats.mark_started()
+                started = time.perf_counter()
+                result = stage.func(value)
+                busy = time.perf_counter() - started
+                blocked = self._put(out_q, (index, result))
+                stats.add(items_in=1, items_out=1, busy=busy, blocked=blocked)
+        except Exception as e:
+            self._fail(stage.name, e)
+        finally:
+            if stage.teardown:
+                try:
+                    stage.teardown()
+                except Exception as e:
+                    logger.warning(f"Ошибка при завершении потока стадии '{stage.name}': {str(e)}")
+            with active_lock:
+                active[0] -= 1
+                is_last = active[0] == 0
+            if is_last:
+                stats.mark_finished()
+                self._put(out_q, _END)
+
+    def _ordered_values(self, in_q, stats):
+        """Читает очередь и отдаёт значения строго по порядку индексов."""
+        buffer = {}
+        next_index = 0
+        while True:
+            item = self._get(in_q)
+            if item is _STOPPED:
+                return
+            if item is _END:
+                break
+            index, value = item
+            stats.add(items_in=1)
+            buffer[index] = value
+            while next_index in buffer:
+                yield buffer.pop(next_index)
+                next_index += 1
+        for index in sorted(buffer):
+            yield buffer[index]
+
+    def _run_iter_stage(self, stage, in_q, out_q, stats):
+        try:
+            index = 0
+            iterator = iter(stage.func(self._ordered_values(in_q, stats)))
+            while not self._stop.is_set():
+                started = time.perf_counter()
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    break
+                stats.mark_started()
+                # Время работы включает ожидание входных данных, т.к. генератор читает их сам
+                busy = time.perf_counter() - started
+                blocked = self._put(out_q, (index, value))
+                stats.add(items_out=1, busy=busy, blocked=blocked)
+                index += 1
+        except Exception as e:
+            self._fail(stage.name, e)
+        finally:
+            stats.mark_finished()
+            self._put(out_q, _END)
+
+    # --- Запуск ---
+
+    def run(self, source, source_name="source", sink=None):
+        """
+        Запускает конвейер и дожидается его завершения.
+        Args:
+            source (Iterable): Источник элементов первой стадии
+            source_name (str): Название стадии-источника для статистики
+            sink (callable): Необязательный обработчик (index, value) результатов последней стадии
+        Returns:
+            tuple: (список результатов последней стадии в порядке индексов, статистика по стадиям)
+        Raises:
+            Exception: Первая ошибка, возникшая в любой из стадий
+        """
+        pipeline_started_at = time.perf_counter()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        all_stats = [StageStats(source_name, 1)] + [StageStats(stage.name, stage.workers) for stage in self.stages]
+        threads = [
+            threading.Thread(
+                target=self._run_source, args=(source, queues[0], all_stats[0]),
+                name=f"stage-{source_name}", daemon=True,
+            )
+        ]
+
+        for position, stage in enumerate(self.stages):
+            in_q, out_q, stats = queues[position], queues[position + 1], all_stats[position + 1]
+            if isinstance(stage, IterStage):
+                threads.append(threading.Thread(
+                    target=self._run_iter_stage, args=(stage, in_q, out_q, stats),
+                    name=f"stage-{stage.name}", daemon=True,
+                ))
+            else:
+                active, active_lock = [stage.workers], threading.Lock()
+                for worker in range(stage.workers):
+                    threads.append(threading.Thread(
+                        target=self._run_map_worker, args=(stage, in_q, out_q, stats, active, active_lock),
+                        name=f"stage-{stage.name}-{worker}", daemon=True,
+                    ))
+
+        for thread in threads:
+            thread.start()
+
+        results = {}
+        sink_stats = StageStats("sink", 1)
+        while True:
+            item = self._get(queues[-1])
+            if item is _END or item is _STOPPED:
+                break
+            index, value = item
+            results[index] = value
+            if sink:
+                sink_stats.mark_started()
+                started = time.perf_counter()
+                try:
+                    sink(index, value)
+                except Exception as e:
+                    self._fail(sink_stats.name, e)
+                    break
+                sink_stats.add(items_in=1, busy=time.perf_counter() - started)
+        sink_stats.mark_finished()
+
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+        stats = {stage_stats.name: stage_stats.as_dict(pipeline_started_at) for stage_stats in all_stats}
+        if sink:
+            stats[sink_stats.name] = sink_stats.as_dict(pipeline_started_at)
+        stats["total_seconds"] = round(time.perf_counter() - pipeline_started_at, 3)
+        return [results[index] for index in sorted(results)], stats
@@ -0,0 +1,123 @@
+"""
+Подсчёт токенов и разбиение текста на чанки по бюджету токенов промпта.
+
+Счётчик токенов подключаемый (настройка LLM_TOKEN_COUNTER): по умолчанию используется
+локальная эвристика без обращения к сети, но можно указать путь к своей функции
+text -> int (например, обёртке над токенизатором модели).
+"""
+
+import logging
+import math
+import threading
+from typing import Iterable, Iterator, Tuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from apps.enhancer.processing.pre_processing import merge_word_stream
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Среднее количество символов на токен (BPE-токенизаторы GigaChat/OpenAI):
+# латиница и цифры кодируются плотнее, кириллица и прочие символы - менее плотно.
+# Значения выбраны с запасом, чтобы оценка не занижала реальный размер запроса.
+ASCII_CHARS_PER_TOKEN = 4.0
+OTHER_CHARS_PER_TOKEN = 2.5
+
+# Запас на служебную разметку сообщений чата (роли, разделители)
+MESSAGE_OVERHEAD_TOKENS = 16
+
+# Минимальный бюджет чанка, если системный промпт почти исчерпал бюджет запроса
+MIN_CHUNK_TOKENS = 256
+
+_counter = None
+_counter_lock = threading.Lock()
+
+
+def heuristic_token_count(text):
+    """
+    Оценивает количество токенов в тексте без токенизатора модели.
+    Каждое слово оценивается отдельно и занимает не меньше одного токена.
+    Args:
+        text (str): Текст
+    Returns:
+        int: Оценка количества токенов
+    """
+    tokens = 0
+    for word in text.split():
+        ascii_chars = len(word.encode("ascii", "ignore"))
+        other_chars = len(word) - ascii_chars
+        tokens += max(1, math.ceil(ascii_chars / ASCII_CHARS_PER_TOKEN + other_chars / OTHER_CHARS_PER_TOKEN))
+    return tokens
+
+
+def get_token_counter():
+    """
+    Возвращает функцию подсчёта токенов согласно настройке LLM_TOKEN_COUNTER.
+    "heuristic" - локальная оценка, иначе - путь к функции text -> int.
+    Если функцию не удалось импортировать, используется эвристика.
+    Returns:
+        callable: Функция text -> int
+    """
+    global _counter
+    with _counter_lock:
+        if _counter is None:
+            counter_path = getattr(settings, "LLM_TOKEN_COUNTER", "heuristic")
+            if counter_path and counter_path != "heuristic":
+                try:
+                    _counter = import_string(counter_path)
+                    logger.info(f"Используется счётчик токенов {counter_path}")
+                except ImportError as e:
+                    logger.warning(f"Не удалось загрузить счётчик токенов {counter_path}, используется эвристика: {str(e)}")
+            if _counter is None:
+                _counter = heuristic_token_count
+        return _counter
+
+
+def count_tokens(text):
+    """
+    Подсчитывает количество токенов в тексте текущим счётчиком.
+    Args:
+        text (str): Текст
+    Returns:
+        int: Количество токенов
+    """
+    return get_token_counter()(text or "")
+
+
+def chunk_token_budget(system_prompt, prompt_budget=None):
+    """
+    Вычисляет, сколько токенов текста помещается в один запрос вместе с системным промптом.
+    Args:
+        system_prompt (str): Системный промпт запроса
+        prompt_budget (int): Бюджет токенов всего промпта (по умолчанию LLM_PROMPT_TOKEN_BUDGET)
+    Returns:
+        int: Бюджет токенов для текста чанка
+    """
+    if prompt_budget is None:
+        prompt_budget = getattr(settings, "LLM_PROMPT_TOKEN_BUDGET", 6000)
+    budget = prompt_budget - count_tokens(system_prompt) - MESSAGE_OVERHEAD_TOKENS
+    if budget < MIN_CHUNK_TOKENS:
+        logger.warning(
+            f"Системный промпт занимает почти весь бюджет запроса ({prompt_budget} токенов), "
+            f"размер чанка увеличен до {MIN_CHUNK_TOKENS}"
+        )
+        budget = MIN_CHUNK_TOKENS
+    return budget
+
+
+def iter_token_chunks(fragments: Iterable[str], max_tokens, overlap_tokens=0, counter=None) -> Iterator[Tuple[str, int]]:
+    """
+    Потоково разбивает текст на чанки, заполняя каждый до бюджета токенов.
+    Перекрытие между соседними чанками также задаётся в токенах.
+    Args:
+        fragments (Iterable[str]): Фрагменты текста (например, предобработанные страницы)
+        max_tokens (int): Максимальное количество токенов в чанке
+        overlap_tokens (int): Максимальное перекрытие между чанками в токенах
+        counter (callable): Функция подсчёта токенов (по умолчанию get_token_counter())
+    Yields:
+        tuple: (текст чанка, количество токенов в нём)
+    """
+    counter = counter or get_token_counter()
+    yield from merge_word_stream(fragments, max_tokens, overlap_tokens, separator=" ", length_function=counter)
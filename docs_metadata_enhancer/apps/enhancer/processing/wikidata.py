@@ -1,19 +1,21 @@
-import time
 import logging
-import requests
 from requests.exceptions import RequestException
 
 from apps.enhancer.models import Document
-from apps.enhancer.processing.wikidata_orm import enrich_entity_with_wikidata
+from apps.enhancer.processing.entity_index import get_entity_index_stats, lookup_entity_name, record_entity_name
+from apps.enhancer.processing.wikidata_cache import FAILURE, WikidataCache, get_wikidata_cache_stats
+from apps.enhancer.processing.wikidata_offline import HYBRID, OFFLINE, get_linker_backend, link_offline
+from apps.enhancer.processing.wikidata_http import (
+    WIKIDATA_API_URL, WIKIDATA_SPARQL_URL, get_wikidata_http_stats, wikidata_get,
+)
+from apps.enhancer.processing.wikidata_orm import enrich_entity_with_wikidata, prefetch_wikidata_entities
 
 # Получение логгера
 logger = logging.getLogger(__name__)
 
-# Глобальный кэш для результатов Wikidata
-wikidata_cache = {}
-
-# Кэш для сущностей, которые не удалось найти из-за проблем с сетью
-network_failure_cache = {}
+# Кэш поиска Q-идентификаторов по имени (в памяти процесса и общий для всех воркеров),
+# ошибки сети запоминаются в нём на WIKIDATA_CACHE_FAILURE_TTL секунд
+search_cache = WikidataCache("search")
 # Кэш известных сопоставлений (можно использовать при проблемах с сетью)
 known_entities = {
     # "Ленин": "Q1394",  # Владимир Ленин
@@ -25,6 +27,116 @@ CORE_METADATA_FIELDS = [
     "subject", "document_language", "identifier", "contributor", "rights"
 ]
 
+# Допустимые типы (P31) сущностей для фильтрации кандидатов поиска
+VALID_TYPES = {
+    "person": ["Q5"],  # человек
+    "organization": ["Q43229", "Q3918", "Q875538"],  # организация, университет
+    "language": ["Q34770"],  # язык
+    "discipline": ["Q11862829"],  # академическая дисциплина
+    "concept": ["Q1656682", "Q7184903"]  # концепция или абстрактное понятие
+}
+
+def build_types_query(entity_ids, allowed_types=None):
+    """
+    Формирует один SPARQL-запрос типов (P31) для нескольких сущностей через VALUES.
+    Args:
+        entity_ids (list): Q-идентификаторы кандидатов
+        allowed_types (list): Если указаны, запрашиваются только эти типы
+    Returns:
+        str: Текст SPARQL-запроса
+    """
+    items = " ".join(f"wd:{entity_id}" for entity_id in entity_ids)
+    query = "SELECT ?item ?type WHERE {\n"
+    query += f"    VALUES ?item {{ {items} }}\n"
+    if allowed_types:
+        types = " ".join(f"wd:{type_id}" for type_id in allowed_types)
+        query += f"    VALUES ?type {{ {types} }}\n"
+    query += "    ?item wdt:P31 ?type .\n}"
+    return query
+
+def parse_types_response(data):
+    """
+    Разбирает ответ SPARQL-запроса типов.
+    Args:
+        data (dict): JSON-ответ SPARQL
+    Returns:
+        dict: Q-идентификатор -> множество типов
+    """
+    types = {}
+    for binding in data.get("results", {}).get("bindings", []):
+        entity_id = binding["item"]["value"].split("/")[-1]
+        types.setdefault(entity_id, set()).add(binding["type"]["value"].split("/")[-1])
+    return types
+
+def parse_entity_types(entities):
+    """
+    Извлекает типы (P31) из данных сущностей wbgetentities.
+    Args:
+        entities (dict): Q-идентификатор -> данные сущности с claims
+    Returns:
+        dict: Q-идентификатор -> множество типов
+    """
+    types = {}
+    for entity_id, entity_data in entities.items():
+        for claim in entity_data.get("claims", {}).get("P31", []):
+            datavalue = claim.get("mainsnak", {}).get("datavalue", {})
+            if datavalue.get("type") == "wikibase-entityid":
+                types.setdefault(entity_id, set()).add(datavalue["value"]["id"])
+    return types
+
+def fetch_candidate_types(entity_ids, allowed_types, headers=None):
+    """
+    Получает типы всех кандидатов одним SPARQL-запросом, а при ошибке SPARQL -
+    из claims пакетного запроса wbgetentities.
+    Args:
+        entity_ids (list): Q-идентификаторы кандидатов
+        allowed_types (list): Допустимые типы
+        headers (dict): Дополнительные HTTP-заголовки
+    Returns:
+        dict: Q-идентификатор -> множество типов (только допустимые для SPARQL)
+    """
+    from apps.enhancer.processing.wikidata_orm import fetch_wikidata_entities_raw
+
+    sparql_query = build_types_query(entity_ids, allowed_types)
+    try:
+        logger.debug(f"SPARQL запрос типов для {len(entity_ids)} кандидатов: {sparql_query}")
+        response = wikidata_get(WIKIDATA_SPARQL_URL, {"query": sparql_query, "format": "json"},
+                                headers, timeout=15, service="sparql")
+        response.raise_for_status()
+        return parse_types_response(response.json())
+    except Exception as sparql_error:
+        logger.warning(f"Ошибка при выполнении SPARQL запроса типов, используем wbgetentities: {str(sparql_error)}")
+    return parse_entity_types(fetch_wikidata_entities_raw(entity_ids, "claims", headers))
+
+def select_typed_candidate(search_results, types, allowed_types):
+    """
+    Выбирает первый по порядку поиска кандидат подходящего типа.
+    Args:
+        search_results (list): Результаты wbsearchentities
+        types (dict): Q-идентификатор -> множество типов
+        allowed_types (list): Допустимые типы
+    Returns:
+        dict: Результат поиска или None
+    """
+    for result in search_results:
+        if types.get(result["id"], set()) & set(allowed_types):
+            return result
+    return None
+
+def select_fallback_candidate(search_results, entity_name):
+    """
+    Выбирает кандидата без фильтрации по типу: точное совпадение метки, иначе первый результат.
+    Args:
+        search_results (list): Результаты wbsearchentities
+        entity_name (str): Название сущности
+    Returns:
+        dict: Результат поиска
+    """
+    for result in search_results:
+        if result.get("label", "").lower() == entity_name.lower():
+            return result
+    return search_results[0]
+
 def test_wikidata_connection():
     """
     Проверяет соединение с Wikidata API.
@@ -32,11 +144,7 @@ def test_wikidata_connection():
         bool: True, если соединение работает, иначе False
     """
     logger.info("Проверка соединения с Wikidata...")
-    headers = {
-        "User-Agent": "DocsMetadataEnhancerBot/1.0 (https://example.com; zheny@example.com)"
-    }
     try:
-        search_url = "https://www.wikidata.org/w/api.php"
         params = {
             "action": "wbsearchentities",
             "search": "test",
@@ -45,7 +153,8 @@ def test_wikidata_connection():
             "limit": 1
         }
         
-        response = requests.get(search_url, params=params, headers=headers, timeout=5)
+        # Без повторов: проверка должна быстро сообщить о недоступности Wikidata
+        response = wikidata_get(WIKIDATA_API_URL, params, timeout=5, max_retries=0)
         response.raise_for_status()
         data = response.json()
         
@@ -59,6 +168,87 @@ def test_wikidata_connection():
         logger.error(f"Ошибка при проверке соединения с Wikidata: {str(e)}")
         return False
 
+def resolve_locally(entity_name, entity_type=None):
+    """
+    Ищет Q-идентификатор без запросов к API Wikidata: кэш поиска, известные сопоставления,
+    локальный индекс имён и локальное хранилище из дампа Wikidata.
+    Args:
+        entity_name (str): Название сущности (без пробелов по краям)
+        entity_type (str): Тип сущности
+    Returns:
+        tuple: (True, Q-идентификатор или None), если результат известен без запроса к API,
+               иначе (False, None)
+    """
+    # Проверяем кэш
+    cache_key = f"{entity_name}:{entity_type}"
+    cached = search_cache.get(cache_key)
+    if cached is not None and cached[0] != FAILURE:
+        logger.debug(f"Найдено в кэше: {entity_name} -> {cached[1]}")
+        return True, cached[1]
+    
+    # Проверяем кэш известных сущностей
+    if entity_name in known_entities:
+        logger.info(f"Найдено в локальном кэше: {entity_name} -> {known_entities[entity_name]}")
+        search_cache.set(cache_key, known_entities[entity_name])
+        return True, known_entities[entity_name]
+    
+    # Проверяем локальный индекс ранее связанных имён
+    indexed_qid = lookup_entity_name(entity_name, entity_type)
+    if indexed_qid:
+        logger.info(f"Найдено в локальном индексе: {entity_name} -> {indexed_qid}")
+        search_cache.set(cache_key, indexed_qid)
+        return True, indexed_qid
+    
+    # Ищем в локальном хранилище, импортированном из дампа Wikidata
+    backend = get_linker_backend()
+    if backend in (OFFLINE, HYBRID):
+        offline_qid = link_offline(entity_name, entity_type)
+        if offline_qid or backend == OFFLINE:
+            logger.info(f"Результат по локальному хранилищу Wikidata для '{entity_name}': {offline_qid}")
+            return True, offline_qid
+    
+    # Проверяем кэш ошибок сети
+    if cached is not None:
+        logger.warning(f"Пропускаем запрос к Wikidata из-за предыдущей ошибки сети: {entity_name}")
+        return True, None
+    
+    return False, None
+
+def remember_result(entity_name, entity_type, qid):
+    """
+    Сохраняет результат поиска в Wikidata в кэше и (если сущность найдена) в локальном индексе имён.
+    Args:
+        entity_name (str): Название сущности
+        entity_type (str): Тип сущности
+        qid (str): Q-идентификатор или None, если сущность не найдена
+    """
+    search_cache.set(f"{entity_name}:{entity_type}", qid)
+    if qid:
+        record_entity_name(entity_name, entity_type, qid)
+
+def fallback_after_failure(entity_name, entity_type):
+    """
+    Запоминает ошибку сети на короткое время и ищет сущность в известных сопоставлениях
+    и локальном хранилище из дампа Wikidata.
+    Args:
+        entity_name (str): Название сущности
+        entity_type (str): Тип сущности
+    Returns:
+        str: Q-идентификатор или None
+    """
+    search_cache.set_failure(f"{entity_name}:{entity_type}")
+    
+    # Проверяем, есть ли известное соответствие в локальном кэше
+    if entity_name in known_entities:
+        logger.info(f"Использую локальный кэш из-за ошибки сети: {entity_name} -> {known_entities[entity_name]}")
+        return known_entities[entity_name]
+    
+    # Ищем в локальном хранилище, импортированном из дампа Wikidata
+    offline_qid = link_offline(entity_name, entity_type)
+    if offline_qid:
+        logger.info(f"Использую локальное хранилище Wikidata из-за ошибки сети: {entity_name} -> {offline_qid}")
+    return offline_qid
+
 def link_to_wikidata(entity_name, entity_type=None):
     """
     Связывает сущность с Wikidata, возвращая только Q-идентификатор.
@@ -77,32 +267,14 @@ def link_to_wikidata(entity_name, entity_type=None):
         logger.warning("Попытка связать пустую строку с Wikidata")
         return None
         
-    # Проверяем кэш
-    cache_key = f"{entity_name}:{entity_type}"
-    if cache_key in wikidata_cache:
-        logger.debug(f"Найдено в кэше: {entity_name} -> {wikidata_cache[cache_key]}")
-        return wikidata_cache[cache_key]
-    
-    # Проверяем кэш известных сущностей
-    if entity_name in known_entities:
-        logger.info(f"Найдено в локальном кэше: {entity_name} -> {known_entities[entity_name]}")
-        wikidata_cache[cache_key] = known_entities[entity_name]
-        return known_entities[entity_name]
-    
-    # Проверяем кэш ошибок сети
-    if cache_key in network_failure_cache:
-        logger.warning(f"Пропускаем запрос к Wikidata из-за предыдущей ошибки сети: {entity_name}")
-        return None
+    resolved, qid = resolve_locally(entity_name, entity_type)
+    if resolved:
+        return qid
 
     logger.info(f"Поиск сущности в Wikidata: '{entity_name}' (тип: {entity_type})")
     
-    headers = {
-        "User-Agent": "DocsMetadataEnhancerBot/1.0 (https://example.com; zheny@example.com)"
-    }
-
     try:
         # Шаг 1: Поиск через wbsearchentities
-        search_url = "https://www.wikidata.org/w/api.php"
         params = {
             "action": "wbsearchentities",
             "search": entity_name,
@@ -112,9 +284,9 @@ def link_to_wikidata(entity_name, entity_type=None):
             "limit": 10
         }
         
-        logger.debug(f"Отправка запроса на поиск: {search_url} с параметрами {params}")
+        logger.debug(f"Отправка запроса на поиск: {WIKIDATA_API_URL} с параметрами {params}")
         
-        response = requests.get(search_url, params=params, headers=headers, timeout=10)
+        response = wikidata_get(WIKIDATA_API_URL, params, timeout=10)
         response.raise_for_status()
         search_results = response.json().get("search", [])
 
@@ -123,59 +295,30 @@ def link_to_wikidata(entity_name, entity_type=None):
             logger.debug(f"Ничего не найдено на русском, пробуем на английском: '{entity_name}'")
             params["language"] = "en"
             params["uselang"] = "en"
-            response = requests.get(search_url, params=params, headers=headers, timeout=10)
+            response = wikidata_get(WIKIDATA_API_URL, params, timeout=10)
             response.raise_for_status()
             search_results = response.json().get("search", [])
 
         if not search_results:
             logger.info(f"Сущность не найдена в Wikidata: '{entity_name}'")
-            wikidata_cache[cache_key] = None
+            remember_result(entity_name, entity_type, None)
             return None
 
-        # Фильтрация по типу сущности
-        valid_types = {
-            "person": ["Q5"],  # человек
-            "organization": ["Q43229", "Q3918", "Q875538"],  # организация, университет
-            "language": ["Q34770"],  # язык
-            "discipline": ["Q11862829"],  # академическая дисциплина
-            "concept": ["Q1656682", "Q7184903"]  # концепция или абстрактное понятие
-        }
         best_result = None
         
         # Применяем фильтрацию по типу только для основных полей
         # Для всех остальных полей берем лучший результат по совпадению метки
-        if entity_type and entity_type in valid_types:
+        if entity_type and entity_type in VALID_TYPES:
             logger.debug(f"Фильтрация по типу: {entity_type} для '{entity_name}'")
             
-            for result in search_results:
-                entity_id = result["id"]
-                # Проверяем тип через SPARQL
-                sparql_query = f"""
-                SELECT ?type WHERE {{
-                    wd:{entity_id} wdt:P31 ?type .
-                }}
-                """
-                sparql_url = "https://query.wikidata.org/sparql"
-                sparql_params = {"query": sparql_query, "format": "json"}
-                
-                try:
-                    time.sleep(0.5)  # Задержка для соблюдения лимитов
-                    logger.debug(f"SPARQL запрос для {entity_id}: {sparql_query}")
-                    
-                    sparql_response = requests.get(sparql_url, params=sparql_params, headers=headers, timeout=15)
-                    sparql_response.raise_for_status()
-                    
-                    types = [binding["type"]["value"].split("/")[-1] for binding in sparql_response.json().get("results", {}).get("bindings", [])]
-                    
-                    logger.debug(f"Типы для {entity_id}: {types}")
-                    
-                    if any(t in valid_types[entity_type] for t in types):
-                        logger.info(f"Найдена подходящая сущность типа {entity_type} для '{entity_name}': {entity_id}")
-                        best_result = result
-                        break
-                except Exception as sparql_error:
-                    logger.warning(f"Ошибка при выполнении SPARQL запроса для {entity_id}: {str(sparql_error)}")
-                    continue
+            # Типы всех кандидатов проверяются одним запросом
+            allowed_types = VALID_TYPES[entity_type]
+            types = fetch_candidate_types([result["id"] for result in search_results], allowed_types)
+            logger.debug(f"Типы кандидатов для '{entity_name}': {types}")
+            
+            best_result = select_typed_candidate(search_results, types, allowed_types)
+            if best_result:
+                logger.info(f"Найдена подходящая сущность типа {entity_type} для '{entity_name}': {best_result['id']}")
         else:
             # Берем первый результат, если тип не указан или не требуется фильтрация
             logger.debug(f"Тип не указан или не требует фильтрации, берем первый результат для '{entity_name}'")
@@ -184,40 +327,21 @@ def link_to_wikidata(entity_name, entity_type=None):
         if not best_result:
             # Дополнительная попытка: ищем без строгой фильтрации, но с приоритетом по совпадению метки
             logger.debug(f"Поиск без строгой фильтрации для '{entity_name}'")
-            
-            for result in search_results:
-                label = result.get("label", "").lower()
-                if label == entity_name.lower():
-                    logger.info(f"Найдено точное совпадение метки для '{entity_name}': {result['id']}")
-                    best_result = result
-                    break
-            
-            if not best_result:
-                logger.info(f"Берем первый результат поиска для '{entity_name}': {search_results[0]['id']}")
-                best_result = search_results[0]  # Берем первый, если нет точного совпадения
+            best_result = select_fallback_candidate(search_results, entity_name)
+            logger.info(f"Результат без фильтрации по типу для '{entity_name}': {best_result['id']}")
 
         entity_id = best_result["id"]
         logger.info(f"Финальный результат для '{entity_name}': {entity_id}")
         
-        wikidata_cache[cache_key] = entity_id
+        remember_result(entity_name, entity_type, entity_id)
         return entity_id
 
     except RequestException as e:
         logger.error(f"Ошибка при запросе к Wikidata для '{entity_name}': {str(e)}")
-        # Добавляем в кэш ошибок сети
-        network_failure_cache[cache_key] = True
-        
-        # Проверяем, есть ли известное соответствие в локальном кэше
-        if entity_name in known_entities:
-            logger.info(f"Использую локальный кэш из-за ошибки сети: {entity_name} -> {known_entities[entity_name]}")
-            wikidata_cache[cache_key] = known_entities[entity_name]
-            return known_entities[entity_name]
-            
-        wikidata_cache[cache_key] = None
-        return None
+        return fallback_after_failure(entity_name, entity_type)
     except Exception as e:
         logger.error(f"Общая ошибка при связывании '{entity_name}' с Wikidata: {str(e)}", exc_info=True)
-        wikidata_cache[cache_key] = None
+        search_cache.set_failure(f"{entity_name}:{entity_type}")
         return None
     
     
@@ -244,28 +368,48 @@ def enrich_with_wikidata(json_data, document):
         "contributor": "person"
     }
 
+    # Сначала находим Q-идентификаторы всех значений, затем загружаем данные сущностей
+    # пакетными запросами и только после этого создаём сущности и связи
+    # Уникальные имена ищутся в Wikidata параллельно (link_many_to_wikidata)
+    from apps.enhancer.processing.wikidata_async import link_many_to_wikidata
+
+    pairs = {}
     for field in json_data:
         # Определяем тип сущности, если поле находится в списке основных полей
         entity_type = field_types.get(field) if field in CORE_METADATA_FIELDS else None
         
+        value = enriched_data[field]
+        items = value if isinstance(value, list) else [value] if isinstance(value, str) else []
+        for item in items:
+            name = item if isinstance(item, str) else item.get("name", "")
+            if name and (field, name) not in pairs:
+                pairs[(field, name)] = (name.strip(), entity_type)
+    
+    linked = link_many_to_wikidata(pairs.values())
+    wikidata_ids = {key: linked.get(pair) for key, pair in pairs.items()}
+    
+    prefetch_wikidata_entities(wikidata_ids.values())
+
+    for field in json_data:
         if isinstance(enriched_data[field], list):
             enriched_field = []
             for item in enriched_data[field]:
                 name = item if isinstance(item, str) else item.get("name", "")
                 if not name:
                     continue
-                wikidata_id = link_to_wikidata(name, entity_type)
-                enriched_item = enrich_entity_with_wikidata(document, name, wikidata_id, field)
+                enriched_item = enrich_entity_with_wikidata(document, name, wikidata_ids[(field, name)], field)
                 enriched_field.append(enriched_item)
             enriched_data[field] = enriched_field
         elif isinstance(enriched_data[field], str):
             name = enriched_data[field]
             if name:
-                wikidata_id = link_to_wikidata(name, entity_type)
-                enriched_data[field] = enrich_entity_with_wikidata(document, name, wikidata_id, field)
+                enriched_data[field] = enrich_entity_with_wikidata(document, name, wikidata_ids[(field, name)], field)
 
     # Сохраняем метаданные в документ
     document.metadata = enriched_data
     document.save()
+    logger.info(f"Статистика кэша Wikidata: {get_wikidata_cache_stats()}")
+    logger.info(f"Статистика локального индекса имён: {get_entity_index_stats()}")
+    logger.info(f"Статистика запросов к Wikidata: {get_wikidata_http_stats()}")
 
     return enriched_data
\ No newline at end of file
@@ -0,0 +1,188 @@
+"""
+Параллельное связывание множества имён с Wikidata.
+
+Связывание выполняется в три этапа:
+    1. уникальные пары (имя, тип) разрешаются без сети: кэш поиска, локальный индекс
+       имён, локальное хранилище из дампа (resolve_locally);
+    2. оставшиеся пары ищутся в API Wikidata асинхронным HTTP-клиентом (httpx,
+       см. wikidata_http) с ограничением числа одновременных запросов
+       (WIKIDATA_MAX_CONCURRENCY), общим лимитом частоты запросов и повторами;
+    3. результаты сохраняются в кэше и локальном индексе.
+
+Запросы к БД выполняются только на первом и третьем этапах, вне цикла событий.
+Время связывания документа определяется количеством уникальных имён, которые
+не удалось разрешить локально, делённым на число одновременных запросов.
+"""
+
+import asyncio
+import logging
+import time
+
+import httpx
+from django.conf import settings
+
+from apps.enhancer.processing.wikidata import (
+    VALID_TYPES,
+    build_types_query,
+    fallback_after_failure,
+    link_to_wikidata,
+    parse_entity_types,
+    parse_types_response,
+    remember_result,
+    resolve_locally,
+    select_fallback_candidate,
+    select_typed_candidate,
+)
+from apps.enhancer.processing.wikidata_http import WIKIDATA_API_URL, WIKIDATA_SPARQL_URL, arequest, async_client
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Таймауты запросов к API и к SPARQL (сек)
+SEARCH_TIMEOUT = 10
+SPARQL_TIMEOUT = 15
+
+
+async def _aget(client, url, params, service, timeout):
+    """Асинхронный GET-запрос к Wikidata, возвращает разобранный JSON"""
+    response = await arequest(client, url, params, timeout=timeout, service=service)
+    response.raise_for_status()
+    return response.json()
+
+
+async def _acandidate_types(client, entity_ids, allowed_types):
+    """Типы кандидатов одним SPARQL-запросом, при ошибке SPARQL - из claims wbgetentities"""
+    try:
+        data = await _aget(
+            client, WIKIDATA_SPARQL_URL,
+            {"query": build_types_query(entity_ids, allowed_types), "format": "json"},
+            "sparql", SPARQL_TIMEOUT,
+        )
+        return parse_types_response(data)
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning(f"Ошибка при выполнении SPARQL запроса типов, используем wbgetentities: {str(e)}")
+    data = await _aget(
+        client, WIKIDATA_API_URL,
+        {"action": "wbgetentities", "ids": "|".join(entity_ids), "props": "claims", "format": "json"},
+        "api", SEARCH_TIMEOUT,
+    )
+    return parse_entity_types(data.get("entities", {}))
+
+
+async def asearch_entity(client, entity_name, entity_type=None):
+    """
+    Ищет сущность в API Wikidata (как link_to_wikidata, без обращений к БД).
+    Args:
+        client (httpx.AsyncClient): HTTP-клиент
+        entity_name (str): Название сущности
+        entity_type (str): Тип сущности
+    Returns:
+        str: Q-идентификатор или None, если сущность не найдена
+    Raises:
+        httpx.HTTPError: При ошибке запроса
+    """
+    params = {
+        "action": "wbsearchentities",
+        "search": entity_name,
+        "language": "ru",
+        "uselang": "ru",
+        "format": "json",
+        "limit": 10
+    }
+    search_results = (await _aget(client, WIKIDATA_API_URL, params, "api", SEARCH_TIMEOUT)).get("search", [])
+    if not search_results:
+        params["language"] = "en"
+        params["uselang"] = "en"
+        search_results = (await _aget(client, WIKIDATA_API_URL, params, "api", SEARCH_TIMEOUT)).get("search", [])
+    if not search_results:
+        return None
+
+    if entity_type not in VALID_TYPES:
+        return search_results[0]["id"]
+
+    allowed_types = VALID_TYPES[entity_type]
+    types = await _acandidate_types(client, [result["id"] for result in search_results], allowed_types)
+    best_result = select_typed_candidate(search_results, types, allowed_types)
+    if not best_result:
+        best_result = select_fallback_candidate(search_results, entity_name)
+    return best_result["id"]
+
+
+async def asearch_entities(pairs, concurrency):
+    """
+    Ищет пары (имя, тип) в API Wikidata параллельно.
+    Args:
+        pairs (list): Уникальные пары (имя, тип)
+        concurrency (int): Максимум одновременных запросов
+    Returns:
+        dict: Пара -> (True, Q-идентификатор или None) или (False, None) при любой ошибке поиска пары
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with async_client(concurrency) as client:
+        async def search(pair):
+            entity_name, entity_type = pair
+            async with semaphore:
+                try:
+                    return pair, (True, await asearch_entity(client, entity_name, entity_type))
+                except Exception as e:
+                    # Ошибка одной пары не должна прерывать gather: пара уходит в fallback_after_failure
+                    logger.error(f"Ошибка при запросе к Wikidata для '{entity_name}': {str(e)}")
+                    return pair, (False, None)
+
+        return dict(await asyncio.gather(*(search(pair) for pair in pairs)))
+
+
+def _loop_is_running():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def link_many_to_wikidata(pairs, concurrency=None):
+    """
+    Связывает множество имён с Wikidata: локальное разрешение, затем параллельный поиск в API.
+    Args:
+        pairs (Iterable): Пары (имя, тип сущности)
+        concurrency (int): Максимум одновременных запросов (по умолчанию WIKIDATA_MAX_CONCURRENCY)
+    Returns:
+        dict: Пара (имя без пробелов по краям, тип) -> Q-идентификатор или None
+    """
+    if concurrency is None:
+        concurrency = getattr(settings, "WIKIDATA_MAX_CONCURRENCY", 8)
+    started = time.perf_counter()
+
+    pairs = list(dict.fromkeys(
+        (name.strip(), entity_type) for name, entity_type in pairs
+        if isinstance(name, str) and name.strip()
+    ))
+    results = {}
+    pending = []
+    for pair in pairs:
+        resolved, qid = resolve_locally(*pair)
+        if resolved:
+            results[pair] = qid
+        else:
+            pending.append(pair)
+
+    if pending and _loop_is_running():
+        # Внутри работающего цикла событий asyncio.run недоступен, связываем последовательно
+        for pair in pending:
+            results[pair] = link_to_wikidata(*pair)
+    elif pending:
+        outcomes = asyncio.run(asearch_entities(pending, max(1, concurrency)))
+        for pair, (succeeded, qid) in outcomes.items():
+            if succeeded:
+                remember_result(pair[0], pair[1], qid)
+                results[pair] = qid
+            else:
+                results[pair] = fallback_after_failure(*pair)
+
+    logger.info(
+        f"Связывание с Wikidata: {len(pairs)} уникальных имён, {len(pairs) - len(pending)} без запросов к API, "
+        f"{len(pending)} через API, найдено {sum(1 for qid in results.values() if qid)} "
+        f"за {time.perf_counter() - started:.2f} сек"
+    )
+    return results
@@ -0,0 +1,260 @@
+"""
+Двухуровневый кэш запросов к Wikidata.
+
+Первый уровень - LRU-кэш в памяти процесса с ограничением размера, второй - таблица
+WikidataLookupCache, общая для всех воркеров и сохраняющаяся между перезапусками.
+Поиск QID по имени, данные сущностей и метки запрашиваются из Wikidata один раз
+для всех воркеров.
+
+У записей три вида результата с отдельным временем жизни:
+    found     - значение найдено (WIKIDATA_CACHE_POSITIVE_TTL);
+    not_found - Wikidata ответила, что значения нет (WIKIDATA_CACHE_NEGATIVE_TTL);
+    failure   - запрос не удался (WIKIDATA_CACHE_FAILURE_TTL, короткое время,
+                чтобы не повторять запросы во время сбоя, но и не запоминать сбой навсегда).
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from apps.enhancer.models import WikidataLookupCache
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+FOUND = "found"
+NOT_FOUND = "not_found"
+FAILURE = "failure"
+
+# Как часто (в количестве записей) удалять устаревшие записи общего кэша
+EVICTION_INTERVAL = 200
+
+# Счётчики кэша в рамках процесса по видам запросов
+_stats = {}
+_evicted = 0
+_stats_lock = threading.Lock()
+
+
+def _increment(namespace, counter, value=1):
+    with _stats_lock:
+        stats = _stats.setdefault(namespace, {"local_hits": 0, "shared_hits": 0, "misses": 0, "writes": 0})
+        stats[counter] += value
+
+
+def get_ttl(status):
+    """
+    Возвращает время жизни записи в секундах для вида результата.
+    Args:
+        status (str): found, not_found или failure
+    Returns:
+        int: Время жизни в секундах
+    """
+    if status == FOUND:
+        return getattr(settings, "WIKIDATA_CACHE_POSITIVE_TTL", 30 * 24 * 3600)
+    if status == NOT_FOUND:
+        return getattr(settings, "WIKIDATA_CACHE_NEGATIVE_TTL", 24 * 3600)
+    return getattr(settings, "WIKIDATA_CACHE_FAILURE_TTL", 300)
+
+
+class WikidataCache:
+    """
+    Кэш одного вида запросов к Wikidata (search, entity, label).
+    Args:
+        namespace (str): Вид запроса (часть ключа)
+        max_size (int): Максимум записей в памяти процесса (по умолчанию WIKIDATA_CACHE_LOCAL_MAX_ENTRIES)
+    """
+
+    def __init__(self, namespace, max_size=None):
+        self.namespace = namespace
+        self._max_size = max_size
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    @property
+    def max_size(self):
+        if self._max_size is not None:
+            return self._max_size
+        return getattr(settings, "WIKIDATA_CACHE_LOCAL_MAX_ENTRIES", 10000)
+
+    def _db_key(self, key):
+        return hashlib.sha256(f"{self.namespace}:{key}".encode("utf-8")).hexdigest()
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= time.time():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return entry[0], entry[1]
+
+    def _set_local(self, key, status, value, expires_at):
+        with self._lock:
+            self._local[key] = (status, value, expires_at)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+
+    def get(self, key):
+        """
+        Возвращает запись кэша.
+        Args:
+            key (str): Ключ запроса
+        Returns:
+            tuple: (вид результата, значение) или None при промахе
+        """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """
+        Возвращает записи кэша для нескольких ключей (общий кэш - одним запросом к БД).
+        Args:
+            keys (list): Ключи запросов
+        Returns:
+            dict: Ключ -> (вид результата, значение) для найденных записей
+        """
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            entry = self._get_local(key)
+            if entry is not None:
+                found[key] = entry
+            else:
+                missing.append(key)
+        if found:
+            _increment(self.namespace, "local_hits", len(found))
+        if not missing:
+            return found
+
+        db_keys = {self._db_key(key): key for key in missing}
+        try:
+            rows = WikidataLookupCache.objects.filter(
+                key__in=list(db_keys), expires_at__gt=timezone.now()
+            ).values_list("key", "status", "value", "expires_at")
+            for db_key, status, value, expires_at in rows:
+                key = db_keys[db_key]
+                found[key] = (status, value)
+                self._set_local(key, status, value, expires_at.timestamp())
+                _increment(self.namespace, "shared_hits")
+        except Exception as e:
+            # Ошибка кэша не должна прерывать обработку
+            logger.warning(f"Ошибка чтения кэша Wikidata ({self.namespace}): {str(e)}")
+
+        _increment(self.namespace, "misses", sum(1 for key in missing if key not in found))
+        return found
+
+    def set(self, key, value, status=None):
+        """
+        Сохраняет результат запроса.
+        Args:
+            key (str): Ключ запроса
+            value: Значение (JSON-совместимое)
+            status (str): Вид результата (по умолчанию found, если значение задано, иначе not_found)
+        """
+        self.set_many({key: value}, status)
+
+    def set_failure(self, key):
+        """
+        Запоминает неудачный запрос на короткое время (WIKIDATA_CACHE_FAILURE_TTL).
+        Args:
+            key (str): Ключ запроса
+        """
+        self.set_many({key: None}, FAILURE)
+
+    def set_many(self, values, status=None):
+        """
+        Сохраняет результаты нескольких запросов одним запросом к БД.
+        Args:
+            values (dict): Ключ -> значение
+            status (str): Вид результата для всех значений (по умолчанию определяется по значению)
+        """
+        if not values:
+            return
+        now = timezone.now()
+        entries = []
+        for key, value in values.items():
+            entry_status = status or (FOUND if value is not None else NOT_FOUND)
+            expires_at = now + timedelta(seconds=get_ttl(entry_status))
+            self._set_local(key, entry_status, value, expires_at.timestamp())
+            entries.append(WikidataLookupCache(
+                key=self._db_key(key),
+                namespace=self.namespace,
+                lookup=str(key)[:255],
+                status=entry_status,
+                value=value,
+                expires_at=expires_at,
+            ))
+
+        try:
+            WikidataLookupCache.objects.bulk_create(
+                entries,
+                update_conflicts=True,
+                unique_fields=["key"],
+                update_fields=["status", "value", "expires_at"],
+            )
+        except Exception as e:
+            logger.warning(f"Ошибка записи в кэш Wikidata ({self.namespace}): {str(e)}")
+            return
+
+        _increment(self.namespace, "writes", len(entries))
+        with self._lock:
+            previous = self._writes
+            self._writes += len(entries)
+            run_eviction = previous // EVICTION_INTERVAL != self._writes // EVICTION_INTERVAL
+        if run_eviction:
+            evict_expired()
+
+    def clear_local(self):
+        """Очищает кэш в памяти процесса."""
+        with self._lock:
+            self._local.clear()
+
+
+def evict_expired():
+    """
+    Удаляет устаревшие записи общего кэша.
+    Returns:
+        int: Количество удалённых записей
+    """
+    global _evicted
+    try:
+        deleted, _ = WikidataLookupCache.objects.filter(expires_at__lte=timezone.now()).delete()
+    except Exception as e:
+        logger.warning(f"Ошибка очистки кэша Wikidata: {str(e)}")
+        return 0
+    if deleted:
+        with _stats_lock:
+            _evicted += deleted
+        logger.info(f"Очистка кэша Wikidata: удалено {deleted} записей")
+    return deleted
+
+
+def get_wikidata_cache_stats():
+    """
+    Возвращает статистику кэша Wikidata в рамках текущего процесса.
+    Returns:
+        dict: Счётчики по видам запросов (local_hits, shared_hits, misses, writes, hit_rate),
+              количество удалённых устаревших записей evicted и общая доля попаданий hit_rate
+    """
+    with _stats_lock:
+        namespaces = {namespace: dict(counters) for namespace, counters in _stats.items()}
+        stats = {"evicted": _evicted}
+    hits = lookups = 0
+    for namespace, counters in namespaces.items():
+        namespace_hits = counters["local_hits"] + counters["shared_hits"]
+        namespace_lookups = namespace_hits + counters["misses"]
+        counters["hit_rate"] = round(namespace_hits / namespace_lookups, 3) if namespace_lookups else 0.0
+        hits += namespace_hits
+        lookups += namespace_lookups
+        stats[namespace] = counters
+    stats["hit_rate"] = round(hits / lookups, 3) if lookups else 0.0
+    return stats
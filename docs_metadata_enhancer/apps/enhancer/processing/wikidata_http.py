@@ -0,0 +1,284 @@
+"""
+Общий HTTP-клиент Wikidata (API www.wikidata.org и SPARQL query.wikidata.org).
+
+Все запросы к Wikidata выполняются через одну сессию requests на процесс с пулом
+соединений (keep-alive), поэтому TCP- и TLS-соединения переиспользуются между
+запросами. Для каждого запроса:
+    - соблюдается общий для всех воркеров лимит частоты запросов;
+    - задаются таймауты подключения и чтения;
+    - к запросам API добавляется параметр maxlag;
+    - при ответах 429/5xx, maxlag и ошибках соединения запрос повторяется с экспоненциальной
+      задержкой, а если сервер прислал заголовок Retry-After - через указанное в нём время;
+    - ответы запрашиваются сжатыми (gzip);
+    - собираются счётчики запросов, повторов, ошибок и времени ответа.
+
+Асинхронный вариант (arequest) использует httpx.AsyncClient с теми же правилами.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+import requests
+from django.conf import settings
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, RetryError, Timeout
+
+from apps.enhancer.rate_limit import get_rate_limiter
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+WIKIDATA_API_URL = "https://www.wikidata.org/w/api.php"
+WIKIDATA_SPARQL_URL = "https://query.wikidata.org/sparql"
+WIKIDATA_HEADERS = {
+    "User-Agent": "DocsMetadataEnhancerBot/1.0 (https://example.com; zheny@example.com)",
+    "Accept-Encoding": "gzip, deflate",
+}
+
+# Коды ответа, при которых запрос повторяется
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Сессия процесса (после fork воркера создаётся заново)
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+# Счётчики запросов в рамках процесса по сервисам
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _increment(service, counter, value=1):
+    with _stats_lock:
+        stats = _stats.setdefault(service, {"requests": 0, "retries": 0, "errors": 0, "seconds": 0.0})
+        stats[counter] += value
+
+
+def wikidata_rate_limiter(service="api"):
+    """
+    Возвращает ограничитель частоты запросов к Wikidata (общий для всех воркеров).
+    Args:
+        service (str): "api" (www.wikidata.org/w/api.php) или "sparql" (query.wikidata.org)
+    Returns:
+        RateLimiter: Ограничитель
+    """
+    if service == "sparql":
+        per_minute = getattr(settings, "WIKIDATA_SPARQL_REQUESTS_PER_MINUTE", 30)
+    else:
+        per_minute = getattr(settings, "WIKIDATA_REQUESTS_PER_MINUTE", 200)
+    return get_rate_limiter(f"wikidata:{service}", {"requests": per_minute})
+
+
+def get_session():
+    """
+    Возвращает сессию requests текущего процесса с пулом соединений к Wikidata.
+    Returns:
+        requests.Session: Сессия
+    """
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            pool_size = getattr(settings, "WIKIDATA_HTTP_POOL_SIZE", 10)
+            session = requests.Session()
+            session.headers.update(WIKIDATA_HEADERS)
+            # Повторы выполняются в wikidata_get с учётом лимита частоты и Retry-After
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+            _session_pid = os.getpid()
+        return _session
+
+
+def _timeouts(timeout=None):
+    """Таймауты (подключение, чтение): read по умолчанию WIKIDATA_HTTP_TIMEOUT"""
+    connect_timeout = getattr(settings, "WIKIDATA_HTTP_CONNECT_TIMEOUT", 5)
+    read_timeout = timeout or getattr(settings, "WIKIDATA_HTTP_TIMEOUT", 30)
+    return connect_timeout, read_timeout
+
+
+def _prepare_params(url, params):
+    """Добавляет параметр maxlag к запросам API (Wikidata отвечает ошибкой maxlag при отставании реплик)"""
+    params = dict(params or {})
+    maxlag = getattr(settings, "WIKIDATA_MAXLAG", 5)
+    if url == WIKIDATA_API_URL and maxlag:
+        params.setdefault("maxlag", maxlag)
+    return params
+
+
+def _should_retry(response):
+    """Нужно ли повторить запрос: 429/5xx или ошибка maxlag (заголовок MediaWiki-API-Error)"""
+    return response.status_code in RETRY_STATUSES or response.headers.get("MediaWiki-API-Error") == "maxlag"
+
+
+def _retries_exhausted_message(service, response):
+    reason = response.headers.get("MediaWiki-API-Error") or response.status_code
+    return f"Wikidata ({service}) ответила {reason}, повторы исчерпаны"
+
+
+def retry_delay(attempt, retry_after=None):
+    """
+    Вычисляет задержку перед повтором запроса.
+    Args:
+        attempt (int): Номер повтора (с 0)
+        retry_after (str): Значение заголовка Retry-After (секунды или HTTP-дата)
+    Returns:
+        float: Задержка в секундах (не более WIKIDATA_HTTP_MAX_BACKOFF)
+    """
+    max_backoff = getattr(settings, "WIKIDATA_HTTP_MAX_BACKOFF", 60)
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(retry_after) - timezone.now()).total_seconds()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0.0), max_backoff)
+    backoff = getattr(settings, "WIKIDATA_HTTP_BACKOFF", 1.0)
+    return min(backoff * 2 ** attempt + random.uniform(0, backoff), max_backoff)
+
+
+def wikidata_get(url, params, headers=None, timeout=None, service="api", max_retries=None):
+    """
+    Выполняет GET-запрос к Wikidata через сессию процесса с соблюдением лимита частоты
+    запросов и повтором при временных ошибках.
+    Args:
+        url (str): Адрес запроса
+        params (dict): Параметры запроса
+        headers (dict): Дополнительные HTTP-заголовки
+        timeout (float): Таймаут чтения в секундах (по умолчанию WIKIDATA_HTTP_TIMEOUT)
+        service (str): Сервис Wikidata для ограничителя ("api" или "sparql")
+        max_retries (int): Количество повторов (по умолчанию WIKIDATA_HTTP_MAX_RETRIES)
+    Returns:
+        requests.Response: Ответ сервера
+    Raises:
+        requests.RequestException: Если не удалось получить ответ или повторы при 429/5xx
+            и maxlag исчерпаны (requests.exceptions.RetryError)
+    """
+    if max_retries is None:
+        max_retries = getattr(settings, "WIKIDATA_HTTP_MAX_RETRIES", 3)
+    session = get_session()
+    params = _prepare_params(url, params)
+    timeouts = _timeouts(timeout)
+
+    attempt = 0
+    while True:
+        wikidata_rate_limiter(service).acquire("default", requests=1)
+        started = time.perf_counter()
+        try:
+            response = session.get(url, params=params, headers=headers, timeout=timeouts)
+        except (ConnectionError, Timeout) as e:
+            _increment(service, "seconds", time.perf_counter() - started)
+            if attempt >= max_retries:
+                _increment(service, "errors")
+                raise
+            delay = retry_delay(attempt)
+            logger.warning(f"Ошибка соединения с Wikidata ({service}), повтор через {delay:.1f} сек: {str(e)}")
+        else:
+            _increment(service, "requests")
+            _increment(service, "seconds", time.perf_counter() - started)
+            if not _should_retry(response):
+                return response
+            if attempt >= max_retries:
+                # Ответ maxlag приходит с кодом 200, поэтому raise_for_status вызывающего кода его не отличит
+                _increment(service, "errors")
+                raise RetryError(_retries_exhausted_message(service, response), response=response)
+            delay = retry_delay(attempt, response.headers.get("Retry-After"))
+            reason = response.headers.get("MediaWiki-API-Error") or response.status_code
+            logger.warning(f"Wikidata ({service}) ответила {reason}, повтор через {delay:.1f} сек")
+        _increment(service, "retries")
+        attempt += 1
+        time.sleep(delay)
+
+
+def async_client(max_connections):
+    """
+    Создаёт асинхронный HTTP-клиент Wikidata (клиент привязан к циклу событий,
+    поэтому создаётся на каждый запуск asyncio.run).
+    Args:
+        max_connections (int): Размер пула соединений
+    Returns:
+        httpx.AsyncClient: Клиент
+    """
+    connect_timeout, read_timeout = _timeouts()
+    return httpx.AsyncClient(
+        headers=WIKIDATA_HEADERS,
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+    )
+
+
+async def arequest(client, url, params, timeout=None, service="api", max_retries=None):
+    """
+    Асинхронный вариант wikidata_get для httpx.AsyncClient.
+    Args:
+        client (httpx.AsyncClient): Клиент (см. async_client)
+        url (str): Адрес запроса
+        params (dict): Параметры запроса
+        timeout (float): Таймаут чтения в секундах
+        service (str): Сервис Wikidata для ограничителя ("api" или "sparql")
+        max_retries (int): Количество повторов (по умолчанию WIKIDATA_HTTP_MAX_RETRIES)
+    Returns:
+        httpx.Response: Ответ сервера
+    Raises:
+        httpx.TransportError: Если не удалось получить ответ
+        httpx.HTTPStatusError: Если повторы при 429/5xx и maxlag исчерпаны
+    """
+    if max_retries is None:
+        max_retries = getattr(settings, "WIKIDATA_HTTP_MAX_RETRIES", 3)
+    params = _prepare_params(url, params)
+    connect_timeout, read_timeout = _timeouts(timeout)
+    timeouts = httpx.Timeout(read_timeout, connect=connect_timeout)
+
+    attempt = 0
+    while True:
+        await wikidata_rate_limiter(service).aacquire("default", requests=1)
+        started = time.perf_counter()
+        try:
+            response = await client.get(url, params=params, timeout=timeouts)
+        except httpx.TransportError as e:
+            _increment(service, "seconds", time.perf_counter() - started)
+            if attempt >= max_retries:
+                _increment(service, "errors")
+                raise
+            delay = retry_delay(attempt)
+            logger.warning(f"Ошибка соединения с Wikidata ({service}), повтор через {delay:.1f} сек: {str(e)}")
+        else:
+            _increment(service, "requests")
+            _increment(service, "seconds", time.perf_counter() - started)
+            if not _should_retry(response):
+                return response
+            if attempt >= max_retries:
+                _increment(service, "errors")
+                raise httpx.HTTPStatusError(
+                    _retries_exhausted_message(service, response), request=response.request, response=response
+                )
+            delay = retry_delay(attempt, response.headers.get("Retry-After"))
+            reason = response.headers.get("MediaWiki-API-Error") or response.status_code
+            logger.warning(f"Wikidata ({service}) ответила {reason}, повтор через {delay:.1f} сек")
+        _increment(service, "retries")
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+def get_wikidata_http_stats():
+    """
+    Возвращает статистику запросов к Wikidata в рамках текущего процесса.
+    Returns:
+        dict: Счётчики по сервисам (requests, retries, errors, seconds, avg_seconds)
+    """
+    with _stats_lock:
+        stats = {service: dict(counters) for service, counters in _stats.items()}
+    for counters in stats.values():
+        counters["avg_seconds"] = round(counters["seconds"] / counters["requests"], 3) if counters["requests"] else 0.0
+        counters["seconds"] = round(counters["seconds"], 3)
+    return stats
@@ -0,0 +1,268 @@
+"""
+Связывание сущностей с Wikidata без сети по импортированному подмножеству дампа.
+
+Команда import_wikidata_dump загружает из JSON-дампа Wikidata (latest-all.json,
+в том числе .gz и .bz2) сущности выбранных типов (P31): метки и синонимы на русском
+и английском, описания, типы и количество ссылок на статьи. link_offline ищет имя
+по нормализованным меткам и выбирает кандидата так же, как поиск через API:
+сначала подходящего типа, затем с точным совпадением метки, затем самого известного
+(по количеству ссылок на статьи).
+
+Режим связывания задаётся настройкой WIKIDATA_LINKER_BACKEND:
+    api     - поиск через API Wikidata, локальное хранилище - при ошибке сети;
+    offline - только локальное хранилище, без сетевых запросов;
+    hybrid  - сначала локальное хранилище, затем API.
+"""
+
+import bz2
+import gzip
+import json
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from apps.enhancer.models import WikidataDumpEntity, WikidataDumpLabel
+from apps.enhancer.processing.entity_index import normalize_name
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+API = "api"
+OFFLINE = "offline"
+HYBRID = "hybrid"
+
+# Языки меток и описаний
+LANGUAGES = ("ru", "en")
+
+
+def get_linker_backend():
+    return getattr(settings, "WIKIDATA_LINKER_BACKEND", API)
+
+
+def default_dump_types():
+    """
+    Типы (P31), импортируемые по умолчанию: все типы фильтрации кандидатов поиска.
+    Returns:
+        set: Q-идентификаторы типов
+    """
+    from apps.enhancer.processing.wikidata import VALID_TYPES
+
+    return {type_qid for type_qids in VALID_TYPES.values() for type_qid in type_qids}
+
+
+def open_dump(path):
+    """
+    Открывает файл дампа как текст (поддерживаются .gz и .bz2).
+    Args:
+        path (str): Путь к дампу
+    Returns:
+        file: Текстовый файловый объект
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def iter_dump_entities(lines):
+    """
+    Разбирает дамп Wikidata построчно: JSON-массив, в котором каждая сущность - на отдельной строке.
+    Args:
+        lines (Iterable): Строки дампа
+    Yields:
+        dict: Данные сущности
+    """
+    for line in lines:
+        line = line.strip().rstrip(",")
+        if not line or line in ("[", "]"):
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            logger.warning(f"Пропущена некорректная строка дампа Wikidata: {str(e)}")
+
+
+def parse_dump_entity(data, allowed_types):
+    """
+    Извлекает из сущности дампа данные для локального хранилища.
+    Args:
+        data (dict): Данные сущности из дампа
+        allowed_types (set): Допустимые типы (P31); None - без фильтрации
+    Returns:
+        dict: qid, метки, описания, types, sitelinks и names (нормализованное имя -> синоним ли)
+              или None, если сущность не подходит
+    """
+    if data.get("type") != "item":
+        return None
+
+    types = []
+    for claim in data.get("claims", {}).get("P31", []):
+        datavalue = claim.get("mainsnak", {}).get("datavalue", {})
+        if datavalue.get("type") == "wikibase-entityid":
+            types.append(datavalue["value"].get("id") or f"Q{datavalue['value']['numeric-id']}")
+    if allowed_types is not None and not set(types) & allowed_types:
+        return None
+
+    labels = data.get("labels", {})
+    descriptions = data.get("descriptions", {})
+    names = {}
+    for language in LANGUAGES:
+        for alias in data.get("aliases", {}).get(language, []):
+            normalized = normalize_name(alias["value"])
+            if normalized:
+                names.setdefault(normalized, True)
+        if language in labels:
+            normalized = normalize_name(labels[language]["value"])
+            if normalized:
+                names[normalized] = False
+    if not names:
+        return None
+
+    return {
+        "qid": data["id"],
+        "label_ru": labels.get("ru", {}).get("value", "")[:255],
+        "label_en": labels.get("en", {}).get("value", "")[:255],
+        "description_ru": descriptions.get("ru", {}).get("value", ""),
+        "description_en": descriptions.get("en", {}).get("value", ""),
+        "types": list(dict.fromkeys(types)),
+        "sitelinks": len(data.get("sitelinks", {})),
+        "names": names,
+    }
+
+
+def save_dump_entities(parsed_entities):
+    """
+    Сохраняет пачку сущностей в локальное хранилище (существующие сущности обновляются).
+    Args:
+        parsed_entities (list): Результаты parse_dump_entity
+    Returns:
+        int: Количество сохранённых сущностей
+    """
+    if not parsed_entities:
+        return 0
+    fields = ["label_ru", "label_en", "description_ru", "description_en", "types", "sitelinks"]
+    with transaction.atomic():
+        WikidataDumpEntity.objects.bulk_create(
+            [
+                WikidataDumpEntity(qid=parsed["qid"], **{field: parsed[field] for field in fields})
+                for parsed in parsed_entities
+            ],
+            update_conflicts=True,
+            unique_fields=["qid"],
+            update_fields=fields,
+        )
+        ids = dict(
+            WikidataDumpEntity.objects.filter(
+                qid__in=[parsed["qid"] for parsed in parsed_entities]
+            ).values_list("qid", "id")
+        )
+        WikidataDumpLabel.objects.filter(entity_id__in=ids.values()).delete()
+        WikidataDumpLabel.objects.bulk_create([
+            WikidataDumpLabel(entity_id=ids[parsed["qid"]], normalized_name=name, is_alias=is_alias)
+            for parsed in parsed_entities
+            for name, is_alias in parsed["names"].items()
+        ])
+    return len(parsed_entities)
+
+
+def import_dump(lines, allowed_types=None, batch_size=1000, limit=None, on_batch=None):
+    """
+    Импортирует подмножество дампа Wikidata в локальное хранилище.
+    Args:
+        lines (Iterable): Строки дампа
+        allowed_types (set): Допустимые типы (P31), по умолчанию default_dump_types()
+        batch_size (int): Размер пачки записи в БД
+        limit (int): Максимум импортируемых сущностей
+        on_batch (callable): Вызывается после каждой пачки со статистикой
+    Returns:
+        dict: read (прочитано сущностей), imported (импортировано)
+    """
+    if allowed_types is None:
+        allowed_types = default_dump_types()
+    stats = {"read": 0, "imported": 0}
+    batch = []
+    for data in iter_dump_entities(lines):
+        stats["read"] += 1
+        parsed = parse_dump_entity(data, allowed_types)
+        if parsed is None:
+            continue
+        batch.append(parsed)
+        if limit and stats["imported"] + len(batch) >= limit:
+            break
+        if len(batch) >= batch_size:
+            stats["imported"] += save_dump_entities(batch)
+            batch = []
+            if on_batch:
+                on_batch(stats)
+    stats["imported"] += save_dump_entities(batch)
+    if on_batch:
+        on_batch(stats)
+    logger.info(f"Импорт дампа Wikidata завершён: прочитано {stats['read']}, импортировано {stats['imported']}")
+    return stats
+
+
+def link_offline(entity_name, entity_type=None):
+    """
+    Связывает сущность с Wikidata по локальному хранилищу без сетевых запросов.
+    Args:
+        entity_name (str): Название сущности
+        entity_type (str): Тип сущности (person, organization, concept, language, discipline)
+    Returns:
+        str: Q-идентификатор или None
+    """
+    from apps.enhancer.processing.wikidata import VALID_TYPES
+
+    normalized = normalize_name(entity_name or "")
+    if not normalized:
+        return None
+
+    candidates = list(
+        WikidataDumpLabel.objects.filter(normalized_name=normalized)
+        .values_list("entity__qid", "entity__types", "entity__sitelinks", "is_alias")
+    )
+    if not candidates:
+        return None
+
+    # Как и при поиске через API, при отсутствии кандидатов нужного типа берём любой
+    if entity_type in VALID_TYPES:
+        allowed_types = set(VALID_TYPES[entity_type])
+        typed = [candidate for candidate in candidates if set(candidate[1]) & allowed_types]
+        candidates = typed or candidates
+
+    qid, _, _, _ = min(candidates, key=lambda candidate: (candidate[3], -candidate[2]))
+    logger.debug(f"Локальное хранилище Wikidata: '{entity_name}' -> {qid} (кандидатов: {len(candidates)})")
+    return qid
+
+
+def offline_entity_data(qids):
+    """
+    Возвращает данные сущностей из локального хранилища в формате fetch_wikidata_entity.
+    Args:
+        qids (list): Q-идентификаторы
+    Returns:
+        dict: QID -> данные о сущности (метки, описания, свойство P31)
+    """
+    entities = {entity.qid: entity for entity in WikidataDumpEntity.objects.filter(qid__in=list(qids))}
+    type_labels = dict(
+        WikidataDumpEntity.objects.filter(
+            qid__in={type_qid for entity in entities.values() for type_qid in entity.types}
+        ).values_list("qid", "label_ru")
+    )
+    results = {}
+    for qid, entity in entities.items():
+        properties = {}
+        if entity.types:
+            properties["P31"] = {
+                "label": "P31",
+                "values": [{"qid": type_qid, "value": type_labels.get(type_qid) or type_qid} for type_qid in entity.types],
+            }
+        results[qid] = {
+            "label_ru": entity.label_ru or None,
+            "label_en": entity.label_en or None,
+            "description_ru": entity.description_ru or None,
+            "description_en": entity.description_en or None,
+            "properties": properties,
+        }
+    return results
@@ -1,20 +1,48 @@
 import time
-import requests
 from requests.exceptions import RequestException
 from django.db import transaction
 from django.utils import timezone
 import logging
 
 from apps.enhancer.models import WikidataEntity, Document, DocumentEntityRelation
+from apps.enhancer.processing.entity_index import get_entity_index_stats
+from apps.enhancer.processing.wikidata_offline import HYBRID, OFFLINE, get_linker_backend, offline_entity_data
+from apps.enhancer.processing.wikidata_cache import WikidataCache, get_wikidata_cache_stats
+from apps.enhancer.processing.wikidata_http import WIKIDATA_API_URL, wikidata_get
 
-# Глобальный кэш для результатов Wikidata (для работы в рамках одного запроса)
-wikidata_cache = {}
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Кэш данных сущностей и меток (в памяти процесса и общий для всех воркеров)
+entity_cache = WikidataCache("entity")
+label_cache = WikidataCache("label")
+
+# Максимум идентификаторов в одном запросе wbgetentities
+WBGETENTITIES_MAX_IDS = 50
+
+# Свойства, сохраняемые в WikidataEntity.properties
+IMPORTANT_PROPERTIES = ["P31", "P279", "P570", "P19", "P569", "P106", "P131", "P17"]
 
 CORE_METADATA_FIELDS = [
     "creator", "organizations", "title", "keywords", "dates", "summary", 
     "subject", "document_language", "identifier", "contributor", "rights"
 ]
 
+def entity_needs_refresh(entity):
+    """
+    Проверяет, нужно ли обновить сущность из Wikidata: нет меток или описаний
+    либо прошло более 30 дней с последнего обновления.
+    Args:
+        entity (WikidataEntity): Объект сущности
+    Returns:
+        bool: True, если сущность нужно обновить
+    """
+    if not entity.label_ru and not entity.label_en:
+        return True
+    if not entity.description_ru and not entity.description_en:
+        return True
+    return bool(entity.updated_at and (timezone.now() - entity.updated_at).days > 30)
+
 def get_or_create_wikidata_entity(qid, name):
     """
     Проверяет, существует ли сущность Wikidata в базе данных, или создаёт новую.
@@ -31,18 +59,7 @@ def get_or_create_wikidata_entity(qid, name):
         
         if entity:
             # Сущность уже существует
-            needs_update = False
-            
-            # Проверяем, нужно ли обновить метки
-            if not entity.label_ru and not entity.label_en:
-                needs_update = True
-            
-            # Проверяем, нужно ли обновить описания
-            if not entity.description_ru and not entity.description_en:
-                needs_update = True
-            
-            # Если нужно обновление или прошло более 30 дней с последнего обновления
-            if needs_update or (entity.updated_at and (timezone.now() - entity.updated_at).days > 30):
+            if entity_needs_refresh(entity):
                 # Загружаем данные из Wikidata
                 entity_data = fetch_wikidata_entity(qid)
                 if entity_data:
@@ -179,10 +196,13 @@ def update_document_wikidata_links(document):
         logger.warning(f"Документ ID: {document.id} не имеет метаданных для обработки")
         return 0
     
-    # Проверяем соединение с Wikidata
-    wikidata_connection_ok = test_wikidata_connection()
+    # Проверяем соединение с Wikidata (без сети, если используется только локальное хранилище)
+    wikidata_connection_ok = get_linker_backend() != OFFLINE and test_wikidata_connection()
     if not wikidata_connection_ok:
         logger.error("Нет соединения с Wikidata API. Используем только локальный кэш.")
+    else:
+        # Данные уже связанных с документом сущностей загружаем пакетными запросами
+        prefetch_wikidata_entities(meta_wikidata_qids(document.meta_wikidata))
     
     # Типы сущностей для каждого поля
     field_types = {
@@ -433,8 +453,30 @@ def update_document_wikidata_links(document):
         logger.debug("Не было создано новых связей, meta_wikidata не обновлены")
     
     logger.info(f"Обновление завершено. Создано {new_links_count} новых связей.")
+    logger.info(f"Статистика кэша Wikidata: {get_wikidata_cache_stats()}")
+    logger.info(f"Статистика локального индекса имён: {get_entity_index_stats()}")
     return new_links_count
 
+def meta_wikidata_qids(meta_wikidata):
+    """
+    Возвращает Q-идентификаторы из meta_wikidata документа.
+    Args:
+        meta_wikidata (dict): Поле -> {значение: qid} или список пар [значение, qid]
+    Returns:
+        list: Q-идентификаторы в порядке появления
+    """
+    qids = []
+    for field_data in (meta_wikidata or {}).values():
+        if isinstance(field_data, dict):
+            qids.extend(qid for qid in field_data.values() if isinstance(qid, str))
+        elif isinstance(field_data, list):
+            for item in field_data:
+                if isinstance(item, list) and len(item) >= 2:
+                    qids.append(item[1])
+                elif isinstance(item, dict) and 'qid' in item:
+                    qids.append(item['qid'])
+    return [qid for qid in dict.fromkeys(qids) if qid]
+
 def convert_field_to_category(field_name):
     """
     Конвертирует название поля метаданных в категорию поля для DocumentEntityRelation
@@ -552,114 +594,244 @@ def search_and_link_entity_to_document(document, entity_name, category, entity_t
         
         return relation
 
-def fetch_wikidata_entity(qid):
+def fetch_wikidata_entities_raw(ids, props="labels|descriptions|claims", headers=None, not_found=None):
     """
-    Получает данные о сущности Wikidata по QID
+    Загружает сущности или свойства Wikidata запросами wbgetentities
+    по WBGETENTITIES_MAX_IDS идентификаторов в запросе.
     Args:
-        qid (str): Q-идентификатор Wikidata (например, "Q123")
+        ids (list): Q- и P-идентификаторы
+        props (str): Запрашиваемые части сущностей (параметр props API)
+        headers (dict): Дополнительные HTTP-заголовки для запроса
+        not_found (set): Если передано, в него добавляются идентификаторы, которых нет в Wikidata
+            (в отличие от незагруженных из-за ошибки запроса)
     Returns:
-        dict: Данные о сущности (метки, описания, свойства) или None
+        dict: Идентификатор -> данные сущности из API (несуществующие и незагруженные отсутствуют)
     """
-    # Проверяем кэш
-    cache_key = f"entity_data:{qid}"
-    if cache_key in wikidata_cache:
-        return wikidata_cache[cache_key]
-    
-    headers = {
-        "User-Agent": "DocsMetadataEnhancerBot/1.0 (https://example.com; zheny@example.com)"
-    }
+    ids = [entity_id for entity_id in dict.fromkeys(ids) if entity_id]
+    entities = {}
     
-    try:
-        # Получаем основную информацию о сущности через Wikidata API
-        api_url = "https://www.wikidata.org/w/api.php"
+    for start in range(0, len(ids), WBGETENTITIES_MAX_IDS):
+        batch = ids[start:start + WBGETENTITIES_MAX_IDS]
         params = {
             "action": "wbgetentities",
-            "ids": qid,
+            "ids": "|".join(batch),
+            "props": props,
             "languages": "ru|en",
             "format": "json"
         }
+        try:
+            response = wikidata_get(WIKIDATA_API_URL, params, headers, timeout=30)
+            response.raise_for_status()
+            data = response.json()
+        except (RequestException, ValueError) as e:
+            logger.error(f"Ошибка сети при запросе к Wikidata для {len(batch)} идентификаторов: {e}")
+            continue
         
-        response = requests.get(api_url, params=params, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        
-        if "entities" not in data or qid not in data["entities"]:
-            return None
-        
-        entity_data = data["entities"][qid]
+        if "error" in data:
+            logger.error(f"Wikidata вернула ошибку для {len(batch)} идентификаторов: {data['error'].get('info')}")
+            continue
         
-        # Извлекаем метки и описания
-        result = {
-            "label_ru": None,
-            "label_en": None,
-            "description_ru": None,
-            "description_en": None,
-            "properties": {}
+        for entity_id, entity_data in data.get("entities", {}).items():
+            if "missing" in entity_data:
+                if not_found is not None:
+                    not_found.add(entity_id)
+                continue
+            entities[entity_id] = entity_data
+            # Для перенаправленных сущностей данные возвращаются под новым идентификатором
+            redirects = entity_data.get("redirects")
+            if redirects:
+                entities[redirects["from"]] = entity_data
+    
+    logger.debug(f"Загружено {len(entities)} из {len(ids)} сущностей Wikidata")
+    return entities
+
+def _pick_label(labels, default):
+    """Возвращает русскую метку, иначе английскую, иначе значение по умолчанию"""
+    for language in ("ru", "en"):
+        if language in labels:
+            return labels[language]["value"]
+    return default
+
+def fetch_wikidata_labels(ids, headers=None, refresh=False):
+    """
+    Получает метки сущностей и свойств Wikidata пакетными запросами.
+    Args:
+        ids (list): Q- и P-идентификаторы
+        headers (dict): HTTP-заголовки для запроса
+        refresh (bool): Запросить метки из API, не читая кэш (результаты записываются в кэш)
+    Returns:
+        dict: Идентификатор -> метка (или сам идентификатор, если метка не найдена)
+    """
+    ids = list(dict.fromkeys(ids))
+    cached = {} if refresh else label_cache.get_many(ids)
+    labels = {entity_id: cached[entity_id][1] or entity_id for entity_id in cached}
+    missing = [entity_id for entity_id in ids if entity_id not in cached]
+    
+    if missing:
+        not_found = set()
+        entities = fetch_wikidata_entities_raw(missing, "labels", headers, not_found)
+        fetched = {
+            entity_id: _pick_label(entities[entity_id].get("labels", {}), entity_id)
+            for entity_id in missing if entity_id in entities
         }
+        label_cache.set_many(fetched)
+        label_cache.set_many({entity_id: None for entity_id in not_found})
+        for entity_id in missing:
+            labels[entity_id] = fetched.get(entity_id, entity_id)
+    
+    return labels
+
+def _important_claims(entity_data):
+    """
+    Извлекает значения важных свойств сущности.
+    Args:
+        entity_data (dict): Данные сущности из API
+    Returns:
+        dict: Свойство -> список пар ("qid", Q-идентификатор) или ("value", значение)
+    """
+    claims = {}
+    for prop in IMPORTANT_PROPERTIES:
+        prop_values = []
+        for claim in entity_data.get("claims", {}).get(prop, []):
+            mainsnak = claim.get("mainsnak", {})
+            if mainsnak.get("snaktype") != "value":
+                continue
+            data_value = mainsnak["datavalue"]
+            
+            if data_value["type"] == "wikibase-entityid":
+                prop_values.append(("qid", "Q" + str(data_value["value"]["numeric-id"])))
+            elif data_value["type"] == "string":
+                prop_values.append(("value", data_value["value"]))
+            elif data_value["type"] == "time":
+                prop_values.append(("value", data_value["value"]["time"]))
         
-        # Получаем метки
-        if "labels" in entity_data:
-            if "ru" in entity_data["labels"]:
-                result["label_ru"] = entity_data["labels"]["ru"]["value"]
-            if "en" in entity_data["labels"]:
-                result["label_en"] = entity_data["labels"]["en"]["value"]
-        
-        # Получаем описания
-        if "descriptions" in entity_data:
-            if "ru" in entity_data["descriptions"]:
-                result["description_ru"] = entity_data["descriptions"]["ru"]["value"]
-            if "en" in entity_data["descriptions"]:
-                result["description_en"] = entity_data["descriptions"]["en"]["value"]
-        
-        # Получаем основные свойства через SPARQL (упрощенный вариант)
+        if prop_values:
+            claims[prop] = prop_values
+    return claims
+
+def _build_entity_data(entity_data, claims, labels):
+    """
+    Формирует данные о сущности: метки, описания и свойства с метками значений.
+    Args:
+        entity_data (dict): Данные сущности из API
+        claims (dict): Результат _important_claims
+        labels (dict): Метки значений свойств и самих свойств
+    Returns:
+        dict: Данные о сущности (см. fetch_wikidata_entity)
+    """
+    result = {
+        "label_ru": None,
+        "label_en": None,
+        "description_ru": None,
+        "description_en": None,
+        "properties": {}
+    }
+    
+    for language in ("ru", "en"):
+        if language in entity_data.get("labels", {}):
+            result[f"label_{language}"] = entity_data["labels"][language]["value"]
+        if language in entity_data.get("descriptions", {}):
+            result[f"description_{language}"] = entity_data["descriptions"][language]["value"]
+    
+    for prop, prop_values in claims.items():
+        result["properties"][prop] = {
+            "label": labels.get(prop, prop),
+            "values": [
+                {"qid": value, "value": labels.get(value, value)} if kind == "qid" else {"value": value}
+                for kind, value in prop_values
+            ]
+        }
+    return result
+
+def fetch_wikidata_entities(qids, refresh=False):
+    """
+    Получает данные о нескольких сущностях Wikidata. Сущности загружаются запросами
+    wbgetentities по 50 идентификаторов, затем метки всех значений свойств и самих свойств
+    загружаются такими же пакетными запросами (вместо отдельного запроса на каждую метку).
+    Args:
+        qids (list): Q-идентификаторы Wikidata
+        refresh (bool): Запросить сущности и метки из API, не читая кэш (явное обновление
+            пользователем); полученные данные заменяют записи кэша
+    Returns:
+        dict: QID -> данные о сущности (метки, описания, свойства); сущности, которые
+              не удалось получить, отсутствуют
+    """
+    qids = [qid for qid in dict.fromkeys(qids) if qid]
+    if get_linker_backend() == OFFLINE:
+        return offline_entity_data(qids)
+    
+    cached = {} if refresh else entity_cache.get_many(qids)
+    # Отсутствующие сущности и недавние ошибки запроса повторно не запрашиваются
+    results = {qid: entity_data for qid, (status, entity_data) in cached.items() if entity_data is not None}
+    missing = [qid for qid in qids if qid not in cached]
+    
+    if not missing:
+        return results
+    
+    not_found = set()
+    entities = fetch_wikidata_entities_raw(missing, not_found=not_found)
+    
+    claims = {}
+    for qid, entity_data in entities.items():
         try:
-            important_properties = ["P31", "P279", "P570", "P19", "P569", "P106", "P131", "P17"]
-            for prop in important_properties:
-                if "claims" in entity_data and prop in entity_data["claims"]:
-                    claims = entity_data["claims"][prop]
-                    prop_values = []
-                    
-                    for claim in claims:
-                        if "mainsnak" in claim and claim["mainsnak"]["snaktype"] == "value":
-                            data_value = claim["mainsnak"]["datavalue"]
-                            
-                            if data_value["type"] == "wikibase-entityid":
-                                value_qid = "Q" + str(data_value["value"]["numeric-id"])
-                                
-                                # Получаем метку для этой сущности
-                                prop_entity = fetch_property_entity_label(prop, value_qid, headers)
-                                if prop_entity:
-                                    prop_values.append(prop_entity)
-                            
-                            elif data_value["type"] == "string":
-                                prop_values.append({"value": data_value["value"]})
-                            
-                            elif data_value["type"] == "time":
-                                time_value = data_value["value"]["time"]
-                                prop_values.append({"value": time_value})
-                    
-                    # Если есть значения, добавляем свойство в результат
-                    if prop_values:
-                        # Получаем метку для самого свойства
-                        prop_label = fetch_property_label(prop, headers)
-                        result["properties"][prop] = {
-                            "label": prop_label,
-                            "values": prop_values
-                        }
+            claims[qid] = _important_claims(entity_data)
         except Exception as e:
-            print(f"Ошибка при получении свойств для {qid}: {e}")
             # Продолжаем работу даже при ошибке получения свойств
-        
-        # Сохраняем в кэш
-        wikidata_cache[cache_key] = result
-        return result
+            logger.warning(f"Ошибка при получении свойств для {qid}: {e}")
+            claims[qid] = {}
     
-    except RequestException as e:
-        print(f"Ошибка сети при запросе к Wikidata для '{qid}': {e}")
-        return None
-    except Exception as e:
-        print(f"Общая ошибка при получении данных о сущности '{qid}' из Wikidata: {e}")
-        return None
+    label_ids = []
+    for entity_claims in claims.values():
+        for prop, prop_values in entity_claims.items():
+            label_ids.append(prop)
+            label_ids.extend(value for kind, value in prop_values if kind == "qid")
+    labels = fetch_wikidata_labels(label_ids, refresh=refresh) if label_ids else {}
+    
+    for qid in missing:
+        if qid in entities:
+            results[qid] = _build_entity_data(entities[qid], claims[qid], labels)
+    entity_cache.set_many({qid: results[qid] for qid in missing if qid in results})
+    entity_cache.set_many({qid: None for qid in not_found})
+    for qid in missing:
+        if qid not in results and qid not in not_found:
+            entity_cache.set_failure(qid)
+    
+    if get_linker_backend() == HYBRID:
+        # Сущности, которые не удалось получить через API, дополняем из локального хранилища
+        results.update(offline_entity_data([qid for qid in missing if qid not in results]))
+    
+    logger.info(f"Загружены данные {len(results)} сущностей Wikidata ({len(missing)} запрошено из API, "
+                f"{len(set(label_ids))} меток)")
+    return results
+
+def prefetch_wikidata_entities(qids):
+    """
+    Заранее загружает пакетными запросами данные сущностей, которые понадобятся
+    get_or_create_wikidata_entity (отсутствующих в базе или требующих обновления).
+    Args:
+        qids (Iterable): Q-идентификаторы Wikidata
+    Returns:
+        int: Количество сущностей, запрошенных из Wikidata
+    """
+    qids = [qid for qid in dict.fromkeys(qids) if qid]
+    if not qids:
+        return 0
+    
+    existing = {entity.qid: entity for entity in WikidataEntity.objects.filter(qid__in=qids)}
+    to_fetch = [qid for qid in qids if qid not in existing or entity_needs_refresh(existing[qid])]
+    if to_fetch:
+        fetch_wikidata_entities(to_fetch)
+    return len(to_fetch)
+
+def fetch_wikidata_entity(qid):
+    """
+    Получает данные о сущности Wikidata по QID
+    Args:
+        qid (str): Q-идентификатор Wikidata (например, "Q123")
+    Returns:
+        dict: Данные о сущности (метки, описания, свойства) или None
+    """
+    return fetch_wikidata_entities([qid]).get(qid)
 
 def fetch_property_label(prop_id, headers):
     """
@@ -670,39 +842,7 @@ def fetch_property_label(prop_id, headers):
     Returns:
         str: Метка свойства или prop_id, если метка не найдена
     """
-    cache_key = f"prop_label:{prop_id}"
-    if cache_key in wikidata_cache:
-        return wikidata_cache[cache_key]
-    
-    try:
-        api_url = "https://www.wikidata.org/w/api.php"
-        params = {
-            "action": "wbgetentities",
-            "ids": prop_id,
-            "languages": "ru|en",
-            "format": "json"
-        }
-        
-        response = requests.get(api_url, params=params, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        
-        if "entities" in data and prop_id in data["entities"] and "labels" in data["entities"][prop_id]:
-            labels = data["entities"][prop_id]["labels"]
-            if "ru" in labels:
-                label = labels["ru"]["value"]
-            elif "en" in labels:
-                label = labels["en"]["value"]
-            else:
-                label = prop_id
-            
-            wikidata_cache[cache_key] = label
-            return label
-        
-        return prop_id
-    
-    except Exception:
-        return prop_id
+    return fetch_wikidata_labels([prop_id], headers)[prop_id]
 
 def fetch_property_entity_label(prop_id, value_qid, headers):
     """
@@ -712,40 +852,6 @@ def fetch_property_entity_label(prop_id, value_qid, headers):
         value_qid (str): Q-идентификатор значения свойства (например, "Q5")
         headers (dict): HTTP-заголовки для запроса
     Returns:
-        dict: Словарь с полями value (метка) и qid (Q-идентификатор) или None
+        dict: Словарь с полями value (метка) и qid (Q-идентификатор)
     """
-    cache_key = f"entity_label:{value_qid}"
-    if cache_key in wikidata_cache:
-        return wikidata_cache[cache_key]
-    
-    try:
-        api_url = "https://www.wikidata.org/w/api.php"
-        params = {
-            "action": "wbgetentities",
-            "ids": value_qid,
-            "languages": "ru|en",
-            "format": "json"
-        }
-        
-        response = requests.get(api_url, params=params, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        
-        if "entities" in data and value_qid in data["entities"] and "labels" in data["entities"][value_qid]:
-            labels = data["entities"][value_qid]["labels"]
-            result = {"qid": value_qid}
-            
-            if "ru" in labels:
-                result["value"] = labels["ru"]["value"]
-            elif "en" in labels:
-                result["value"] = labels["en"]["value"]
-            else:
-                result["value"] = value_qid
-            
-            wikidata_cache[cache_key] = result
-            return result
-        
-        return {"qid": value_qid, "value": value_qid}
-    
-    except Exception:
-        return {"qid": value_qid, "value": value_qid} 
\ No newline at end of file
+    return {"qid": value_qid, "value": fetch_wikidata_labels([value_qid], headers)[value_qid]}
@@ -0,0 +1,312 @@
+"""
+Ограничение частоты запросов к внешним сервисам (LLM, Wikidata) алгоритмом token bucket.
+
+Состояние корзин хранится в Redis и общее для всех воркеров Celery, поэтому
+суммарная нагрузка на учётные данные не превышает квоту независимо от числа
+параллельных задач. Если Redis недоступен, используется корзина в памяти процесса.
+
+Лимиты задаются в единицах в минуту (например, запросов и токенов в минуту).
+Ёмкость корзины равна лимиту за RATE_LIMIT_BURST_SECONDS секунд, что сглаживает
+нагрузку вместо всплесков в начале каждой минуты.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Префикс ключей корзин в Redis
+KEY_PREFIX = "ratelimit"
+
+# Случайная добавка к ожиданию, чтобы воркеры не обращались к корзине одновременно (сек)
+WAIT_JITTER = 0.05
+
+# Через сколько секунд снова пробовать Redis после ошибки подключения
+REDIS_RETRY_INTERVAL = 30
+
+# Атомарная проверка и списание из нескольких корзин.
+# KEYS - ключи корзин, ARGV - флаг принудительного списания и тройки (скорость в сек, ёмкость, стоимость).
+# Возвращает "0" при успешном списании или время ожидания в секундах.
+_ACQUIRE_SCRIPT = """
+local force = tonumber(ARGV[1])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local levels = {}
+local wait = 0
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[2 + (i - 1) * 3])
+    local capacity = tonumber(ARGV[3 + (i - 1) * 3])
+    local cost = tonumber(ARGV[4 + (i - 1) * 3])
+    local data = redis.call('HMGET', KEYS[i], 'level', 'ts')
+    local level = tonumber(data[1])
+    local ts = tonumber(data[2])
+    if level == nil then
+        level = capacity
+        ts = now
+    end
+    level = math.min(capacity, level + math.max(0, now - ts) * rate)
+    levels[i] = level
+    local need = math.min(cost, capacity)
+    if level < need then
+        wait = math.max(wait, (need - level) / rate)
+    end
+end
+if wait > 0 and force == 0 then
+    return tostring(wait)
+end
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[2 + (i - 1) * 3])
+    local capacity = tonumber(ARGV[3 + (i - 1) * 3])
+    local cost = tonumber(ARGV[4 + (i - 1) * 3])
+    redis.call('HSET', KEYS[i], 'level', tostring(levels[i] - cost), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[i], math.ceil(capacity / rate) + 60)
+end
+return "0"
+"""
+
+
+class LocalBucketStore:
+    """Хранилище корзин в памяти процесса"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, buckets, force=False):
+        """
+        Списывает стоимость из всех корзин, если во всех её достаточно.
+        Args:
+            buckets (list): Кортежи (ключ, скорость в секунду, ёмкость, стоимость)
+            force (bool): Списать даже при нехватке (баланс уходит в минус)
+        Returns:
+            float: 0 при успешном списании или время ожидания в секундах
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            wait = 0.0
+            for key, rate, capacity, cost in buckets:
+                level, ts = self._buckets.get(key, (capacity, now))
+                level = min(capacity, level + max(0.0, now - ts) * rate)
+                levels.append(level)
+                need = min(cost, capacity)
+                if level < need:
+                    wait = max(wait, (need - level) / rate)
+            if wait > 0 and not force:
+                return wait
+            for (key, rate, capacity, cost), level in zip(buckets, levels):
+                self._buckets[key] = (level - cost, now)
+            return 0.0
+
+
+class RedisBucketStore:
+    """Хранилище корзин в Redis, общее для всех процессов"""
+
+    def __init__(self):
+        self._client = redis.Redis(
+            host=getattr(settings, "REDIS_HOST", "localhost"),
+            port=int(getattr(settings, "REDIS_PORT", 6379)),
+            password=getattr(settings, "REDIS_PASSWORD", None),
+            db=int(getattr(settings, "REDIS_DB", 0)),
+            socket_timeout=1,
+            socket_connect_timeout=1,
+        )
+        self._script = self._client.register_script(_ACQUIRE_SCRIPT)
+
+    def consume(self, buckets, force=False):
+        args = [1 if force else 0]
+        for _, rate, capacity, cost in buckets:
+            args.extend([rate, capacity, cost])
+        result = self._script(keys=[f"{KEY_PREFIX}:{key}" for key, *_ in buckets], args=args)
+        return float(result)
+
+
+class RateLimiter:
+    """
+    Ограничитель частоты с несколькими корзинами на ключ (например, запросы и токены).
+    Args:
+        name (str): Название ограничителя (часть ключа корзины)
+        limits (dict): Лимиты в минуту по видам ресурсов, например {"requests": 60, "tokens": 100000}.
+            Нулевой или пустой лимит означает отсутствие ограничения.
+        burst_seconds (float): За сколько секунд лимита допускается всплеск (ёмкость корзины)
+    """
+
+    def __init__(self, name, limits, burst_seconds=None):
+        self.name = name
+        self.limits = {resource: per_minute for resource, per_minute in limits.items() if per_minute}
+        if burst_seconds is None:
+            burst_seconds = getattr(settings, "RATE_LIMIT_BURST_SECONDS", 10)
+        self.burst_seconds = max(1.0, float(burst_seconds))
+        self._stats = {"acquired": 0, "waits": 0, "waited_seconds": 0.0}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.limits)
+
+    def _buckets(self, key, costs):
+        buckets = []
+        for resource, per_minute in self.limits.items():
+            cost = costs.get(resource, 0)
+            if cost <= 0:
+                continue
+            rate = per_minute / 60.0
+            buckets.append((f"{self.name}:{key}:{resource}", rate, rate * self.burst_seconds, cost))
+        return buckets
+
+    def _record(self, waited):
+        with self._stats_lock:
+            self._stats["acquired"] += 1
+            if waited:
+                self._stats["waits"] += 1
+                self._stats["waited_seconds"] += waited
+
+    def try_acquire(self, key, **costs):
+        """
+        Пытается списать стоимость запроса без ожидания.
+        Args:
+            key (str): Ключ (например, хэш учётных данных)
+            **costs: Стоимость по видам ресурсов, например requests=1, tokens=1500
+        Returns:
+            float: 0 при успехе или рекомендуемое время ожидания в секундах
+        """
+        buckets = self._buckets(key, costs)
+        if not buckets:
+            return 0.0
+        return _consume(buckets)
+
+    def acquire(self, key, timeout=None, **costs):
+        """
+        Дожидается, пока во всех корзинах ключа будет достаточно ресурса, и списывает его.
+        Args:
+            key (str): Ключ (например, хэш учётных данных)
+            timeout (float): Максимальное время ожидания (None - без ограничения)
+            **costs: Стоимость по видам ресурсов, например requests=1, tokens=1500
+        Returns:
+            float: Время ожидания в секундах
+        Raises:
+            TimeoutError: Если ресурс не освободился за timeout секунд
+        """
+        started = time.monotonic()
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(key, **costs)
+            if wait <= 0:
+                self._record(waited)
+                return waited
+            if timeout is not None and waited + wait > timeout:
+                raise TimeoutError(f"Превышено время ожидания лимита {self.name} для {key}")
+            time.sleep(wait + random.uniform(0, WAIT_JITTER))
+            waited = time.monotonic() - started
+
+    async def aacquire(self, key, timeout=None, **costs):
+        """
+        Асинхронный вариант acquire.
+        Args:
+            key (str): Ключ (например, хэш учётных данных)
+            timeout (float): Максимальное время ожидания (None - без ограничения)
+            **costs: Стоимость по видам ресурсов
+        Returns:
+            float: Время ожидания в секундах
+        Raises:
+            TimeoutError: Если ресурс не освободился за timeout секунд
+        """
+        started = time.monotonic()
+        waited = 0.0
+        while True:
+            # Списание в Redis - блокирующий сетевой вызов, выполняем его вне цикла событий
+            wait = await asyncio.to_thread(self.try_acquire, key, **costs)
+            if wait <= 0:
+                self._record(waited)
+                return waited
+            if timeout is not None and waited + wait > timeout:
+                raise TimeoutError(f"Превышено время ожидания лимита {self.name} для {key}")
+            await asyncio.sleep(wait + random.uniform(0, WAIT_JITTER))
+            waited = time.monotonic() - started
+
+    def charge(self, key, **costs):
+        """
+        Списывает фактически израсходованный ресурс без ожидания (например, токены ответа).
+        Баланс корзины может уйти в минус, тогда следующие запросы подождут.
+        Args:
+            key (str): Ключ
+            **costs: Стоимость по видам ресурсов
+        """
+        buckets = self._buckets(key, costs)
+        if buckets:
+            _consume(buckets, force=True)
+
+    def get_stats(self):
+        """
+        Возвращает статистику ограничителя в рамках процесса.
+        Returns:
+            dict: acquired, waits, waited_seconds и текущие лимиты
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["waited_seconds"] = round(stats["waited_seconds"], 3)
+        stats["limits"] = dict(self.limits)
+        return stats
+
+
+_local_store = LocalBucketStore()
+_redis_store = None
+_redis_failed_at = None
+_store_lock = threading.Lock()
+
+
+def _get_redis_store():
+    global _redis_store
+    with _store_lock:
+        if _redis_store is None:
+            _redis_store = RedisBucketStore()
+        return _redis_store
+
+
+def _consume(buckets, force=False):
+    """
+    Списывает ресурс в Redis, а при его недоступности - в памяти процесса.
+    """
+    global _redis_failed_at
+    if getattr(settings, "RATE_LIMIT_BACKEND", "redis") == "redis":
+        if _redis_failed_at is None or time.monotonic() - _redis_failed_at > REDIS_RETRY_INTERVAL:
+            try:
+                result = _get_redis_store().consume(buckets, force)
+                if _redis_failed_at is not None:
+                    logger.info("Подключение к Redis восстановлено, лимиты снова общие для всех воркеров")
+                    _redis_failed_at = None
+                return result
+            except redis.exceptions.RedisError as e:
+                if _redis_failed_at is None:
+                    logger.warning(f"Redis недоступен, лимиты запросов действуют только в рамках процесса: {str(e)}")
+                _redis_failed_at = time.monotonic()
+    return _local_store.consume(buckets, force)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name, limits, burst_seconds=None):
+    """
+    Возвращает ограничитель с указанным именем (один экземпляр на процесс).
+    Args:
+        name (str): Название ограничителя
+        limits (dict): Лимиты в минуту по видам ресурсов
+        burst_seconds (float): Ёмкость корзины в секундах лимита
+    Returns:
+        RateLimiter: Ограничитель
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = RateLimiter(name, limits, burst_seconds)
+            _limiters[name] = limiter
+        return limiter
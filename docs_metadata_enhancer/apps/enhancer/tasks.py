@@ -1,27 +1,94 @@
 import logging
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from celery import shared_task
+from celery.result import AsyncResult
 from celery.utils.log import get_task_logger
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django import db
 from celery import current_app
 
+from apps.enhancer.LLM.client import LLMError
 from apps.enhancer.processing.pipeline import (
-    process_doc_pipeline, process_wikidata_pipeline)
+    finalize_chunk_results, prepare_document_chunks, process_doc_pipeline, process_wikidata_pipeline)
+from apps.enhancer.processing.checkpoints import ChunkCheckpoint, chunk_hash
+from apps.enhancer.processing.dedup import clone_document_results, find_processed_duplicate
+from apps.enhancer.processing.post_processing import extract_chunk_entities, extract_chunk_entities_in_thread
 
 from .models import Document
 
 # Используем специальный логгер задач Celery для лучшей интеграции
 logger = get_task_logger(__name__)
 
+
+def _fail_document(document, error_msg):
+    """Помечает документ как обработанный с ошибкой."""
+    document.processing_status = 'failed'
+    document.processing_errors = error_msg
+    document.save(update_fields=['processing_status', 'processing_errors'])
+
+
+def _complete_document(document, final_entities, checkpoint, task_id, start_time, priority=None):
+    """Сохраняет финальные сущности документа и завершает обработку.
+    При WIKIDATA_LINK_AFTER_PROCESSING запускает связывание с Wikidata в очереди wikidata.
+
+    Аргументы:
+        document (Document): Обрабатываемый документ
+        final_entities (dict): Финальные сущности или None
+        checkpoint (ChunkCheckpoint): Контрольные точки чанков (удаляются после сохранения результата)
+        task_id (str): ID задачи для логов
+        start_time (float): Время начала обработки документа
+        priority (int): Приоритет задачи связывания с Wikidata
+    Возвращает:
+        bool: True, если сущности сохранены
+    """
+    if not final_entities:
+        _fail_document(document, "Не удалось извлечь сущности из документа")
+        logger.error(f"[Задача {task_id}] Не удалось извлечь сущности для документа '{document.name}'")
+        return False
+
+    document.metadata = final_entities
+    document.processing_status = 'success'
+    document.processing_errors = None
+    document.save(update_fields=['metadata', 'processing_status', 'processing_errors'])
+    checkpoint.clear()
+
+    elapsed_time = time.time() - start_time
+    logger.info(f"[Задача {task_id}] Документ '{document.name}' успешно обработан за {elapsed_time:.2f} сек.")
+
+    if getattr(settings, "WIKIDATA_LINK_AFTER_PROCESSING", False):
+        link_document_wikidata.apply_async(args=[document.id], priority=priority)
+    return True
+
+
+def enqueue_document(document_id, priority=None):
+    """Ставит документ в очередь обработки с заданным приоритетом.
+
+    Приоритет передаётся всем задачам обработки документа (чанкам и финализации),
+    поэтому документ, загруженный из интерфейса, обгоняет массовую загрузку во всех очередях.
+    Аргументы:
+        document_id (int): ID документа
+        priority (int): Приоритет (TASK_PRIORITY_INTERACTIVE, TASK_PRIORITY_BULK или None - по умолчанию)
+    Возвращает:
+        AsyncResult: Результат задачи process_document
+    """
+    return process_document.apply_async(args=[document_id], kwargs={'priority': priority}, priority=priority)
+
+
 @shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=True, retry_kwargs={'max_retries': 3})
-def process_document(self, document_id):
+def process_document(self, document_id, priority=None):
     """Задача для обработки загруженного документа.
     
-    Извлекает сущности из документа и обогащает их данными из Wikidata.
+    Загружает документ и потоково разбивает его на чанки. Каждый чанк ставится в очередь задачей
+    extract_chunk сразу после формирования, поэтому воркеры начинают извлечение сущностей
+    до окончания загрузки документа; объединение и финализация выполняются задачей
+    finalize_document после завершения задач всех чанков. Небольшие документы и синхронный
+    (eager) режим обрабатываются в текущей задаче.
     Аргументы:
         document_id (int): ID документа для обработки
+        priority (int): Приоритет задач обработки чанков и финализации (см. enqueue_document)
     """
     # Определяем, запущена ли задача в eager режиме (синхронное выполнение без Celery)
     is_eager = getattr(current_app.conf, 'task_always_eager', False)
@@ -43,35 +110,88 @@ def process_document(self, document_id):
         document.processing_status = 'processing'
         document.save(update_fields=['processing_status'])
         
+        # Шаг 0: Если такой же файл уже обработан, копируем результаты без запуска пайплайна
+        duplicate = find_processed_duplicate(document)
+        if duplicate:
+            logger.info(f"[Задача {task_id}] Найден ранее обработанный документ с тем же содержимым (ID: {duplicate.id}), копируем результаты")
+            clone_document_results(duplicate, document)
+            document.processing_status = 'success'
+            document.processing_errors = None
+            document.save(update_fields=['processing_status', 'processing_errors'])
+            
+            elapsed_time = time.time() - start_time
+            logger.info(f"[Задача {task_id}] Документ '{document.name}' обработан по дубликату за {elapsed_time:.2f} сек.")
+            return True
+        
         # Шаг 1: Извлечение сущностей из документа
         logger.info(f"[Задача {task_id}] Извлечение сущностей из документа...")
         try:
-            final_entities = process_doc_pipeline(document.file.path, 3000, 200)
-            if not final_entities:
-                document.processing_status = 'failed'
-                document.processing_errors = "Не удалось извлечь сущности из документа"
-                document.save(update_fields=['processing_status', 'processing_errors'])
-                logger.error(f"[Задача {task_id}] Не удалось извлечь сущности для документа '{document.name}'")
+            # Результаты чанков сохраняются по мере обработки: повторный запуск задачи обработает только недостающие чанки
+            checkpoint = ChunkCheckpoint(document)
+            
+            if is_eager:
+                # В синхронном режиме документ обрабатывается потоковым конвейером в текущем процессе
+                pipeline_stats = {}
+                final_entities = process_doc_pipeline(document.file.path, stats=pipeline_stats, checkpoint=checkpoint)
+                logger.info(f"[Задача {task_id}] Тайминги стадий: {pipeline_stats}")
+                return _complete_document(document, final_entities, checkpoint, task_id, start_time, priority)
+            
+            # Чанки формируются потоково. Пока не набралось DOCUMENT_CHORD_MIN_CHUNKS необработанных чанков,
+            # они накапливаются (небольшой документ обрабатывается в текущей задаче), затем каждый чанк
+            # сразу отправляется воркерам задачей extract_chunk, не дожидаясь окончания загрузки документа
+            min_chunks = getattr(settings, "DOCUMENT_CHORD_MIN_CHUNKS", 4)
+            chunk_hashes = []
+            chunk_tasks = {}
+            pending = []
+            for index, (chunk, _) in enumerate(prepare_document_chunks(document.file.path)):
+                key = chunk_hash(chunk)
+                chunk_hashes.append(key)
+                if key in chunk_tasks or checkpoint.get_by_hash(key) is not None:
+                    continue
+                pending.append((index, chunk))
+                if chunk_tasks or len(pending) >= min_chunks:
+                    for pending_index, pending_chunk in pending:
+                        result = extract_chunk.apply_async(
+                            args=[document_id, pending_index, pending_chunk], priority=priority
+                        )
+                        chunk_tasks[chunk_hash(pending_chunk)] = result.id
+                    pending = []
+            
+            if not chunk_hashes:
+                _fail_document(document, "Не удалось извлечь текст из документа")
+                logger.error(f"[Задача {task_id}] Документ '{document.name}' не содержит текста")
                 return False
-            document.metadata = final_entities
-            document.save(update_fields=['metadata'])
+            
+            if not chunk_tasks:
+                # Для небольших документов распределение чанков по воркерам не окупается
+                logger.info(f"[Задача {task_id}] Документ разбит на {len(chunk_hashes)} чанков, требуют обработки: {len(pending)}")
+                extract_pending_chunks(pending, checkpoint)
+                results = checkpoint.results(chunk_hashes)
+                failed = sum(1 for entities in results if not entities)
+                if failed:
+                    _fail_document(document, f"Не удалось обработать чанков: {failed} из {len(results)}")
+                    logger.error(f"[Задача {task_id}] Документ '{document.name}': не обработано чанков {failed}/{len(results)}")
+                    return False
+                final_entities = finalize_chunk_results(results)
+                return _complete_document(document, final_entities, checkpoint, task_id, start_time, priority)
+            
+            # Шаг 2: Объединение и финализация - задачей finalize_document после завершения задач всех чанков
+            finalize_document.apply_async(
+                args=[document_id, chunk_hashes, start_time, priority, chunk_tasks],
+                countdown=getattr(settings, "DOCUMENT_FINALIZE_POLL_INTERVAL", 5),
+                priority=priority,
+            )
+            logger.info(
+                f"[Задача {task_id}] Документ '{document.name}' разбит на {len(chunk_hashes)} чанков, "
+                f"запущена распределённая обработка {len(chunk_tasks)} чанков"
+            )
+            return True
         except Exception as e:
             error_msg = f"Ошибка при извлечении сущностей: {str(e)}"
-            document.processing_status = 'failed'
-            document.processing_errors = error_msg
-            document.save(update_fields=['processing_status', 'processing_errors'])
+            _fail_document(document, error_msg)
             logger.error(f"[Задача {task_id}] {error_msg}")
             logger.error(traceback.format_exc())
             return False
-            
-        # Успешное завершение обработки
-        document.processing_status = 'success'
-        document.processing_errors = None
-        document.save(update_fields=['processing_status', 'processing_errors'])
-        
-        elapsed_time = time.time() - start_time
-        logger.info(f"[Задача {task_id}] Документ '{document.name}' успешно обработан за {elapsed_time:.2f} сек.")
-        return True
     
     except ObjectDoesNotExist:
         logger.error(f"[Задача {task_id}] Документ с ID {document_id} не найден в базе данных")
@@ -97,3 +217,145 @@ def process_document(self, document_id):
     finally:
         # Закрываем соединения с БД в конце задачи
         db.close_old_connections()
+
+
+def extract_pending_chunks(pending, checkpoint):
+    """Извлекает сущности из чанков небольшого документа параллельно в текущей задаче.
+
+    Аргументы:
+        pending (list): Пары (номер чанка, текст чанка) без сохранённого результата
+        checkpoint (ChunkCheckpoint): Контрольные точки чанков (результаты сохраняются в них)
+    """
+    if not pending:
+        return
+    workers = max(1, min(int(getattr(settings, "LLM_MAX_CONCURRENCY", 4)), len(pending)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-chunk") as executor:
+        list(executor.map(lambda item: extract_chunk_entities_in_thread(*item, checkpoint=checkpoint), pending))
+
+
+@shared_task(bind=True, autoretry_for=(LLMError,), retry_backoff=True, retry_jitter=True,
+             retry_kwargs={'max_retries': 3})
+def extract_chunk(self, document_id, index, chunk):
+    """Задача извлечения сущностей из одного чанка документа (см. process_document).
+
+    Результат сохраняется в контрольной точке DocumentChunk, а возвращается только признак успеха.
+    Временные ошибки LLM (429/5xx, сеть) повторяются с экспоненциальной задержкой; после исчерпания
+    повторов задача завершается с ошибкой, и finalize_document помечает документ как failed.
+    Аргументы:
+        document_id (int): ID документа
+        index (int): Порядковый номер чанка
+        chunk (str): Текст чанка
+    Возвращает:
+        bool: True, если сущности чанка сохранены
+    """
+    task_id = getattr(self.request, 'id', None) or 'direct-mode'
+    db.close_old_connections()
+    try:
+        document = Document.objects.get(id=document_id)
+        checkpoint = ChunkCheckpoint(document, preload=False)
+        entities = checkpoint.extract(
+            index, chunk, lambda i, text: extract_chunk_entities(i, text, raise_retryable=True)
+        )
+        return bool(entities)
+    except ObjectDoesNotExist:
+        logger.error(f"[Задача {task_id}] Документ с ID {document_id} не найден в базе данных")
+        return False
+    except LLMError as e:
+        logger.warning(
+            f"[Задача {task_id}] Временная ошибка LLM при обработке чанка {index+1} документа {document_id} "
+            f"(попытка {self.request.retries + 1}): {str(e)}"
+        )
+        raise
+    except Exception as e:
+        logger.error(f"[Задача {task_id}] Ошибка при обработке чанка {index+1} документа {document_id}: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise
+    finally:
+        db.close_old_connections()
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=True, retry_kwargs={'max_retries': 3})
+def finalize_document(self, document_id, chunk_hashes, start_time=None, priority=None, chunk_tasks=None):
+    """Завершающая задача распределённой обработки документа: объединяет и финализирует результаты чанков.
+
+    Задачи чанков ставятся в очередь по мере разбиения документа, поэтому задача проверяет их
+    завершение и, пока они выполняются, ставит себя в очередь повторно через DOCUMENT_FINALIZE_POLL_INTERVAL.
+    Если после завершения задач результата хотя бы одного чанка нет, документ помечается как failed
+    вместо сохранения частичного результата; повторная обработка продолжится с сохранённых чанков.
+    Аргументы:
+        document_id (int): ID документа
+        chunk_hashes (list): Хэши чанков документа по порядку
+        start_time (float): Время начала обработки документа (для логов и ожидания задач чанков)
+        priority (int): Приоритет задачи связывания с Wikidata
+        chunk_tasks (dict): Хэш чанка -> ID задачи extract_chunk
+    """
+    task_id = getattr(self.request, 'id', None) or 'direct-mode'
+    start_time = start_time or time.time()
+    chunk_tasks = chunk_tasks or {}
+    db.close_old_connections()
+    try:
+        document = Document.objects.get(id=document_id)
+        checkpoint = ChunkCheckpoint(document, preload=False)
+        results = checkpoint.results(chunk_hashes)
+        missing = {key for key, entities in zip(chunk_hashes, results) if not entities}
+        running = [key for key in missing if key in chunk_tasks and not AsyncResult(chunk_tasks[key]).ready()]
+
+        if running and time.time() - start_time < getattr(settings, "DOCUMENT_CHUNKS_TIMEOUT", 3600):
+            logger.info(f"[Задача {task_id}] Документ '{document.name}': ожидается завершение {len(running)} задач чанков")
+            finalize_document.apply_async(
+                args=[document_id, chunk_hashes, start_time, priority, chunk_tasks],
+                countdown=getattr(settings, "DOCUMENT_FINALIZE_POLL_INTERVAL", 5),
+                priority=priority,
+            )
+            return None
+
+        total = len(set(chunk_hashes))
+        if missing:
+            error_msg = f"Не удалось обработать чанков: {len(missing)} из {total}"
+            if running:
+                error_msg += " (превышено время ожидания)"
+            _fail_document(document, error_msg)
+            logger.error(f"[Задача {task_id}] Документ '{document.name}': {error_msg}")
+            return False
+
+        logger.info(f"[Задача {task_id}] Финализация документа '{document.name}': обработано {total} чанков")
+        finalize_stats = {}
+        final_entities = finalize_chunk_results(results, finalize_stats)
+        logger.info(f"[Задача {task_id}] Статистика финализации: {finalize_stats}")
+        return _complete_document(document, final_entities, checkpoint, task_id, start_time, priority)
+
+    except ObjectDoesNotExist:
+        logger.error(f"[Задача {task_id}] Документ с ID {document_id} не найден в базе данных")
+        return False
+
+    except Exception as e:
+        logger.error(f"[Задача {task_id}] Ошибка при финализации документа {document_id}: {str(e)}")
+        logger.error(f"[Задача {task_id}] Трассировка: {traceback.format_exc()}")
+        if 'document' in locals():
+            _fail_document(document, f"Ошибка при финализации: {str(e)}")
+        raise
+    finally:
+        db.close_old_connections()
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=True, retry_kwargs={'max_retries': 3})
+def link_document_wikidata(self, document_id):
+    """Задача связывания метаданных документа с сущностями Wikidata (очередь wikidata).
+
+    Аргументы:
+        document_id (int): ID документа
+    """
+    from apps.enhancer.processing.wikidata_orm import update_document_wikidata_links
+
+    task_id = getattr(self.request, 'id', None) or 'direct-mode'
+    db.close_old_connections()
+    try:
+        document = Document.objects.get(id=document_id)
+        new_links_count = update_document_wikidata_links(document)
+        logger.info(f"[Задача {task_id}] Документ '{document.name}': создано связей с Wikidata: {new_links_count}")
+        return new_links_count
+    except ObjectDoesNotExist:
+        logger.error(f"[Задача {task_id}] Документ с ID {document_id} не найден в базе данных")
+        return 0
+    finally:
+        db.close_old_connections()
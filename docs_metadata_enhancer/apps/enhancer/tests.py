@@ -1,3 +1,552 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import time
+import zipfile
+from datetime import timedelta
+from email.utils import format_datetime
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.accounts.models import User
+
+from apps.enhancer.LLM.client import FakeLLMClient, LLMError
+from apps.enhancer.LLM.entities import extract_entities, finalize_entities
+from apps.enhancer.models import Document, EntityNameIndex
+from apps.enhancer.processing.checkpoints import ChunkCheckpoint, chunk_hash
+from apps.enhancer.processing.entity_index import lookup_entity_name, record_entity_name
+from apps.enhancer.processing.entity_merge import compact_candidates, is_near_duplicate, rank_entities, rank_values
+from apps.enhancer.processing.finalization import (
+    FINAL_LIST_LIMITS, FULL, SHRINK, SKIP, FinalizationPolicy, build_local_result,
+)
+from apps.enhancer.processing.ingest import ArchiveTooLargeError, check_zip_archive, iter_zip_members
+from apps.enhancer.processing.json_repair import METADATA_SCHEMA, conform_to_schema, parse_llm_json, repair_json
+from apps.enhancer.processing.post_processing import extract_chunk_entities, merge_and_finalize_entities, reduce_entities
+from apps.enhancer.processing.stages import IterStage, MapStage, StagedPipeline
+from apps.enhancer.processing.tokens import heuristic_token_count, iter_token_chunks
+from apps.enhancer.processing.wikidata_async import asearch_entities
+from apps.enhancer.processing.wikidata_http import retry_delay as wikidata_retry_delay
+from apps.enhancer.processing.wikidata_orm import entity_cache, fetch_wikidata_entities
+from apps.enhancer.rate_limit import RateLimiter
+from apps.enhancer.tasks import extract_chunk, finalize_document, process_document
+
+
+def _values(candidates):
+    return sorted(candidate["value"] for candidate in candidates)
+
+
+class EntityMergeTests(SimpleTestCase):
+    def test_merges_spelling_variants_of_a_name(self):
+        candidates = rank_values(["Иван Иванов", "Ivan Ivanov", "Иванов Иван", "И. Иванов"], "creator")
+        self.assertEqual(len(candidates), 1)
+        self.assertEqual(candidates[0]["count"], 4)
+
+    def test_merges_word_forms_and_typos_of_a_term(self):
+        candidates = rank_values(["машинное обучение", "машинного обучения", "машиное обучение"], "keywords")
+        self.assertEqual(len(candidates), 1)
+        self.assertEqual(candidates[0]["value"], "машинное обучение")
+
+    def test_initials_do_not_merge_different_first_names(self):
+        values = ["А. Иванов", "Алексей Иванов", "Андрей Иванов"]
+        candidates = rank_values(values, "creator")
+        self.assertEqual(_values(candidates), sorted(values))
+        self.assertEqual(sum(candidate["count"] for candidate in candidates), 3)
+
+    def test_initials_merge_with_a_single_full_name(self):
+        candidates = rank_values(["А. Иванов", "Алексей Иванов", "Иванов Алексей"], "creator")
+        self.assertEqual(len(candidates), 1)
+        self.assertEqual(candidates[0]["count"], 3)
+
+    def test_grouping_does_not_depend_on_order(self):
+        values = ["А. Иванов", "Алексей Иванов", "Андрей Иванов", "Иванов А.", "Алексей Иванов"]
+        expected = sorted((candidate["count"], sorted(candidate["variants"])) for candidate in rank_values(values, "creator"))
+        for permutation in (values[::-1], values[2:] + values[:2], values[1:] + values[:1]):
+            actual = sorted(
+                (candidate["count"], sorted(candidate["variants"])) for candidate in rank_values(permutation, "creator")
+            )
+            self.assertEqual(actual, expected)
+
+    def test_values_with_different_numbers_are_not_merged(self):
+        self.assertEqual(len(rank_values(["Windows 10", "Windows 11"], "keywords")), 2)
+        self.assertEqual(len(rank_values(["ГОСТ 7.32-2017", "ГОСТ 7.32-2001"], "keywords")), 2)
+        self.assertFalse(is_near_duplicate("windows 10", "windows 11", "keywords"))
+        self.assertTrue(is_near_duplicate("windows 10", "windovs 10", "keywords"))
+
+    def test_organizations_use_stricter_threshold(self):
+        self.assertTrue(is_near_duplicate("росгидромет", "росгидрамет", "keywords"))
+        self.assertFalse(is_near_duplicate("росгидромет", "росгидрамет", "organizations"))
+        self.assertEqual(len(rank_values(["Росгидромет", "Росгидрамет"], "organizations")), 2)
+
+    def test_exact_fields_are_not_fuzzy_merged(self):
+        self.assertEqual(len(rank_values(["2020-01-01", "2020-01-02"], "dates")), 2)
+
+    def test_names_are_not_truncated_before_finalization(self):
+        creators = [f"Автор{chr(ord('А') + index)} Фамилия{index:02d}" for index in range(30)]
+        merged = compact_candidates(rank_entities([{"creator": creators}]))
+        self.assertEqual(len(merged["creator"]), 30)
+
+
+class JsonRepairTests(SimpleTestCase):
+    def test_valid_json_is_parsed_without_repair(self):
+        self.assertEqual(repair_json('{"title": "X"}'), ({"title": "X"}, False))
+
+    def test_code_fences_and_trailing_commas_are_removed(self):
+        text = 'Ответ:\n```json\n{"title": "X", "keywords": ["a", "b",],}\n```'
+        self.assertEqual(repair_json(text), ({"title": "X", "keywords": ["a", "b"]}, True))
+
+    def test_truncated_response_is_closed(self):
+        self.assertEqual(repair_json('{"creator": ["Иван", "Пет'), ({"creator": ["Иван", "Пет"]}, True))
+        self.assertEqual(repair_json('{"creator": ["Иван"], "tit'), ({"creator": ["Иван"]}, True))
+
+    def test_unrecoverable_text(self):
+        self.assertEqual(repair_json("нет JSON"), (None, False))
+        self.assertIsNone(parse_llm_json("нет JSON", METADATA_SCHEMA, record=False))
+
+    def test_fields_are_conformed_to_schema(self):
+        data = parse_llm_json('{"keywords": "a", "title": ["X", "Y"], "creator": null}', METADATA_SCHEMA, record=False)
+        self.assertEqual(data, {"keywords": ["a"], "title": "X", "creator": None})
+        self.assertIsNone(conform_to_schema({"unknown": 1}, METADATA_SCHEMA))
+
+
+class TokenChunkTests(SimpleTestCase):
+    @staticmethod
+    def count_words(text):
+        return len(text.split())
+
+    def test_chunks_are_filled_up_to_the_budget(self):
+        chunks = list(iter_token_chunks(["a b c d", "e f g h i j k"], 5, counter=self.count_words))
+        self.assertEqual(chunks, [("a b c d e", 5), ("f g h i j", 5), ("k", 1)])
+
+    def test_overlap_between_chunks(self):
+        chunks = list(iter_token_chunks(["a b c d", "e f g h i j k"], 5, 2, counter=self.count_words))
+        self.assertTrue(all(tokens <= 5 for _, tokens in chunks))
+        for (previous, _), (current, _) in zip(chunks, chunks[1:]):
+            self.assertEqual(previous.split()[-2:], current.split()[:2])
+        self.assertEqual(chunks[-1][0].split()[-1], "k")
+
+    def test_heuristic_token_count(self):
+        self.assertEqual(heuristic_token_count(""), 0)
+        self.assertEqual(heuristic_token_count("a b c"), 3)
+        self.assertGreater(heuristic_token_count("машинное обучение"), heuristic_token_count("ml"))
+
+
+class StagedPipelineTests(SimpleTestCase):
+    def test_results_keep_source_order(self):
+        def slow_square(value):
+            time.sleep(0.001 * (value % 3))
+            return value * value
+
+        pipeline = StagedPipeline([MapStage("square", slow_square, workers=4)], queue_size=2)
+        results, stats = pipeline.run(range(20))
+        self.assertEqual(results, [value * value for value in range(20)])
+        self.assertEqual(stats["square"]["items_in"], 20)
+        self.assertEqual(stats["source"]["items_out"], 20)
+
+    def test_iter_stage_regroups_values(self):
+        def pairs(values):
+            batch = []
+            for value in values:
+                batch.append(value)
+                if len(batch) == 2:
+                    yield tuple(batch)
+                    batch = []
+            if batch:
+                yield tuple(batch)
+
+        pipeline = StagedPipeline([IterStage("pairs", pairs), MapStage("sum", sum, workers=2)])
+        results, _ = pipeline.run(range(5))
+        self.assertEqual(results, [1, 5, 4])
+
+    def test_stage_error_is_raised(self):
+        def fail_on_three(value):
+            if value == 3:
+                raise ValueError("ошибка стадии")
+            return value
+
+        pipeline = StagedPipeline([MapStage("fail", fail_on_three, workers=2)])
+        with self.assertRaisesMessage(ValueError, "ошибка стадии"):
+            pipeline.run(range(10))
+
+    def test_source_error_is_raised(self):
+        def source():
+            yield 1
+            raise OSError("ошибка чтения")
+
+        with self.assertRaises(OSError):
+            StagedPipeline([MapStage("identity", lambda value: value)]).run(source())
+
+
+@override_settings(RATE_LIMIT_BACKEND="local")
+class RateLimiterTests(SimpleTestCase):
+    def limiter(self, limits, burst_seconds=1):
+        return RateLimiter(f"test:{self.id()}", limits, burst_seconds)
+
+    def test_waits_when_bucket_is_empty(self):
+        limiter = self.limiter({"requests": 60})
+        self.assertEqual(limiter.try_acquire("key", requests=1), 0)
+        self.assertGreater(limiter.try_acquire("key", requests=1), 0)
+        self.assertEqual(limiter.try_acquire("other", requests=1), 0)
+
+    def test_charge_makes_balance_negative(self):
+        limiter = self.limiter({"tokens": 600})
+        self.assertEqual(limiter.try_acquire("key", tokens=5), 0)
+        limiter.charge("key", tokens=100)
+        self.assertGreater(limiter.try_acquire("key", tokens=1), 5)
+
+    def test_acquire_timeout(self):
+        limiter = self.limiter({"requests": 60})
+        limiter.acquire("key", requests=1)
+        with self.assertRaises(TimeoutError):
+            limiter.acquire("key", timeout=0.1, requests=1)
+
+    def test_aacquire_waits_for_bucket(self):
+        limiter = self.limiter({"requests": 60})
+        self.assertEqual(asyncio.run(limiter.aacquire("key", requests=1)), 0.0)
+        self.assertGreater(limiter.try_acquire("key", requests=1), 0)
+        with self.assertRaises(TimeoutError):
+            asyncio.run(limiter.aacquire("key", timeout=0.1, requests=1))
+
+    def test_disabled_without_limits(self):
+        limiter = self.limiter({"requests": 0})
+        self.assertFalse(limiter.enabled)
+        for _ in range(10):
+            self.assertEqual(limiter.try_acquire("key", requests=1), 0)
+
+
+class WikidataAsyncSearchTests(SimpleTestCase):
+    def test_unexpected_error_fails_only_its_pair(self):
+        async def search(client, entity_name, entity_type=None):
+            if entity_name == "сломанный ответ":
+                raise KeyError("id")
+            return "Q1"
+
+        with mock.patch("apps.enhancer.processing.wikidata_async.asearch_entity", side_effect=search):
+            outcomes = asyncio.run(asearch_entities([("сломанный ответ", None), ("Москва", None)], 2))
+        self.assertEqual(outcomes, {("сломанный ответ", None): (False, None), ("Москва", None): (True, "Q1")})
+
+
+def _zip_bytes(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for name, content in members.items():
+            zip_file.writestr(name, content)
+    return buffer.getvalue()
+
+
+@override_settings(BULK_INGEST_ZIP_MAX_MEMBERS=3, BULK_INGEST_ZIP_MAX_BYTES=1000)
+class ZipLimitsTests(TestCase):
+    def test_archive_within_limits(self):
+        archive = io.BytesIO(_zip_bytes({"a.txt": "a", "dir/b.pdf": "b"}))
+        self.assertEqual([name for name, _ in iter_zip_members(archive)], ["a.txt", "dir/b.pdf"])
+
+    def test_too_many_members(self):
+        archive = io.BytesIO(_zip_bytes({f"{index}.txt": "x" for index in range(4)}))
+        with self.assertRaises(ArchiveTooLargeError):
+            next(iter_zip_members(archive))
+
+    def test_too_large_after_decompression(self):
+        archive = io.BytesIO(_zip_bytes({"bomb.txt": "0" * 100000}))
+        self.assertLess(len(archive.getvalue()), 1000)
+        with self.assertRaises(ArchiveTooLargeError):
+            check_zip_archive(archive)
+
+    def test_upload_rejects_archive_before_ingest(self):
+        user = User.objects.create_user("uploader@example.com", "password")
+        self.client.force_login(user)
+        archive = SimpleUploadedFile("bomb.zip", _zip_bytes({"bomb.txt": "0" * 100000}))
+        with mock.patch("apps.enhancer.views.ingest_files") as ingest:
+            response = self.client.post(
+                reverse("enhancer:upload_files"), {"files": [archive]}, HTTP_ACCEPT="application/json"
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()["success"])
+        ingest.assert_not_called()
+
+
+@override_settings(WIKIDATA_ENTITY_INDEX_ENABLED=True)
+class EntityNameIndexTests(TestCase):
+    def test_lookup_does_not_change_usage_count(self):
+        record_entity_name("Москва", "concept", "Q649")
+        for _ in range(3):
+            self.assertEqual(lookup_entity_name("москва", "concept"), "Q649")
+        self.assertEqual(EntityNameIndex.objects.get(qid="Q649").usage_count, 1)
+
+    def test_confirmed_links_select_qid(self):
+        record_entity_name("Меркурий", "concept", "Q308")
+        record_entity_name("Меркурий", "concept", "Q925")
+        record_entity_name("Меркурий", "concept", "Q925")
+        for _ in range(3):
+            lookup_entity_name("Меркурий", "concept")
+        self.assertEqual(EntityNameIndex.objects.get(qid="Q925").usage_count, 2)
+        self.assertEqual(lookup_entity_name("Меркурий", "concept"), "Q925")
+
+
+@override_settings(WIKIDATA_LINKER_BACKEND="api")
+class WikidataEntityRefreshTests(TestCase):
+    def setUp(self):
+        entity_cache.clear_local()
+        self.addCleanup(entity_cache.clear_local)
+
+    @staticmethod
+    def api_entity(description):
+        return {"Q1": {"labels": {"ru": {"value": "Москва"}}, "descriptions": {"ru": {"value": description}}}}
+
+    def test_refresh_bypasses_entity_cache(self):
+        with mock.patch("apps.enhancer.processing.wikidata_orm.fetch_wikidata_entities_raw") as fetch:
+            fetch.return_value = self.api_entity("столица России")
+            self.assertEqual(fetch_wikidata_entities(["Q1"])["Q1"]["description_ru"], "столица России")
+            fetch.return_value = self.api_entity("город федерального значения")
+            self.assertEqual(fetch_wikidata_entities(["Q1"])["Q1"]["description_ru"], "столица России")
+            self.assertEqual(fetch.call_count, 1)
+
+            refreshed = fetch_wikidata_entities(["Q1"], refresh=True)
+            self.assertEqual(refreshed["Q1"]["description_ru"], "город федерального значения")
+            self.assertEqual(fetch.call_count, 2)
+        self.assertEqual(fetch_wikidata_entities(["Q1"])["Q1"]["description_ru"], "город федерального значения")
+
+
+@override_settings(LLM_CACHE_ENABLED=False, RATE_LIMIT_BACKEND="local", DOCUMENT_CHORD_MIN_CHUNKS=3)
+class DocumentTaskTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user("owner@example.com", "password")
+        self.document = Document.objects.create(
+            name="Документ", file="docs/document.pdf", file_type="pdf", owner=owner, content_hash="0" * 64,
+        )
+
+    def run_small_document(self, chunks, extracted):
+        # Потоки пула не видят транзакцию теста, поэтому чанки извлекаются последовательно
+        def extract_sequentially(pending, checkpoint):
+            for index, chunk in pending:
+                checkpoint.extract(index, chunk, extract_chunk_entities)
+
+        with mock.patch("apps.enhancer.tasks.prepare_document_chunks", return_value=iter(chunks)), \
+                mock.patch("apps.enhancer.tasks.extract_pending_chunks", side_effect=extract_sequentially), \
+                mock.patch("apps.enhancer.processing.post_processing.extract_entities", side_effect=extracted), \
+                mock.patch.object(extract_chunk, "apply_async") as dispatch:
+            result = process_document.run(self.document.id)
+        dispatch.assert_not_called()
+        return result
+
+    def refresh_status(self):
+        self.document.refresh_from_db()
+        return self.document.processing_status
+
+    def test_chunks_are_dispatched_while_document_is_chunked(self):
+        events = []
+
+        def chunks(path):
+            for index in range(5):
+                events.append(f"chunk {index}")
+                yield f"Текст чанка {index}", 10
+
+        def dispatch(args, priority=None):
+            events.append(f"task {args[1]}")
+            return mock.Mock(id=f"task-{args[1]}")
+
+        with mock.patch("apps.enhancer.tasks.prepare_document_chunks", side_effect=chunks), \
+                mock.patch.object(extract_chunk, "apply_async", side_effect=dispatch), \
+                mock.patch.object(finalize_document, "apply_async") as finalize:
+            self.assertTrue(process_document.run(self.document.id))
+
+        self.assertEqual(events[:5], ["chunk 0", "chunk 1", "chunk 2", "task 0", "task 1"])
+        self.assertEqual(events[-2:], ["chunk 4", "task 4"])
+        args = finalize.call_args.kwargs["args"]
+        self.assertEqual(len(args[1]), 5)
+        self.assertEqual(len(args[4]), 5)
+
+    def test_small_document_is_processed_in_task(self):
+        chunks = [("Первый чанк", 10), ("Второй чанк", 10)]
+        self.assertTrue(self.run_small_document(chunks, [FAKE_ENTITIES, FAKE_ENTITIES]))
+        self.assertEqual(self.refresh_status(), "success")
+
+    def test_small_document_with_failed_chunk_is_not_finalized(self):
+        chunks = [("Первый чанк", 10), ("Второй чанк", 10)]
+        self.assertFalse(self.run_small_document(chunks, [FAKE_ENTITIES, None]))
+        self.assertEqual(self.refresh_status(), "failed")
+        self.assertEqual(ChunkCheckpoint(self.document).results([chunk_hash("Первый чанк")]), [FAKE_ENTITIES])
+
+    def test_extract_chunk_retries_transient_llm_errors(self):
+        error = LLMError("Service Unavailable", status_code=503)
+        with mock.patch("apps.enhancer.processing.post_processing.extract_entities", side_effect=error) as extract:
+            result = extract_chunk.apply(args=[self.document.id, 0, "Текст чанка"])
+        self.assertTrue(result.failed())
+        self.assertEqual(extract.call_count, 4)
+
+    def finalize(self, chunk_tasks, ready):
+        checkpoint = ChunkCheckpoint(self.document)
+        checkpoint.save(0, "Первый чанк", FAKE_ENTITIES)
+        hashes = [chunk_hash("Первый чанк"), chunk_hash("Второй чанк")]
+        with mock.patch("apps.enhancer.tasks.AsyncResult") as async_result, \
+                mock.patch.object(finalize_document, "apply_async") as reschedule:
+            async_result.return_value.ready.return_value = ready
+            result = finalize_document.run(self.document.id, hashes, time.time(), None, chunk_tasks)
+        return result, reschedule
+
+    def test_finalize_waits_for_running_chunks(self):
+        result, reschedule = self.finalize({chunk_hash("Второй чанк"): "task-1"}, ready=False)
+        self.assertIsNone(result)
+        reschedule.assert_called_once()
+        self.assertEqual(self.refresh_status(), "pending")
+
+    def test_finalize_fails_document_with_missing_chunk(self):
+        result, reschedule = self.finalize({chunk_hash("Второй чанк"): "task-1"}, ready=True)
+        self.assertFalse(result)
+        reschedule.assert_not_called()
+        self.assertEqual(self.refresh_status(), "failed")
+        self.assertIn("1 из 2", self.document.processing_errors)
+
+    def test_finalize_completes_document(self):
+        ChunkCheckpoint(self.document).save(1, "Второй чанк", {"keywords": ["термин"]})
+        result, _ = self.finalize({}, ready=True)
+        self.assertTrue(result)
+        self.assertEqual(self.refresh_status(), "success")
+
+
+class FinalizationPolicyTests(SimpleTestCase):
+    def test_single_chunk_is_finalized_locally(self):
+        ranked = rank_entities([{"title": "Заголовок", "keywords": ["a"]}])
+        self.assertEqual(FinalizationPolicy(3, 1000).decide(1, ranked).action, SKIP)
+
+    def test_conflicts_are_sent_to_llm(self):
+        ranked = rank_entities([{"title": "Первый заголовок"}, {"title": "Совсем другой"}])
+        decision = FinalizationPolicy(3, 1000).decide(2, ranked)
+        self.assertEqual(decision.action, SHRINK)
+        self.assertEqual(decision.fields, ["title"])
+
+    def test_large_result_uses_full_finalization(self):
+        ranked = rank_entities([{"title": "Первый заголовок"}, {"title": "Совсем другой"}])
+        self.assertEqual(FinalizationPolicy(3, 1).decide(2, ranked).action, FULL)
+
+    def test_local_result_limits_keywords(self):
+        ranked = rank_entities([{"keywords": [f"термин{index}" for index in range(10)], "title": "X"}])
+        result = build_local_result(ranked)
+        self.assertEqual(len(result["keywords"]), FINAL_LIST_LIMITS["keywords"])
+        self.assertEqual(result["title"], "X")
+        self.assertEqual(result["summary"], "")
+
+
+class WikidataRetryDelayTests(SimpleTestCase):
+    def test_retry_after_seconds(self):
+        self.assertEqual(wikidata_retry_delay(0, "7"), 7.0)
+
+    @override_settings(WIKIDATA_HTTP_MAX_BACKOFF=10)
+    def test_retry_after_is_capped(self):
+        self.assertEqual(wikidata_retry_delay(0, "120"), 10)
+
+    def test_retry_after_http_date(self):
+        retry_at = timezone.now() + timedelta(seconds=30)
+        delay = wikidata_retry_delay(0, format_datetime(retry_at, usegmt=True))
+        self.assertTrue(25 <= delay <= 30)
+        self.assertEqual(wikidata_retry_delay(0, "Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+
+    @override_settings(WIKIDATA_HTTP_BACKOFF=1, WIKIDATA_HTTP_MAX_BACKOFF=60)
+    def test_exponential_backoff_without_header(self):
+        for attempt in range(4):
+            delay = wikidata_retry_delay(attempt, "invalid" if attempt else None)
+            self.assertTrue(2 ** attempt <= delay <= 2 ** attempt + 1)
+
+
+FAKE_ENTITIES = {"title": "Заголовок", "creator": ["Иван Иванов"], "keywords": ["машинное обучение"]}
+
+
+@override_settings(LLM_CACHE_ENABLED=False, RATE_LIMIT_BACKEND="local")
+class LLMExtractionTests(TestCase):
+    def test_extract_entities(self):
+        client = FakeLLMClient(json.dumps(FAKE_ENTITIES, ensure_ascii=False))
+        self.assertEqual(extract_entities("Текст документа", client=client), {**FAKE_ENTITIES, "keywords": ["машинное обучение"]})
+        self.assertEqual(len(client.calls), 1)
+        self.assertEqual(client.calls[0][-1], {"role": "user", "content": "Текст документа"})
+
+    def test_broken_json_is_repaired_locally(self):
+        client = FakeLLMClient('```json\n{"title": "Заголовок", "creator": ["Иван Иванов",\n')
+        self.assertEqual(extract_entities("Текст", client=client), {"title": "Заголовок", "creator": ["Иван Иванов"]})
+        self.assertEqual(len(client.calls), 1)
+
+    def test_unrepairable_json_is_fixed_by_llm(self):
+        responses = iter(["нет JSON", json.dumps(FAKE_ENTITIES, ensure_ascii=False)])
+        client = FakeLLMClient(lambda messages: next(responses))
+        self.assertEqual(extract_entities("Текст", client=client), FAKE_ENTITIES)
+        self.assertEqual(len(client.calls), 2)
+
+    def test_finalize_entities(self):
+        client = FakeLLMClient(json.dumps(FAKE_ENTITIES, ensure_ascii=False))
+        self.assertEqual(finalize_entities({"title": ["A", "B"]}, client=client), FAKE_ENTITIES)
+        self.assertEqual(json.loads(client.calls[0][1]["content"]), {"title": ["A", "B"]})
+
+    def test_acomplete(self):
+        client = FakeLLMClient("ответ")
+        messages = [{"role": "user", "content": "вопрос"}]
+        self.assertEqual(asyncio.run(client.acomplete(messages)), "ответ")
+        self.assertEqual(asyncio.run(client.acomplete(messages)), "ответ")
+
+    @override_settings(LLM_MAX_CONCURRENCY_PER_CREDENTIAL=2)
+    def test_acomplete_limits_concurrency_per_credential(self):
+        class SlowClient(FakeLLMClient):
+            provider = "slow-fake"
+            active = peak = 0
+
+            async def _acomplete(self, messages, temperature, max_tokens):
+                SlowClient.active += 1
+                SlowClient.peak = max(SlowClient.peak, SlowClient.active)
+                await asyncio.sleep(0.01)
+                SlowClient.active -= 1
+                return "ответ"
+
+        async def run():
+            client = SlowClient()
+            messages = [{"role": "user", "content": "вопрос"}]
+            return await asyncio.gather(*(client.acomplete(messages) for _ in range(6)))
+
+        self.assertEqual(asyncio.run(run()), ["ответ"] * 6)
+        self.assertEqual(SlowClient.peak, 2)
+
+    def test_finalization_sends_only_conflicting_fields(self):
+        client = FakeLLMClient(json.dumps({"title": "Итоговый заголовок"}, ensure_ascii=False))
+        entities_list = [
+            {"title": "Первый заголовок", "creator": ["Иван Иванов"]},
+            {"title": "Совсем другой", "creator": ["Иван Иванов"]},
+        ]
+        stats = {}
+        with mock.patch("apps.enhancer.LLM.entities.get_llm_client", return_value=client):
+            result = merge_and_finalize_entities(entities_list, stats=stats, policy=FinalizationPolicy(3, 10000))
+        self.assertEqual(stats["policy"]["action"], SHRINK)
+        self.assertEqual(len(client.calls), 1)
+        self.assertEqual(set(json.loads(client.calls[0][1]["content"])), {"title"})
+        self.assertEqual(result["title"], "Итоговый заголовок")
+        self.assertEqual(result["creator"], ["Иван Иванов"])
+
+    @override_settings(LLM_FINALIZE_FAN_IN=2)
+    def test_reduction_keeps_chunk_frequencies(self):
+        def finalize(merged):
+            # Свёртка группы выбирает первый кандидат, запрос с одним кандидатом завершается ошибкой
+            return {"title": merged["title"][0]} if len(merged["title"]) > 1 else None
+
+        entities_list = [{"title": "Редкий заголовок"}] + [{"title": "Частый заголовок"}] * 3
+        stats = {}
+        with mock.patch("apps.enhancer.processing.post_processing.chunk_token_budget", return_value=5), \
+                mock.patch("apps.enhancer.processing.post_processing.finalize_entities", side_effect=finalize):
+            result = reduce_entities(entities_list, max_workers=1, stats=stats)
+        self.assertEqual(stats["levels"], 2)
+        self.assertEqual(result["title"], "Частый заголовок")
+
+    def test_failed_final_request_falls_back_to_local_result(self):
+        entities_list = [{"title": "Заголовок", "keywords": ["термин"]}, {"keywords": ["термин", "другой"]}]
+        with mock.patch("apps.enhancer.processing.post_processing.finalize_entities", return_value=None):
+            result = reduce_entities(entities_list, max_workers=1)
+        self.assertEqual(result, build_local_result(rank_entities(entities_list)))
+
+    def test_weighted_values_are_ranked_by_count(self):
+        ranked = rank_values([[{"value": "редкий", "count": 1}], [{"value": "частый", "count": 3}], "редкий"])
+        self.assertEqual([(candidate["value"], candidate["count"]) for candidate in ranked],
+                         [("частый", 3), ("редкий", 2)])
+
+    def test_single_chunk_needs_no_llm_call(self):
+        client = FakeLLMClient()
+        with mock.patch("apps.enhancer.LLM.entities.get_llm_client", return_value=client):
+            result = merge_and_finalize_entities([FAKE_ENTITIES])
+        self.assertEqual(result["title"], "Заголовок")
+        self.assertEqual(client.calls, [])
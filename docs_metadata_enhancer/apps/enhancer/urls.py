@@ -16,6 +16,7 @@ urlpatterns = [
     path('delete-folder/', views.delete_folder, name='delete_folder'),
     path('rename-folder/', views.rename_folder, name='rename_folder'),
     path('upload-file/', views.upload_file, name='upload_file'),
+    path('upload-files/', views.upload_files, name='upload_files'),
     path('process/', views.index, name='process'),
     
     
@@ -0,0 +1,18 @@
+import hashlib
+
+
+def compute_file_hash(file):
+    """
+    Вычисляет SHA-256 содержимого файла, читая его по частям.
+    Args:
+        file (File): Загруженный файл (UploadedFile) или FieldFile документа
+    Returns:
+        str: Шестнадцатеричный SHA-256 содержимого файла
+    """
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    # Возвращаем указатель в начало, чтобы файл можно было сохранить после хэширования
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    return sha256.hexdigest()
@@ -2,11 +2,15 @@ import json
 import logging
 import os
 import time
+import zipfile
 from pathlib import Path
 
 from apps.enhancer.loaders.pdf_loader import load_pdf
 from apps.enhancer.LLM.openai.chat_gpt import (finalize_entities,
                                            process_text_with_chatgpt)
+from apps.enhancer.processing.ingest import (
+    ArchiveTooLargeError, check_uploaded_archives, ingest_files, iter_uploaded_files,
+)
 from apps.enhancer.processing.post_processing import merge_entities
 from apps.enhancer.processing.pre_processing import (clean_text,
                                                      remove_stopwords,
@@ -16,7 +20,8 @@ from django.contrib import messages
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse, HttpResponse, FileResponse
 from .models import DocumentEntityRelation, Folder, Document, WikidataEntity
-from .tasks import process_document
+from .tasks import enqueue_document, process_document
+from .utils import compute_file_hash
 from django.views.decorators.csrf import csrf_protect, ensure_csrf_cookie
 from django.template.loader import render_to_string
 from celery.result import AsyncResult
@@ -130,12 +135,16 @@ def upload_file(request):
             
             logger.info(f"Начинаем загрузку файла '{name}' пользователем {request.user.username}")
             
+            # Хэш содержимого вычисляется потоково по частям загрузки и используется для дедупликации
+            content_hash = compute_file_hash(file)
+            
             # Создаем документ
             document = Document.objects.create(
                 name=name,
                 file=file,
                 folder=folder,
-                owner=request.user
+                owner=request.user,
+                content_hash=content_hash
             )
             
             # Проверяем, работает ли Celery в eager режиме (синхронно)
@@ -156,8 +165,8 @@ def upload_file(request):
                     messages.warning(request, f"Файл '{name}' загружен, но при обработке возникли проблемы. Проверьте лог ошибок.")
             else:
                 # Стандартный асинхронный режим
-                # Запускаем фоновую задачу и получаем ее ID
-                task = process_document.delay(document.id)
+                # Запускаем фоновую задачу с приоритетом интерактивной обработки и получаем ее ID
+                task = enqueue_document(document.id, priority=settings.TASK_PRIORITY_INTERACTIVE)
                 task_id = task.id
                 
                 # Обновляем документ с ID задачи Celery
@@ -181,6 +190,71 @@ def upload_file(request):
     
     return redirect('enhancer:file_system')
 
+@login_required
+def upload_files(request):
+    """
+    Загружает несколько файлов и ZIP-архивы за один запрос: документы создаются пачками,
+    обработка ставится в очередь группами задач. Если клиент ожидает JSON (заголовок Accept),
+    возвращается отчёт о загрузке.
+    """
+    if request.method != 'POST':
+        return redirect('enhancer:file_system')
+
+    wants_json = 'application/json' in request.headers.get('Accept', '')
+    files = request.FILES.getlist('files')
+    folder_id = request.POST.get('folder_id')
+
+    def respond():
+        if folder_id:
+            return redirect('enhancer:folder_detail', folder_id=folder_id)
+        return redirect('enhancer:file_system')
+
+    if not files:
+        if wants_json:
+            return JsonResponse({'success': False, 'error': 'Необходимо выбрать файлы'}, status=400)
+        messages.error(request, "Необходимо выбрать файлы")
+        return respond()
+
+    folder = None
+    if folder_id:
+        folder = get_object_or_404(Folder, id=folder_id, owner=request.user)
+
+    try:
+        check_uploaded_archives(files)
+    except (ArchiveTooLargeError, zipfile.BadZipFile) as e:
+        logger.warning(f"Массовая загрузка отклонена для пользователя {request.user.username}: {str(e)}")
+        if wants_json:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        messages.error(request, f"Ошибка при загрузке файлов: {str(e)}")
+        return respond()
+
+    try:
+        logger.info(f"Массовая загрузка {len(files)} файлов пользователем {request.user.username}")
+        stats = ingest_files(
+            iter_uploaded_files(files),
+            request.user,
+            folder=folder,
+            priority=settings.CELERY_TASK_DEFAULT_PRIORITY,
+        )
+        report = stats.report(queue=settings.CELERY_QUEUE_PARSING)
+        logger.info(f"Массовая загрузка завершена: {report}")
+    except Exception as e:
+        logger.error(f"Ошибка при массовой загрузке файлов: {str(e)}", exc_info=True)
+        if wants_json:
+            return JsonResponse({'success': False, 'error': str(e)}, status=500)
+        messages.error(request, f"Ошибка при загрузке файлов: {str(e)}")
+        return respond()
+
+    if wants_json:
+        return JsonResponse({'success': True, 'report': report})
+
+    messages.success(request, f"Загружено документов: {report['created']}, отправлено на обработку: {report['enqueued']}")
+    if report['skipped']:
+        messages.warning(request, f"Пропущено файлов неподдерживаемого типа: {report['skipped']}")
+    if report['errors']:
+        messages.warning(request, f"Не удалось сохранить файлов: {report['errors']}")
+    return respond()
+
 def index(request):
     result = None
     pdf_path = None
@@ -406,16 +480,9 @@ def wikidata_search(request):
         return JsonResponse({'error': 'Необходимо указать поисковый запрос'}, status=400)
     
     try:
-        from apps.enhancer.processing.wikidata import link_to_wikidata
-        import time
-        import requests
-        
-        headers = {
-            "User-Agent": "DocsMetadataEnhancerBot/1.0 (https://example.com; zheny@example.com)"
-        }
+        from apps.enhancer.processing.wikidata_http import WIKIDATA_API_URL, wikidata_get
         
         # Поиск через wbsearchentities
-        search_url = "https://www.wikidata.org/w/api.php"
         params = {
             "action": "wbsearchentities",
             "search": query,
@@ -424,7 +491,7 @@ def wikidata_search(request):
             "format": "json",
             "limit": 10
         }
-        response = requests.get(search_url, params=params, headers=headers)
+        response = wikidata_get(WIKIDATA_API_URL, params, timeout=10)
         response.raise_for_status()
         search_results = response.json().get("search", [])
         
@@ -432,7 +499,7 @@ def wikidata_search(request):
         if not search_results:
             params["language"] = "en"
             params["uselang"] = "en"
-            response = requests.get(search_url, params=params, headers=headers)
+            response = wikidata_get(WIKIDATA_API_URL, params, timeout=10)
             response.raise_for_status()
             search_results = response.json().get("search", [])
         
@@ -570,6 +637,10 @@ def link_entity_to_document(request, document_id):
         if entity_id:
             entity = get_or_create_wikidata_entity(entity_id, entity_name)
             
+            # Запоминаем выбранное пользователем сопоставление в локальном индексе имён
+            from apps.enhancer.processing.entity_index import FIELD_ENTITY_TYPES, record_entity_name
+            record_entity_name(actual_field_value, entity_type or FIELD_ENTITY_TYPES.get(actual_field_key), entity_id)
+            
             # Создаем или обновляем связь с учетом новых полей
             relation, created = DocumentEntityRelation.objects.get_or_create(
                 document=document,
@@ -1042,19 +1113,22 @@ def refresh_entity_descriptions(request, document_id):
     document = get_object_or_404(Document, id=document_id, owner=request.user)
     
     try:
-        from apps.enhancer.processing.wikidata_orm import fetch_wikidata_entity
+        from apps.enhancer.processing.wikidata_orm import fetch_wikidata_entities
         
         # Получаем все уникальные сущности, связанные с документом
-        entities = WikidataEntity.objects.filter(
+        entities = list(WikidataEntity.objects.filter(
             document_relations__document=document
-        ).distinct()
+        ).distinct())
         
         updated_count = 0
         not_found_count = 0
         
+        # Загружаем данные всех сущностей пакетными запросами в обход кэша: пользователь явно запросил обновление
+        entities_data = fetch_wikidata_entities([entity.qid for entity in entities], refresh=True)
+        
         # Обновляем описания каждой сущности
         for entity in entities:
-            entity_data = fetch_wikidata_entity(entity.qid)
+            entity_data = entities_data.get(entity.qid)
             if entity_data:
                 # Обновляем метки
                 if entity_data.get('label_ru') and not entity.label_ru:
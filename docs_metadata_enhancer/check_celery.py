@@ -18,7 +18,7 @@ logger = logging.getLogger(__name__)
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'docs_metadata_enhancer.settings')
 django.setup()
 
-from docs_metadata_enhancer.celery import app as celery_app
+from docs_metadata_enhancer.celery import app as celery_app, get_worker_queues
 from docs_metadata_enhancer.settings import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD
 
 def check_redis_connection():
@@ -84,8 +84,10 @@ def main():
     # Проверка выполнения задач
     if not check_task_execution():
         logger.error("Проверка выполнения задач не пройдена. Возможно, Celery worker не запущен.")
-        logger.info("Попробуйте запустить Celery worker командой:")
-        logger.info("celery -A docs_metadata_enhancer worker --loglevel=info --pool=solo")
+        # Без -Q воркер слушает только очередь по умолчанию, и задачи parsing/llm/wikidata остаются в ожидании
+        logger.info("Попробуйте запустить Celery worker, обслуживающий все очереди, командой:")
+        logger.info(f"celery -A docs_metadata_enhancer worker --loglevel=info --pool=solo -Q {','.join(get_worker_queues())}")
+        logger.info("Для рабочего окружения запустите отдельные воркеры для каждой очереди (см. README.md)")
         return False
     
     logger.info("=== Проверка Celery успешно завершена ===")
@@ -20,6 +20,25 @@ app = Celery('docs_metadata_enhancer')
 # Загружаем настройки из файла settings.py
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
+# Задачи распределяются по очередям (CELERY_TASK_ROUTES в settings.py):
+#   parsing  - загрузка и разбиение документов (CPU, конвертация .doc через soffice)
+#   llm      - извлечение и финализация сущностей (ожидание ответа LLM)
+#   wikidata - связывание с Wikidata (ожидание HTTP-ответов)
+# Рекомендуемый запуск воркеров для каждой очереди:
+#   celery -A docs_metadata_enhancer worker -Q parsing -P prefork -c <число ядер> -n parsing@%h
+#   celery -A docs_metadata_enhancer worker -Q llm -P threads -c 16 -n llm@%h
+#   celery -A docs_metadata_enhancer worker -Q wikidata -P threads -c 8 -n wikidata@%h
+# Для очередей llm и wikidata вместо threads можно использовать -P gevent (требуется пакет gevent).
+
+def get_worker_queues():
+    """Возвращает список всех очередей задач (для воркера, обслуживающего все очереди)."""
+    from django.conf import settings
+    queues = [app.conf.task_default_queue]
+    for route in settings.CELERY_TASK_ROUTES.values():
+        if route['queue'] not in queues:
+            queues.append(route['queue'])
+    return queues
+
 # Проверяем, работает ли Redis
 def check_redis_connection():
     try:
@@ -158,6 +158,67 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GIGACHAT_CREDENTIALS = os.getenv("GIGACHAT_CREDENTIALS")
 
+# Клиент LLM
+# Провайдер по умолчанию: "gigachat", "openai" или "fake" (локальная заглушка без сети)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gigachat")
+GIGACHAT_MODEL = os.getenv("GIGACHAT_MODEL", "GigaChat-2-Max")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+# Таймаут одного запроса к LLM в секундах
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+# Количество повторов при ответах 429/5xx и сетевых ошибках
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+# Базовая задержка экспоненциального повтора в секундах
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", 1.0))
+
+# Ограничение частоты запросов к LLM на одни учётные данные (общее для всех воркеров через Redis)
+# Лимиты в минуту, 0 - без ограничения
+GIGACHAT_REQUESTS_PER_MINUTE = int(os.getenv("GIGACHAT_REQUESTS_PER_MINUTE", 60))
+GIGACHAT_TOKENS_PER_MINUTE = int(os.getenv("GIGACHAT_TOKENS_PER_MINUTE", 0))
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 500))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", 200000))
+# Хранилище лимитов: "redis" (общее, с запасным вариантом в памяти процесса) или "local"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "redis")
+# Допустимый всплеск запросов: ёмкость корзины равна лимиту за столько секунд
+RATE_LIMIT_BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", 10))
+
+# Параллельная обработка чанков LLM
+# Максимум одновременных запросов к LLM из одного процесса воркера
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 4))
+# Максимум одновременных запросов с одними учётными данными в рамках процесса
+LLM_MAX_CONCURRENCY_PER_CREDENTIAL = int(os.getenv("LLM_MAX_CONCURRENCY_PER_CREDENTIAL", 4))
+
+# Размер запросов к LLM в токенах
+# Бюджет токенов промпта (системный промпт + текст чанка), под который заполняются чанки
+LLM_PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", 6000))
+# Перекрытие между соседними чанками в токенах
+LLM_CHUNK_OVERLAP_TOKENS = int(os.getenv("LLM_CHUNK_OVERLAP_TOKENS", 100))
+# Максимальное количество токенов в ответе LLM
+LLM_MAX_OUTPUT_TOKENS = int(os.getenv("LLM_MAX_OUTPUT_TOKENS", 2000))
+# Максимум чанков, при котором финализация без конфликтов выполняется локально без запроса к LLM
+FINALIZE_SKIP_MAX_CHUNKS = int(os.getenv("FINALIZE_SKIP_MAX_CHUNKS", 3))
+# Максимум частичных результатов, сворачиваемых одним запросом иерархической финализации
+LLM_FINALIZE_FAN_IN = int(os.getenv("LLM_FINALIZE_FAN_IN", 8))
+# Порог схожести Jaro-Winkler при локальном объединении терминов с опечатками
+ENTITY_TERM_SIMILARITY = float(os.getenv("ENTITY_TERM_SIMILARITY", 0.96))
+# Порог схожести для названий организаций и издателей (строже: разные организации часто различаются одной буквой)
+ENTITY_ORGANIZATION_SIMILARITY = float(os.getenv("ENTITY_ORGANIZATION_SIMILARITY", 0.98))
+# Счётчик токенов: "heuristic" (локальная оценка) или путь к функции text -> int
+LLM_TOKEN_COUNTER = os.getenv("LLM_TOKEN_COUNTER", "heuristic")
+
+# Кэш ответов LLM (таблица LLMResponseCache)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "True") == "True"
+# Время жизни записи в днях (0 - без ограничения)
+LLM_CACHE_TTL_DAYS = int(os.getenv("LLM_CACHE_TTL_DAYS", 30))
+# Максимальное количество записей, сверх которого удаляются давно не использованные (LRU)
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 50000))
+
+# Конвейер обработки документа (загрузка -> очистка -> чанки -> LLM)
+# Максимальный размер очереди между стадиями (ограничивает память и создаёт backpressure)
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 8))
+# Количество потоков стадии очистки текста
+PIPELINE_CLEAN_WORKERS = int(os.getenv("PIPELINE_CLEAN_WORKERS", 1))
+
 
 # SMTP Configuration
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -188,7 +249,73 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
-CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 3600}
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'visibility_timeout': 3600,
+    # Приоритеты задач в Redis: отдельный список на каждый приоритет 0-9, меньшее значение выбирается раньше
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
+
+# Очереди задач: разбор документов (CPU, prefork), запросы к LLM и к Wikidata (сеть, threads/gevent)
+CELERY_QUEUE_PARSING = os.getenv("CELERY_QUEUE_PARSING", "parsing")
+CELERY_QUEUE_LLM = os.getenv("CELERY_QUEUE_LLM", "llm")
+CELERY_QUEUE_WIKIDATA = os.getenv("CELERY_QUEUE_WIKIDATA", "wikidata")
+CELERY_TASK_ROUTES = {
+    'apps.enhancer.tasks.process_document': {'queue': CELERY_QUEUE_PARSING},
+    'apps.enhancer.tasks.extract_chunk': {'queue': CELERY_QUEUE_LLM},
+    'apps.enhancer.tasks.finalize_document': {'queue': CELERY_QUEUE_LLM},
+    'apps.enhancer.tasks.link_document_wikidata': {'queue': CELERY_QUEUE_WIKIDATA},
+}
+# Приоритеты задач (для Redis 0 - наивысший): интерактивная обработка из интерфейса
+# обгоняет массовую загрузку документов
+TASK_PRIORITY_INTERACTIVE = int(os.getenv("TASK_PRIORITY_INTERACTIVE", 0))
+TASK_PRIORITY_BULK = int(os.getenv("TASK_PRIORITY_BULK", 9))
+CELERY_TASK_DEFAULT_PRIORITY = int(os.getenv("CELERY_TASK_DEFAULT_PRIORITY", 5))
+# Воркер резервирует по одной задаче, иначе приоритеты не учитываются для уже полученных задач
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# Размер пачки при массовой загрузке документов (bulk_create и постановка задач в очередь)
+BULK_INGEST_BATCH_SIZE = int(os.getenv("BULK_INGEST_BATCH_SIZE", 100))
+# Ограничения ZIP-архива при массовой загрузке (защита от ZIP-бомб): количество файлов
+# и суммарный размер после распаковки в байтах, 0 - без ограничения
+BULK_INGEST_ZIP_MAX_MEMBERS = int(os.getenv("BULK_INGEST_ZIP_MAX_MEMBERS", 10000))
+BULK_INGEST_ZIP_MAX_BYTES = int(os.getenv("BULK_INGEST_ZIP_MAX_BYTES", 2 * 1024 ** 3))
+# Ограничение частоты запросов к Wikidata (в минуту, общее для всех воркеров через Redis), 0 - без ограничения
+WIKIDATA_REQUESTS_PER_MINUTE = int(os.getenv("WIKIDATA_REQUESTS_PER_MINUTE", 200))
+WIKIDATA_SPARQL_REQUESTS_PER_MINUTE = int(os.getenv("WIKIDATA_SPARQL_REQUESTS_PER_MINUTE", 30))
+# Кэш запросов к Wikidata: LRU в памяти процесса и общая таблица WikidataLookupCache
+# Время жизни записей в секундах: найденные значения, отсутствующие значения, ошибки запросов
+WIKIDATA_CACHE_POSITIVE_TTL = int(os.getenv("WIKIDATA_CACHE_POSITIVE_TTL", 30 * 24 * 3600))
+WIKIDATA_CACHE_NEGATIVE_TTL = int(os.getenv("WIKIDATA_CACHE_NEGATIVE_TTL", 24 * 3600))
+WIKIDATA_CACHE_FAILURE_TTL = int(os.getenv("WIKIDATA_CACHE_FAILURE_TTL", 300))
+# Максимальное количество записей в памяти процесса (для каждого вида запросов)
+WIKIDATA_CACHE_LOCAL_MAX_ENTRIES = int(os.getenv("WIKIDATA_CACHE_LOCAL_MAX_ENTRIES", 10000))
+# Искать Q-идентификаторы в локальном индексе ранее связанных имён до запросов к Wikidata
+WIKIDATA_ENTITY_INDEX_ENABLED = os.getenv("WIKIDATA_ENTITY_INDEX_ENABLED", "True") == "True"
+# Источник связывания с Wikidata: "api" (API, при ошибке сети - локальное хранилище из дампа),
+# "offline" (только локальное хранилище, без сетевых запросов) или "hybrid" (сначала хранилище, затем API)
+WIKIDATA_LINKER_BACKEND = os.getenv("WIKIDATA_LINKER_BACKEND", "api")
+# Максимум одновременных запросов к API Wikidata при связывании сущностей документа
+WIKIDATA_MAX_CONCURRENCY = int(os.getenv("WIKIDATA_MAX_CONCURRENCY", 8))
+# HTTP-клиент Wikidata: размер пула соединений процесса, таймауты подключения и чтения (сек),
+# количество повторов и задержки повторов (сек) при 429/5xx, maxlag и ошибках соединения
+WIKIDATA_HTTP_POOL_SIZE = int(os.getenv("WIKIDATA_HTTP_POOL_SIZE", 10))
+WIKIDATA_HTTP_CONNECT_TIMEOUT = float(os.getenv("WIKIDATA_HTTP_CONNECT_TIMEOUT", 5))
+WIKIDATA_HTTP_TIMEOUT = float(os.getenv("WIKIDATA_HTTP_TIMEOUT", 30))
+WIKIDATA_HTTP_MAX_RETRIES = int(os.getenv("WIKIDATA_HTTP_MAX_RETRIES", 3))
+WIKIDATA_HTTP_BACKOFF = float(os.getenv("WIKIDATA_HTTP_BACKOFF", 1))
+WIKIDATA_HTTP_MAX_BACKOFF = float(os.getenv("WIKIDATA_HTTP_MAX_BACKOFF", 60))
+# Параметр maxlag запросов к API Wikidata (сек отставания реплик; 0 - не передавать)
+WIKIDATA_MAXLAG = int(os.getenv("WIKIDATA_MAXLAG", 5))
+# Запускать связывание с Wikidata (очередь wikidata) после успешного извлечения метаданных
+WIKIDATA_LINK_AFTER_PROCESSING = os.getenv("WIKIDATA_LINK_AFTER_PROCESSING", "False") == "True"
+# Минимальное количество необработанных чанков, при котором чанки документа распределяются
+# по воркерам отдельными задачами extract_chunk; документы меньше обрабатываются в одной задаче
+DOCUMENT_CHORD_MIN_CHUNKS = int(os.getenv("DOCUMENT_CHORD_MIN_CHUNKS", 4))
+# Интервал (сек), с которым finalize_document проверяет завершение задач чанков документа
+DOCUMENT_FINALIZE_POLL_INTERVAL = int(os.getenv("DOCUMENT_FINALIZE_POLL_INTERVAL", 5))
+# Максимальное время (сек) ожидания задач чанков, после которого документ помечается как failed
+DOCUMENT_CHUNKS_TIMEOUT = int(os.getenv("DOCUMENT_CHUNKS_TIMEOUT", 3600))
 
 # Настройки логирования
 LOGGING = {